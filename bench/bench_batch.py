@@ -0,0 +1,82 @@
+#!/usr/bin/python3
+#
+# Benchmark of a scene sent to riod.py as single commands and as one batch
+# Starts a simulated RIO device (riosim.py) and riod.py, then switches all zones of the
+# controllers on a source at a volume: once with one GET /cmd per zone and action, once with
+# zone=1,2,... per action and once as one POST /cmd with a JSON list. Reports the time until the
+# simulator received all commands, the HTTP round trips and the writes to the RIO connection.
+#
+# Usage: bench_batch.py [-c 2] [-r 20] [--webport 18080]
+
+import http.client
+import json
+import optparse
+import time
+
+import loadtest
+import suite
+
+def scene(controllers, zones, source, volume):
+	return [{"controller": c, "zone": z, "action": action, "source": source, "volume": volume}
+		for c in range(1, controllers + 1) for z in range(1, zones + 1) for action in ("on", "volume")]
+
+def query(command):
+	return '&'.join('%s=%s' % (key, ','.join(str(v) for v in value) if isinstance(value, list) else value)
+		for key, value in command.items())
+
+# Send the requests of a scene, returns the duration until the simulator received all
+# RIO commands, the number of round trips and of writes to the RIO connection
+def run(port, sim, requests, expected):
+	client=suite.Client(port)
+	writes=client.json('/status')["CommandWriter"]["Writes"]
+	received=len(sim.received)
+
+	conn=http.client.HTTPConnection('127.0.0.1', port, timeout=10)
+	start=time.perf_counter()
+	for method, path, body in requests:
+		conn.request(method, path, body=body)
+		response=conn.getresponse()
+		response.read()
+		if response.status != 200:
+			raise RuntimeError("%s %s: %d" % (method, path, response.status))
+
+	while len(sim.received) < received + expected:
+		time.sleep(0.0005)
+	duration=time.perf_counter() - start
+	conn.close()
+
+	return duration, len(requests), client.json('/status')["CommandWriter"]["Writes"] - writes
+
+def main():
+	parser=optparse.OptionParser()
+	parser.add_option('-c', '--controllers', dest="controllers", default=2, type="int")
+	parser.add_option('-r', '--repeat', dest="repeat", default=20, type="int")
+	parser.add_option('--webport', dest="webport", default=18080, type="int")
+	options, remainder=parser.parse_args()
+
+	process, sim=loadtest.startDaemon(options.webport, options.controllers)
+	try:
+		suite.waitConnected(suite.Client(options.webport), sim)
+
+		commands=scene(options.controllers, sim.zones, 2, 20)
+		zones=list(range(1, sim.zones + 1))
+		variants=[
+			("single", [('GET', '/cmd?' + query(command), None) for command in commands]),
+			("zone list", [('GET', '/cmd?' + query({"controller": c, "zone": zones, "action": action, "source": 2, "volume": 20}), None)
+				for c in range(1, options.controllers + 1) for action in ("on", "volume")]),
+			("batch", [('POST', '/cmd', json.dumps(commands))]),
+		]
+
+		print("Scene: %d controllers, %d zones, %d RIO commands, %d runs" % (options.controllers,
+			sim.zones, len(commands), options.repeat))
+		print("%-10s %10s %12s %12s" % ("", "ms", "round trips", "RIO writes"))
+		for name, requests in variants:
+			results=[run(options.webport, sim, requests, len(commands)) for r in range(options.repeat)]
+			print("%-10s %10.2f %12d %12.1f" % (name, sorted(r[0] for r in results)[len(results) // 2] * 1000,
+				results[0][1], sum(r[2] for r in results) / len(results)))
+	finally:
+		process.terminate()
+		process.wait()
+
+if __name__ == "__main__":
+	main()
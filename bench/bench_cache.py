@@ -0,0 +1,86 @@
+#!/usr/bin/python3
+#
+# Benchmark of the parse cache of riod.py on the lines of a tuner source: RDS radioText and
+# programServiceName repeat a few strings every couple of seconds, mixed with zone changes.
+# Compares decoding and parsing every line with ParseCache and processLines without cache
+# (size 0) with the default cache. With -f, the lines of a recording or capture are used.
+#
+# Usage: bench_cache.py [-f burst.txt|riod.cap] [-n 20000] [-s 1024] [-r 20]
+
+import optparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+import riod
+import riosim
+
+TEXTS=["Now playing: Song %d by Artist %d" % (i, i % 7) for i in range(12)]
+NAMES=["RADIO %d" % i for i in range(3)]
+
+# RDS lines of a tuner, one zone change every 20 lines
+def tunerLines(count):
+	rnd=random.Random(1)
+	lines=[]
+	for i in range(count):
+		if i % 20 == 0:
+			lines.append('N C[1].Z[%d].volume="%d"' % (rnd.randint(1, 8), rnd.randint(0, 50)))
+		elif i % 3 == 0:
+			lines.append('N S[1].programServiceName="%s"' % rnd.choice(NAMES))
+		else:
+			lines.append('N S[1].radioText="%s"' % rnd.choice(TEXTS))
+	return [line.encode('iso-8859-15') for line in lines]
+
+def measure(function, lines, repeat):
+	start=time.perf_counter()
+	for r in range(repeat):
+		function(lines)
+	return len(lines) * repeat / (time.perf_counter() - start)
+
+def main():
+	parser=optparse.OptionParser()
+	parser.add_option('-f', '--file', dest="file")
+	parser.add_option('-n', '--lines', dest="lines", default=20000, type="int")
+	parser.add_option('-s', '--size', dest="size", default=1024, type="int")
+	parser.add_option('-r', '--repeat', dest="repeat", default=20, type="int")
+	options, remainder=parser.parse_args()
+
+	if options.file:
+		lines=[line.encode('iso-8859-15') for stamp, line in riosim.loadRecording(options.file)]
+	else:
+		lines=tunerLines(options.lines)
+
+	def uncached(lines):
+		for line in lines:
+			riod.parseNotification(riod.checkCharSet(line))
+
+	cache=riod.ParseCache(options.size)
+	def cached(lines):
+		for line in lines:
+			cache.get(line)
+
+	print("Lines: %d, distinct: %d, runs: %d, cache size: %d" % (len(lines), len(set(lines)), options.repeat, options.size))
+	decode=measure(uncached, lines, options.repeat)
+	lookup=measure(cached, lines, options.repeat)
+	print("checkCharSet + parseNotification : %10.0f lines/s" % decode)
+	print("ParseCache.get                   : %10.0f lines/s (x%.1f), hits %d, misses %d" % (lookup, lookup / decode,
+		cache.hits, cache.misses))
+
+	device=riod.Device("default", "127.0.0.1")
+	device.publisher=riod.SnapshotPublisher({}, {"ZoneConfig": device.state.zonesJSON, "SourceConfig": device.state.sourcesJSON})
+	def process(lines):
+		riod.processLines(device, lines)
+		device.publisher.patches.clear()
+
+	results=[]
+	for size in (0, options.size):
+		riod.parseCache=riod.ParseCache(size)
+		results.append(measure(process, lines, options.repeat))
+	print("processLines without cache       : %10.0f lines/s" % results[0])
+	print("processLines with cache          : %10.0f lines/s (x%.1f), hit rate %.1f%%" % (results[1], results[1] / results[0],
+		100.0 * riod.parseCache.hits / max(1, riod.parseCache.hits + riod.parseCache.misses)))
+
+if __name__ == "__main__":
+	main()
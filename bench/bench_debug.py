@@ -0,0 +1,111 @@
+#!/usr/bin/python3
+#
+# Benchmark of the debug output in the read loop of riod.py
+# Processes the lines of a recorded burst (burst.txt) with processLines at debug level 0
+# and compares it with the former loop, which built every debug message (e.g.
+# json.dumps(SourceConfig) for each source notification) before the level was checked.
+# Runs alternate between the burst and a copy with every value changed and the parse cache
+# is disabled, so every line is decoded, parsed and applied like by the former loop and
+# none is skipped as unchanged.
+#
+# Usage: bench_debug.py [-f burst.txt] [-r 200] [-d 0]
+
+import json
+import optparse
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+import riod
+
+# Read loop as done by watchRussound up to V1.22, every message is built before the level is
+# checked. The state is updated as by processLines.
+def legacyProcess(device, lines):
+	State=device.state
+	publisher=device.publisher
+	debugFunction=riod.debugFunction
+
+	for line in lines:
+		if len(line) > 0:
+			line=riod.checkCharSet(line)
+			event=riod.parseNotification(line)
+
+			if event is None:
+				if line[0] == 'N':
+					debugFunction(0, "ERROR: " + line)
+
+			elif event.kind == riod.EVENT_ZONE:
+				c=int(event.controller)
+				z=int(event.index)
+				debugFunction(2, "ZONE: %s, Attr: %s, Current:%s" % (event.index, event.attribute,
+					json.dumps(State.zone(c, z) and State.zone(c, z).currentSource)))
+
+				publisher.change("ZoneConfig", State.setZone(c, z, event.attribute, event.value))
+				zone=State.zone(c, z)
+				debugFunction(2, "ZONE: " + line)
+
+				if event.attribute == "status" and event.value == "OFF" and zone.turnOnVolume is not None:
+					publisher.change("ZoneConfig", State.setZone(c, z, "volume", zone.turnOnVolume))
+					debugFunction(0, "ZONE " + event.index + ": Set Volume to " + zone.volume)
+				if event.attribute == "status" or event.attribute == "currentSource":
+					for change in riod.countActiveSources(State):
+						publisher.change("SourceConfig", change)
+
+			elif event.kind == riod.EVENT_SOURCE:
+				debugFunction(3, "SOURCECONFIG: " + json.dumps(State.sourcesJSON()))
+				change=State.setSource(int(event.index), event.attribute, event.value)
+				publisher.change("SourceConfig", change)
+				debugFunction(2, "SOURCE: " + line)
+
+			elif event.attribute == "status":
+				debugFunction(0, "SYSTEM: " + line)
+
+			else:
+				debugFunction(1, "SYSTEM: " + line)
+
+# The lines with every value of a notification changed, e.g. volume="20" to volume="20x"
+def changedLines(lines):
+	return [re.sub(rb'="(.*)"$', rb'="\1x"', line) for line in lines]
+
+# Every run changes all values of the previous one
+def measure(process, device, bursts, repeat):
+	start=time.perf_counter()
+	for r in range(repeat):
+		process(device, bursts[r % 2])
+		device.publisher.patches.clear()
+	return len(bursts[0]) * repeat / (time.perf_counter() - start)
+
+def main():
+	parser=optparse.OptionParser()
+	parser.add_option('-f', '--file', dest="file",
+		default=os.path.join(os.path.dirname(os.path.realpath(__file__)), 'burst.txt'))
+	parser.add_option('-r', '--repeat', dest="repeat", default=200, type="int")
+	parser.add_option('-d', '--debug', dest="debugLevel", default=0, type="int")
+	options, remainder=parser.parse_args()
+
+	with open(options.file, 'rb') as f:
+		lines=[line.rstrip(b'\r\n') for line in f if line.strip()]
+
+	# Debug output to stdout at the given level, messages are written by the DebugLog thread
+	# of riod.py, which isn't started here, so they are only queued
+	riod.debugTarget=2
+	riod.debugLevel=options.debugLevel
+	riod.parseCache=riod.ParseCache(0)
+	device=riod.Device("default", "127.0.0.1")
+	device.publisher=riod.SnapshotPublisher({}, {"ZoneConfig": device.state.zonesJSON, "SourceConfig": device.state.sourcesJSON})
+
+	# Fill the state first with the changed values, so the first run changes them again
+	bursts=[lines, changedLines(lines)]
+	riod.processLines(device, bursts[1])
+
+	legacy=measure(legacyProcess, device, bursts, options.repeat)
+	current=measure(riod.processLines, device, bursts, options.repeat)
+
+	print("Lines: %d, runs: %d, debug level: %d" % (len(lines), options.repeat, options.debugLevel))
+	print("legacy eager messages : %10.0f lines/s" % legacy)
+	print("processLines          : %10.0f lines/s (x%.1f)" % (current, current / legacy))
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,84 @@
+#!/usr/bin/python3
+#
+# Benchmark of the topology discovery of riod.py against a simulated RIO device
+# with configurable latency. Compares the pipelined discoverTopology with the former
+# sequential discovery (one request, one recv).
+#
+# Usage: bench_discovery.py [-l 0.005,0.02,0.05] [-c 1,3,6] [-r 3]
+
+import optparse
+import os
+import socket
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+import riod
+import riosim
+
+# Discovery as done by connectRussound up to V1.19
+def legacyDiscovery(s, controllers):
+	zones={}
+	s.send('VERSION\r'.encode())
+	res = s.recv(1024).decode().split('"')
+
+	for c in controllers:
+		s.send(('GET C[' + str(c) + '].type\r').encode())
+		res = s.recv(1024).decode().split('"')
+
+		zones[c]=0
+		while True:
+			s.send(('GET C[' + str(c) + '].Z[' + str(zones[c]+1) + '].name\r').encode())
+			res = s.recv(1024).decode()
+			if res[0] == 'S':
+				zones[c] += 1
+			else:
+				break
+
+	sources=0
+	while True:
+		s.send(('GET S[' + str(sources+1) + '].name\r').encode())
+		res = s.recv(1024).decode()
+		if res[0] == 'S':
+			sources += 1
+		else:
+			break
+
+	return zones, sources
+
+def pipelinedDiscovery(s, controllers):
+	discovery=riod.discoverTopology(s, controllers)
+	return discovery.zones, discovery.sources
+
+def measure(discover, port, controllers, repeat):
+	best=None
+	for r in range(repeat):
+		s=socket.create_connection(('127.0.0.1', port))
+		start=time.perf_counter()
+		result=discover(s, controllers)
+		duration=time.perf_counter() - start
+		s.close()
+		best=duration if best is None else min(best, duration)
+	return best, result
+
+def main():
+	parser=optparse.OptionParser()
+	parser.add_option('-l', '--latency', dest="latency", default="0.005,0.02,0.05")
+	parser.add_option('-c', '--controllers', dest="controllers", default="1,3,6")
+	parser.add_option('-r', '--repeat', dest="repeat", default=3, type="int")
+	options, remainder=parser.parse_args()
+
+	print("%-8s %-12s %12s %12s %8s" % ("latency", "controllers", "sequential", "pipelined", "speedup"))
+	for latency in [float(l) for l in options.latency.split(',')]:
+		for count in [int(c) for c in options.controllers.split(',')]:
+			sim=riosim.RIOSimulator(0, count, 8, 6, model="MCA-88", latency=latency).start()
+			controllers=[str(c) for c in range(1, count + 1)]
+
+			legacy, expected=measure(legacyDiscovery, sim.port, controllers, options.repeat)
+			pipelined, result=measure(pipelinedDiscovery, sim.port, controllers, options.repeat)
+
+			print("%-8s %-12d %10.0fms %10.0fms %7.1fx %s" % (str(latency * 1000) + "ms", count,
+				legacy * 1000, pipelined * 1000, legacy / pipelined, "" if result == expected else "MISMATCH"))
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,117 @@
+#!/usr/bin/python3
+#
+# Microbenchmark for the RIO line framer of riod.py
+# A recorded notification burst (burst.txt, one RIO line per text line) is fed
+# through RIOFramer split into chunks of arbitrary size. Every run is verified
+# against the recorded lines, so a line cut at a chunk boundary is detected.
+# With a capture file of riod.py, the chunks are also fed as they were received.
+#
+# Usage: bench_framer.py [-f burst.txt|riod.cap] [-c 1,7,100,1024,65536] [-r 200]
+
+import optparse
+import os
+import socket
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+import riod
+import riosim
+
+def loadBurst(filename):
+	lines=[line.encode('iso-8859-15') for stamp, line in riosim.loadRecording(filename)]
+
+	return lines, b''.join(line + b'\r\n' for line in lines)
+
+# Received chunks of a capture file, an incomplete line at a reconnect is dropped
+def loadChunks(filename):
+	chunks=[]
+	for stamp, direction, data in riosim.readCapture(filename):
+		if direction == riosim.CAPTURE_CONNECT:
+			chunks.append(None)
+		elif direction == riosim.CAPTURE_RECEIVED:
+			chunks.append(data)
+	return chunks
+
+# Legacy behaviour: each recv(1024) chunk is split on its own
+def legacySplit(data, chunksize):
+	lines=[]
+	for i in range(0, len(data), chunksize):
+		lines += [line for line in data[i:i+chunksize].split(b'\r\n') if len(line) > 0]
+	return lines
+
+def runFeed(data, chunksize, repeat, chunks=None):
+	if chunks is None:
+		chunks=[data[i:i+chunksize] for i in range(0, len(data), chunksize)]
+	framer=riod.RIOFramer()
+
+	lines=[]
+	start=time.perf_counter()
+	for r in range(repeat):
+		lines=[]
+		framer.reset()
+		for chunk in chunks:
+			if chunk is None:
+				framer.reset()
+			else:
+				lines += framer.feed(chunk)
+	duration=time.perf_counter() - start
+
+	return lines, duration
+
+# Whole burst through a socket pair, read with recv_into as in watchRussound
+def runSocket(data, expected, repeat):
+	framer=riod.RIOFramer()
+	reader, writer=socket.socketpair()
+	writer.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, len(data) * 2)
+	reader.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, len(data) * 2)
+
+	syscalls=0
+	start=time.perf_counter()
+	for r in range(repeat):
+		writer.sendall(data)
+		lines=[]
+		while len(lines) < expected:
+			lines += framer.recv(reader)
+			syscalls += 1
+	duration=time.perf_counter() - start
+
+	reader.close()
+	writer.close()
+	return lines, duration, syscalls / repeat
+
+def main():
+	parser=optparse.OptionParser()
+	parser.add_option('-f', '--file', dest="file",
+		default=os.path.join(os.path.dirname(os.path.realpath(__file__)), 'burst.txt'))
+	parser.add_option('-c', '--chunks', dest="chunks", default="1,7,100,1024,4096,65536")
+	parser.add_option('-r', '--repeat', dest="repeat", default=200, type="int")
+	options, remainder=parser.parse_args()
+
+	reference, data=loadBurst(options.file)
+	print("Burst: %d lines, %d bytes, %d runs" % (len(reference), len(data), options.repeat))
+	print("%-10s %12s %12s %10s %14s" % ("chunk", "lines/s", "MB/s", "framer", "legacy split"))
+
+	for chunksize in [int(c) for c in options.chunks.split(',')]:
+		lines, duration=runFeed(data, chunksize, options.repeat)
+		broken=len([line for line in legacySplit(data, chunksize) if line not in reference])
+		print("%-10d %12.0f %12.2f %10s %8d broken" % (chunksize,
+			len(lines) * options.repeat / duration,
+			len(data) * options.repeat / duration / 1e6,
+			"ok" if lines == reference else "MISMATCH", broken))
+
+	if riosim.isCapture(options.file):
+		lines, duration=runFeed(data, 0, options.repeat, loadChunks(options.file))
+		print("%-10s %12.0f %12.2f %10s" % ("captured",
+			len(lines) * options.repeat / duration,
+			len(data) * options.repeat / duration / 1e6,
+			"ok" if lines == reference else "MISMATCH"))
+
+	lines, duration, syscalls=runSocket(data, len(reference), options.repeat)
+	print("socket     %12.0f %12.2f %10s %8.1f recv per burst" % (
+		len(lines) * options.repeat / duration,
+		len(data) * options.repeat / duration / 1e6,
+		"ok" if lines == reference else "MISMATCH", syscalls))
+
+if __name__ == "__main__":
+	main()
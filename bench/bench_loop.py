@@ -0,0 +1,88 @@
+#!/usr/bin/python3
+#
+# Benchmark of the event loop of riod.py against the former thread per service
+# ([Common] EventLoop=0). riod.py is started against the simulated RIO device in both
+# architectures and reports resident memory, threads, CPU while idle, the latency of a
+# notification until the UDP delta patch, of /zoneconfig and, with --mqtt host:port of a
+# running broker, of the MQTT /Get round trip.
+#
+# Usage: bench_loop.py [-i 10] [-n 200] [--mqtt localhost:1883] [--webport 18095]
+
+import optparse
+import os
+import socket
+import time
+
+import loadtest
+import suite
+
+def procStatus(pid):
+	status={}
+	with open('/proc/%d/status' % pid) as f:
+		for line in f:
+			name, sep, value=line.partition(':')
+			status[name]=value.strip()
+	return status
+
+# CPU seconds (user + system) of a process
+def cpuTime(pid):
+	with open('/proc/%d/stat' % pid) as f:
+		fields=f.read().rpartition(')')[2].split()
+	return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+
+def measure(eventLoop, options, mqtt):
+	udp=socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+	udp.bind(('127.0.0.1', 0))
+	extra="\n[RemoteTargets]\nZoneConfig=udp:127.0.0.1:%d:delta\n" % udp.getsockname()[1]
+
+	process, sim=loadtest.startDaemon(options.webport, 2, extra=extra, common="EventLoop=%d\n" % eventLoop, mqtt=mqtt)
+	client=suite.Client(options.webport)
+	result={}
+
+	try:
+		suite.waitConnected(client, sim)
+
+		start=cpuTime(process.pid)
+		time.sleep(options.idle)
+		result["idle"]=(cpuTime(process.pid) - start) / options.idle * 100
+
+		status=procStatus(process.pid)
+		result["rss"]=int(status["VmRSS"].split()[0]) / 1024
+		result["threads"]=int(status["Threads"])
+
+		result["latency"]=sorted(suite.testLatency(client, sim, udp, options.count))
+		result["http"]=sorted(suite.measureHTTP(client, ['/zoneconfig'], 3)['/zoneconfig'])
+		if mqtt:
+			result["mqtt"]=sorted(suite.testMQTT(mqtt[0], mqtt[1], mqtt[2], options.count))
+	finally:
+		process.terminate()
+		process.wait()
+		udp.close()
+
+	return result
+
+def main():
+	parser=optparse.OptionParser()
+	parser.add_option('-i', '--idle', dest="idle", default=10, type="float")
+	parser.add_option('-n', '--count', dest="count", default=200, type="int")
+	parser.add_option('--mqtt', dest="mqtt")
+	parser.add_option('--webport', dest="webport", default=18095, type="int")
+	options, remainder=parser.parse_args()
+
+	mqtt=None
+	if options.mqtt:
+		host, sep, port=options.mqtt.partition(':')
+		mqtt=(host, int(port or 1883), "riodbench")
+
+	results=[("threads", measure(0, options, mqtt)), ("event loop", measure(1, options, mqtt))]
+
+	print()
+	print("%-12s %8s %8s %9s %22s %22s %22s" % ("", "RSS MB", "threads", "idle CPU",
+		"UDP patch p50/p99 ms", "/zoneconfig p50/p99", "MQTT /Get p50/p99"))
+	for name, result in results:
+		latencies=["%9.2f / %-9.2f" % (loadtest.percentile(result[key], 50) * 1000, loadtest.percentile(result[key], 99) * 1000)
+			if result.get(key) else "%22s" % "-" for key in ("latency", "http", "mqtt")]
+		print("%-12s %8.1f %8d %8.2f%% %s %s %s" % (name, result["rss"], result["threads"], result["idle"], *latencies))
+
+if __name__ == "__main__":
+	main()
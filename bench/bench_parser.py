@@ -0,0 +1,69 @@
+#!/usr/bin/python3
+#
+# Benchmark of the notification parser of riod.py
+# Compares parseNotification with the former re.search/re.split chain of
+# watchRussound on the lines of a recorded burst (burst.txt) or a capture file of riod.py.
+#
+# Usage: bench_parser.py [-f burst.txt|riod.cap] [-r 200]
+
+import optparse
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+import riod
+import riosim
+
+# Classification as done by watchRussound up to V1.10
+def legacyParse(line):
+	if line[0] == 'N':
+		if re.search(r'N System.status\="(.*)"$', line):
+			res=re.split(r'N System.status\="(.*)"$', line, 0);
+			return ("system", None, None, "status", res[1])
+
+		elif re.search(r'N C\[(\d)\]\.Z\[(\d)\]\.(\w+)\="(.*)"$', line):
+			res=re.split(r'N C\[(\d)\]\.Z\[(\d)\]\.(\w+)\="(.*)"$', line, 0);
+			return ("zone", res[1], res[2], res[3], res[4])
+
+		elif re.search(r'N S\[(\d)\]\.(\w+)\="(.*)"$', line):
+			res=re.split(r'N S\[(\d)\]\.(\w+)\="(.*)"$', line, 0);
+			return ("source", None, res[1], res[2], res[3])
+
+	return None
+
+def measure(parse, lines, repeat):
+	start=time.perf_counter()
+	for r in range(repeat):
+		for line in lines:
+			parse(line)
+	return len(lines) * repeat / (time.perf_counter() - start)
+
+def main():
+	parser=optparse.OptionParser()
+	parser.add_option('-f', '--file', dest="file",
+		default=os.path.join(os.path.dirname(os.path.realpath(__file__)), 'burst.txt'))
+	parser.add_option('-r', '--repeat', dest="repeat", default=200, type="int")
+	options, remainder=parser.parse_args()
+
+	lines=[riod.checkCharSet(line.encode('iso-8859-15')) for stamp, line in riosim.loadRecording(options.file)]
+
+	for line in lines:
+		event=riod.parseNotification(line)
+		if (tuple(event) if event else None) != legacyParse(line):
+			print("MISMATCH: " + line)
+
+	legacy=measure(legacyParse, lines, options.repeat)
+	current=measure(riod.parseNotification, lines, options.repeat)
+
+	print("Lines: %d, runs: %d" % (len(lines), options.repeat))
+	print("legacy re.search/re.split : %10.0f lines/s" % legacy)
+	print("parseNotification         : %10.0f lines/s (x%.1f)" % (current, current / legacy))
+
+	for line in ['N C[2].Z[12].volume="20"', 'N S[10].name="Tuner"']:
+		print("%-28s legacy: %-5s parseNotification: %s" % (line,
+			"ok" if legacyParse(line) else "ERROR", tuple(riod.parseNotification(line))))
+
+if __name__ == "__main__":
+	main()
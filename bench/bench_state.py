@@ -0,0 +1,178 @@
+#!/usr/bin/python3
+#
+# Memory and throughput of the state model of riod.py on a simulated system of
+# 6 controllers MCA-88 (48 zones) and 8 sources. The typed model (Zone, Source and
+# Controller with __slots__ and int indices) is compared with the former nested dicts
+# with string keys (recursivedefaultdict and setPath up to V1.23).
+#
+# Usage: bench_state.py [-c 6] [-z 8] [-s 8] [-r 20]
+
+import json
+import optparse
+import os
+import random
+import sys
+import threading
+import time
+import tracemalloc
+
+from collections import defaultdict
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+import riod
+import riosim
+
+class recursivedefaultdict(defaultdict):
+	def __init__(self):
+		self.default_factory = type(self)
+
+# State update as done up to V1.23
+def setPath(root, keys, value):
+	node=root
+	missing=None
+	for depth, key in enumerate(keys[:-1]):
+		if missing is None and key not in node:
+			missing=depth
+		node=node[key]
+
+	if missing is None:
+		op="replace" if keys[-1] in node else "add"
+		if op == "replace" and node[keys[-1]] == value:
+			return None
+		node[keys[-1]]=value
+		return {"op": op, "path": "/" + "/".join(keys), "value": value}
+
+	node[keys[-1]]=value
+	node=root
+	for key in keys[:missing+1]:
+		node=node[key]
+	return {"op": "add", "path": "/" + "/".join(keys[:missing+1]), "value": json.loads(json.dumps(node))}
+
+# Updates with the lock as done by State.set up to V1.23
+class LegacyState:
+	def __init__(self):
+		self.zones=recursivedefaultdict()
+		self.sources=defaultdict(dict)
+		self.lock=threading.RLock()
+
+	def apply(self, event):
+		with self.lock:
+			if event.kind == riod.EVENT_ZONE:
+				change=setPath(self.zones, (event.controller, event.index, event.attribute), event.value)
+				if event.attribute == "status" or event.attribute == "currentSource":
+					self.countActiveSources()
+				return change
+
+			added=event.index not in self.sources
+			change=setPath(self.sources, (event.index, event.attribute), event.value)
+			if added: # A new source starts with its active zones, like StateStore.setSource
+				self.countActiveSources()
+			return change
+
+	# Recount activeZones of all sources as done by countActiveSources up to V1.23
+	def countActiveSources(self):
+		count=dict.fromkeys(self.sources, 0)
+		for controller in self.zones.values():
+			for zone in controller.values():
+				source=zone.get("currentSource")
+				if zone.get("status") == "ON" and source in count:
+					count[source] += 1
+
+		for source in count:
+			setPath(self.sources, (source, "activeZones"), count[source])
+
+	def volume(self, c, z):
+		return self.zones.get(c, {}).get(z, {}).get("volume")
+
+	def snapshot(self):
+		return self.zones, self.sources
+
+class TypedState:
+	def __init__(self):
+		self.state=riod.StateStore()
+
+	def apply(self, event):
+		if event.kind == riod.EVENT_ZONE:
+			change=self.state.setZone(int(event.controller), int(event.index), event.attribute, event.value)
+			if event.attribute == "status" or event.attribute == "currentSource":
+				riod.countActiveSources(self.state)
+			return change
+		return self.state.setSource(int(event.index), event.attribute, event.value)
+
+	def volume(self, c, z):
+		zone=self.state.zone(int(c), int(z))
+		return zone and zone.volume
+
+	def snapshot(self):
+		return self.state.zonesJSON(), self.state.sourcesJSON()
+
+# All notifications after WATCH of every zone and source
+def initialEvents(sim):
+	lines=[]
+	for (c, z) in sim.zone:
+		lines += sim.zoneNotifications(c, z)
+	for n in sim.source:
+		lines += sim.sourceNotifications(n)
+	return [riod.parseNotification(line) for line in lines]
+
+# Changes of volume, status and source of random zones and the radio text of sources
+def changeEvents(sim, count):
+	random.seed(1)
+	zones=list(sim.zone)
+	lines=[]
+	for i in range(count):
+		c, z=random.choice(zones)
+		attribute, value=random.choice([("volume", str(random.randint(0, 50))), ("status", random.choice(["ON", "OFF"])),
+			("currentSource", str(random.randint(1, sim.sources)))])
+		lines.append('N C[%d].Z[%d].%s="%s"' % (c, z, attribute, value))
+		if i % 4 == 0:
+			lines.append('N S[%d].radioText="Text %d"' % (random.randint(1, sim.sources), i))
+	return [riod.parseNotification(line) for line in lines]
+
+def memory(model, events):
+	tracemalloc.start()
+	before=tracemalloc.take_snapshot()
+	state=model()
+	for event in events:
+		state.apply(event)
+	size=sum(stat.size_diff for stat in tracemalloc.take_snapshot().compare_to(before, 'filename'))
+	tracemalloc.stop()
+	return state, size
+
+def rate(function, count, repeat):
+	start=time.perf_counter()
+	for r in range(repeat):
+		function()
+	return count * repeat / (time.perf_counter() - start)
+
+def main():
+	parser=optparse.OptionParser()
+	parser.add_option('-c', '--controllers', dest="controllers", default=6, type="int")
+	parser.add_option('-z', '--zones', dest="zones", default=8, type="int")
+	parser.add_option('-s', '--sources', dest="sources", default=8, type="int")
+	parser.add_option('-r', '--repeat', dest="repeat", default=20, type="int")
+	options, remainder=parser.parse_args()
+
+	sim=riosim.RIOSimulator(0, options.controllers, options.zones, options.sources, model="MCA-88")
+	sim.server.close()
+	initial=initialEvents(sim)
+	changes=changeEvents(sim, 5000)
+	lookups=list(sim.zone)
+
+	print("%d controllers, %d zones, %d sources, %d initial notifications, %d changes" % (options.controllers,
+		len(sim.zone), options.sources, len(initial), len(changes)))
+	print("%-8s %12s %14s %14s %14s" % ("model", "memory KB", "updates/s", "lookups/s", "encodes/s"))
+
+	results={}
+	for name, model in [("legacy", LegacyState), ("typed", TypedState)]:
+		state, size=memory(model, initial)
+		updates=rate(lambda: [state.apply(event) for event in changes], len(changes), options.repeat)
+		volumes=rate(lambda: [state.volume(str(c), str(z)) for c, z in lookups], len(lookups), options.repeat * 50)
+		encodes=rate(lambda: [json.dumps(snapshot) for snapshot in state.snapshot()], 1, options.repeat * 10)
+		results[name]=json.loads(json.dumps(state.snapshot()))
+		print("%-8s %12.1f %14.0f %14.0f %14.0f" % (name, size / 1024, updates, volumes, encodes))
+
+	print("same JSON: %s" % (results["legacy"] == results["typed"]))
+
+if __name__ == "__main__":
+	main()
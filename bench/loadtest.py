@@ -0,0 +1,146 @@
+#!/usr/bin/python3
+#
+# Load test of the built in web service of riod.py
+# Starts a simulated RIO device (riosim.py) and riod.py with a temporary ini file,
+# then polls a view with concurrent clients and reports requests per second and latency.
+# With --port an already running riod.py is tested.
+#
+# Usage: loadtest.py [-v zoneconfig] [-n 20] [-d 10] [--close] [--port 8080]
+
+import http.client
+import optparse
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import riosim
+
+RIOD=os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'riod.py')
+
+INI="""[Common]
+Russound=127.0.0.1
+Port=%d
+Controllers=%s
+%s
+[Webserver]
+EnableWeb=1
+Port=%d
+EnableSSL=0
+
+[MQTT]
+%s
+"""
+
+def percentile(values, p):
+	return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+# Start simulator and riod.py, returns the process and the simulator
+# extra: further sections of the ini file, common: further lines of section [Common],
+# mqtt: (host, port, topic) of a MQTT broker
+def startDaemon(webPort, controllers=1, extra="", common="", mqtt=None):
+	sim=riosim.RIOSimulator(0, controllers).start()
+
+	if mqtt:
+		mqttSection="EnableMQTT=1\nEnableMQTTSSL=0\nHost=%s\nPort=%d\nTopic=%s\n" % mqtt
+	else:
+		mqttSection="EnableMQTT=0\n"
+
+	ini=tempfile.NamedTemporaryFile('w', suffix='.ini', delete=False)
+	ini.write(INI % (sim.port, ','.join(str(c) for c in range(1, controllers + 1)), common, webPort, mqttSection) + extra)
+	ini.close()
+
+	process=subprocess.Popen([sys.executable, RIOD, '-c', ini.name])
+
+	# Wait for the web service
+	for i in range(100):
+		if process.poll() is not None:
+			sys.exit("riod.py terminated with " + str(process.returncode))
+		try:
+			conn=http.client.HTTPConnection('127.0.0.1', webPort, timeout=1)
+			conn.request('GET', '/status')
+			conn.getresponse().read()
+			conn.close()
+			break
+		except OSError:
+			time.sleep(0.1)
+
+	os.unlink(ini.name)
+	return process, sim
+
+def client(port, view, duration, close, latencies, errors):
+	conn=None
+	end=time.perf_counter() + duration
+	headers={'Connection': 'close'} if close else {}
+
+	while time.perf_counter() < end:
+		try:
+			if conn is None:
+				conn=http.client.HTTPConnection('127.0.0.1', port, timeout=10)
+
+			start=time.perf_counter()
+			conn.request('GET', '/' + view, headers=headers)
+			response=conn.getresponse()
+			response.read()
+			latencies.append(time.perf_counter() - start)
+
+			if close or response.getheader('Connection', '').lower() == 'close':
+				conn.close()
+				conn=None
+
+		except (OSError, http.client.HTTPException):
+			errors.append(1)
+			if conn:
+				conn.close()
+			conn=None
+
+def run(port, view, clients, duration, close):
+	latencies=[]
+	errors=[]
+
+	threads=[threading.Thread(target=client, args=(port, view, duration, close, latencies, errors))
+		for i in range(clients)]
+	start=time.perf_counter()
+	for t in threads:
+		t.start()
+	for t in threads:
+		t.join()
+	elapsed=time.perf_counter() - start
+
+	latencies.sort()
+	return len(latencies) / elapsed, latencies, len(errors)
+
+def main():
+	parser=optparse.OptionParser()
+	parser.add_option('-v', '--view', dest="view", default="zoneconfig")
+	parser.add_option('-n', '--clients', dest="clients", default=20, type="int")
+	parser.add_option('-d', '--duration', dest="duration", default=10, type="float")
+	parser.add_option('--close', dest="close", action="store_true", default=False)
+	parser.add_option('--port', dest="port", type="int")
+	parser.add_option('--webport', dest="webport", default=18080, type="int")
+	options, remainder=parser.parse_args()
+
+	process=None
+	port=options.port
+	if port is None:
+		port=options.webport
+		process, sim=startDaemon(port)
+
+	try:
+		rps, latencies, errors=run(port, options.view, options.clients, options.duration, options.close)
+	finally:
+		if process:
+			process.terminate()
+			process.wait()
+
+	print("View: /%s, clients: %d, keep-alive: %s" % (options.view, options.clients, not options.close))
+	print("Requests: %d, errors: %d" % (len(latencies), errors))
+	if latencies:
+		print("Requests/s: %.0f" % rps)
+		print("Latency ms: p50 %.2f, p99 %.2f, max %.2f" % (percentile(latencies, 50) * 1000,
+			percentile(latencies, 99) * 1000, latencies[-1] * 1000))
+
+if __name__ == "__main__":
+	main()
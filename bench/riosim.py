@@ -0,0 +1,319 @@
+#!/usr/bin/python3
+#
+# Simulated Russound RIO device for benchmarks of riod.py
+# Answers VERSION, GET C[n].type, GET C[n].Z[m].<attr>, GET S[n].<attr> and WATCH,
+# accepts EVENT and SET. After WATCH SYSTEM ON the state of all zones and sources is
+# sent as notifications, like a real device does.
+# With a latency, every reply is delivered latency seconds after its request was received,
+# like over a slow network link. Pipelined requests don't add up their latency.
+#
+# A recorded notification stream can be replayed to all clients, at the recorded speed
+# (rate 1), accelerated (e.g. rate 10) or as fast as possible (rate 0). A recording is a
+# text file with one RIO line per line, optionally preceded by the time in seconds and a
+# tab, e.g. "12.345<TAB>N C[1].Z[2].volume="20"". Lines without a time are sent at once.
+# Replayed notifications also change the state answered on GET and WATCH.
+# A capture file of riod.py ([Capture] File) is replayed as well: all lines received from
+# the device with the time of the chunk, in which they were completed.
+#
+# Usage: riosim.py [-p 9621] [-c 2] [-z 8] [-s 6] [-l 0.02] [-f burst.txt|riod.cap] [-r 10] [--loop]
+
+import optparse
+import queue
+import re
+import socket
+import struct
+import threading
+import time
+
+GET=re.compile(r'GET (?:C\[(\d+)\]\.Z\[(\d+)\]|C\[(\d+)\]|S\[(\d+)\])\.(\w+)$')
+NOTIFICATION=re.compile(r'N (?:C\[(\d+)\]\.Z\[(\d+)\]|S\[(\d+)\])\.(\w+)="(.*)"$')
+
+# Format of a capture file, see CaptureLog of riod.py
+CAPTURE_MAGIC=b'RIOCAP1\n'
+CAPTURE_HEADER=struct.Struct('<8sQQ')
+CAPTURE_RECORD=struct.Struct('<QcI')
+CAPTURE_RECEIVED=b'<'
+CAPTURE_CONNECT=b'*'
+
+# Yields the records (seconds, direction, data) of a capture file, the time in seconds of
+# the monotonic clock of riod.py. A truncated last record (e.g. after a crash) is ignored.
+def readCapture(filename):
+	with open(filename, 'rb') as f:
+		header=f.read(CAPTURE_HEADER.size)
+		if len(header) < CAPTURE_HEADER.size or CAPTURE_HEADER.unpack(header)[0] != CAPTURE_MAGIC:
+			raise ValueError(filename + " is not a capture file")
+
+		while True:
+			record=f.read(CAPTURE_RECORD.size)
+			if len(record) < CAPTURE_RECORD.size:
+				break
+			stamp, direction, length=CAPTURE_RECORD.unpack(record)
+			data=f.read(length)
+			if len(data) < length:
+				break
+			yield stamp / 1e9, direction, data
+
+def isCapture(filename):
+	with open(filename, 'rb') as f:
+		return f.read(len(CAPTURE_MAGIC)) == CAPTURE_MAGIC
+
+# Returns the records [(time, line)] of all lines received in a capture file
+def loadCapture(filename):
+	records=[]
+	buffer=b''
+	for stamp, direction, data in readCapture(filename):
+		if direction == CAPTURE_CONNECT: # Drop an incomplete line of the previous connection
+			buffer=b''
+		elif direction == CAPTURE_RECEIVED:
+			buffer += data
+			lines=buffer.split(b'\r\n')
+			buffer=lines.pop()
+			records += [(stamp, line.decode('iso-8859-15')) for line in lines if line]
+	return records
+
+# Returns the records [(time or None, line)] of a recording or a capture file
+def loadRecording(filename):
+	if isCapture(filename):
+		return loadCapture(filename)
+
+	records=[]
+	with open(filename, 'rb') as f:
+		for line in f:
+			line=line.rstrip(b'\r\n').decode('iso-8859-15')
+			if not line.strip():
+				continue
+			stamp, sep, rest=line.partition('\t')
+			try:
+				records.append((float(stamp), rest) if sep else (None, line))
+			except ValueError:
+				records.append((None, line))
+	return records
+
+class RIOSimulator:
+	def __init__(self, port=0, controllers=1, zones=8, sources=6, model="MCA-C5", version="1.08.00", latency=0):
+		self.latency=latency
+		self.controllers=controllers
+		self.zones=zones
+		self.sources=sources
+		self.model=model
+		self.version=version
+		self.received=[]
+		self.clients=[]
+		self.lock=threading.Lock()
+
+		self.zone={}
+		for c in range(1, controllers + 1):
+			for z in range(1, zones + 1):
+				self.zone[(c, z)]={"name": "Zone " + str(z), "currentSource": str((z - 1) % sources + 1),
+					"volume": "20", "bass": "0", "treble": "0", "balance": "0", "loudness": "OFF",
+					"turnOnVolume": "20", "doNotDisturb": "OFF", "partyMode": "OFF", "status": "OFF",
+					"mute": "OFF", "sharedSource": "OFF"}
+
+		self.source={}
+		for n in range(1, sources + 1):
+			self.source[n]={"name": "Source " + str(n), "type": "Misc Audio", "channel": "", "channelName": "",
+				"programServiceName": "", "radioText": ""}
+
+		self.server=socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+		self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+		self.server.bind(('127.0.0.1', port))
+		self.server.listen(8)
+		self.port=self.server.getsockname()[1]
+
+	def start(self):
+		t=threading.Thread(target=self.run)
+		t.daemon=True
+		t.start()
+		return self
+
+	def run(self):
+		while True:
+			conn, address=self.server.accept()
+			conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+			t=threading.Thread(target=self.serve, args=(conn,))
+			t.daemon=True
+			t.start()
+
+	# Deliver replies after the latency
+	def delay(self, conn, replies):
+		while True:
+			due, data=replies.get()
+			if data is None:
+				break
+
+			wait=due - time.monotonic()
+			if wait > 0:
+				time.sleep(wait)
+
+			try:
+				conn.sendall(data)
+			except OSError:
+				break
+
+	def serve(self, conn):
+		with self.lock:
+			self.clients.append(conn)
+
+		replies=None
+		if self.latency:
+			replies=queue.Queue()
+			t=threading.Thread(target=self.delay, args=(conn, replies))
+			t.daemon=True
+			t.start()
+
+		buffer=b''
+		try:
+			while True:
+				data=conn.recv(4096)
+				if not data:
+					break
+
+				buffer += data
+				while b'\r' in buffer:
+					line, buffer=buffer.split(b'\r', 1)
+					line=line.strip(b'\n').decode('iso-8859-15')
+					if line:
+						self.received.append(line)
+						answer=self.answer(line)
+						if answer:
+							reply=''.join(a + '\r\n' for a in answer).encode('iso-8859-15')
+							if replies:
+								replies.put((time.monotonic() + self.latency, reply))
+							else:
+								conn.sendall(reply)
+		except OSError:
+			pass
+		finally:
+			if replies:
+				replies.put((0, None))
+			with self.lock:
+				self.clients.remove(conn)
+			conn.close()
+
+	# Send a notification to all connected clients
+	def notify(self, line):
+		self.send(line + '\r\n')
+
+	def send(self, data):
+		data=data.encode('iso-8859-15')
+		with self.lock:
+			for conn in self.clients:
+				try:
+					conn.sendall(data)
+				except OSError:
+					pass
+
+	# Change the state by a notification
+	def apply(self, line):
+		match=NOTIFICATION.match(line)
+		if match:
+			c, z, n, attribute, value=match.groups()
+			if z and (int(c), int(z)) in self.zone:
+				self.zone[(int(c), int(z))][attribute]=value
+			elif n and int(n) in self.source:
+				self.source[int(n)][attribute]=value
+
+	# Replay records [(time, line)] with rate times the recorded speed, rate 0 as fast as
+	# possible. All lines due at the same time are sent at once. Returns the number of lines.
+	def replay(self, records, rate=1):
+		start=time.monotonic()
+		first=None
+		pending=[]
+		for stamp, line in records:
+			if rate and stamp is not None:
+				if first is None:
+					first=stamp
+				wait=start + (stamp - first) / rate - time.monotonic()
+				if wait > 0:
+					if pending:
+						self.send(''.join(pending))
+						pending=[]
+					time.sleep(wait)
+
+			self.apply(line)
+			pending.append(line + '\r\n')
+
+		if pending:
+			self.send(''.join(pending))
+		return len(records)
+
+	# Drop all client connections, like a network outage
+	def disconnect(self):
+		with self.lock:
+			for conn in self.clients:
+				try:
+					conn.shutdown(socket.SHUT_RDWR)
+				except OSError:
+					pass
+
+	def setZone(self, c, z, attribute, value):
+		self.zone[(c, z)][attribute]=value
+		self.notify('N C[%d].Z[%d].%s="%s"' % (c, z, attribute, value))
+
+	def zoneNotifications(self, c, z):
+		return ['N C[%d].Z[%d].%s="%s"' % (c, z, a, v) for a, v in self.zone[(c, z)].items()]
+
+	def sourceNotifications(self, n):
+		return ['N S[%d].%s="%s"' % (n, a, v) for a, v in self.source[n].items()]
+
+	def answer(self, line):
+		if line == 'VERSION':
+			return ['S VERSION="' + self.version + '"']
+
+		match=GET.match(line)
+		if match:
+			c, z, controller, n, attribute=match.groups()
+			if controller and int(controller) <= self.controllers and attribute == "type":
+				return ['S C[%s].type="%s"' % (controller, self.model)]
+			if z and (int(c), int(z)) in self.zone and attribute in self.zone[(int(c), int(z))]:
+				return ['S C[%s].Z[%s].%s="%s"' % (c, z, attribute, self.zone[(int(c), int(z))][attribute])]
+			if n and int(n) in self.source and attribute in self.source[int(n)]:
+				return ['S S[%s].%s="%s"' % (n, attribute, self.source[int(n)][attribute])]
+			return ['E Invalid key']
+
+		if line == 'WATCH SYSTEM ON':
+			return ['S', 'N System.status="ON"']
+
+		match=re.match(r'WATCH C\[(\d+)\]\.Z\[(\d+)\] ON$', line)
+		if match and (int(match.group(1)), int(match.group(2))) in self.zone:
+			return ['S'] + self.zoneNotifications(int(match.group(1)), int(match.group(2)))
+
+		match=re.match(r'WATCH S\[(\d+)\] ON$', line)
+		if match and int(match.group(1)) in self.source:
+			return ['S'] + self.sourceNotifications(int(match.group(1)))
+
+		if line.startswith('EVENT ') or line.startswith('SET ') or line.startswith('WATCH '):
+			return ['S']
+
+		return ['E Invalid command']
+
+def main():
+	parser=optparse.OptionParser()
+	parser.add_option('-p', '--port', dest="port", default=9621, type="int")
+	parser.add_option('-c', '--controllers', dest="controllers", default=1, type="int")
+	parser.add_option('-z', '--zones', dest="zones", default=8, type="int")
+	parser.add_option('-s', '--sources', dest="sources", default=6, type="int")
+	parser.add_option('-l', '--latency', dest="latency", default=0, type="float")
+	parser.add_option('-f', '--file', dest="file")
+	parser.add_option('-r', '--rate', dest="rate", default=1, type="float")
+	parser.add_option('--loop', dest="loop", action="store_true", default=False)
+	options, remainder=parser.parse_args()
+
+	sim=RIOSimulator(options.port, options.controllers, options.zones, options.sources, latency=options.latency)
+	print("Simulated RIO device on port " + str(sim.port))
+	if not options.file:
+		sim.run()
+		return
+
+	sim.start()
+	records=loadRecording(options.file)
+	while True:
+		while not sim.clients: # Replay as soon as riod.py is connected
+			time.sleep(0.1)
+		time.sleep(1)
+		print("Replay %d lines of %s at rate %g" % (sim.replay(records, options.rate), options.file, options.rate))
+		if not options.loop:
+			break
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,238 @@
+#!/usr/bin/python3
+#
+# Benchmark suite of riod.py against the simulated RIO device (riosim.py)
+# - latency:   notification of the device until the delta patch arrives at a UDP target
+# - parse:     lines per second of a replayed recording at full speed (riod_lines_total)
+# - http:      latency of /status and /zoneconfig, idle and during the replay
+# - mqtt:      round trip of /Get to /Data, only with --mqtt host:port of a running broker
+# - reconnect: connection drop until all zones and sources are refreshed again
+#
+# With --threads riod.py runs with a thread per service ([Common] EventLoop=0).
+#
+# Usage: suite.py [-t latency,parse,http,mqtt,reconnect] [-f burst.txt] [-n 200]
+#                 [--mqtt localhost:1883] [--webport 18090] [--threads]
+
+import http.client
+import json
+import optparse
+import os
+import re
+import socket
+import sys
+import threading
+import time
+
+import loadtest
+import riosim
+
+TESTS="latency,parse,http,mqtt,reconnect"
+
+def percentiles(values):
+	values=sorted(values)
+	if not values:
+		return "no samples"
+	return "p50 %.2f ms, p99 %.2f ms, max %.2f ms (%d samples)" % (loadtest.percentile(values, 50) * 1000,
+		loadtest.percentile(values, 99) * 1000, values[-1] * 1000, len(values))
+
+class Client:
+	def __init__(self, port):
+		self.port=port
+		self.conn=None
+
+	def get(self, path):
+		if self.conn is None:
+			self.conn=http.client.HTTPConnection('127.0.0.1', self.port, timeout=10)
+		try:
+			self.conn.request('GET', path)
+			return self.conn.getresponse().read()
+		except (OSError, http.client.HTTPException):
+			self.conn.close()
+			self.conn=None
+			raise
+
+	def json(self, path):
+		return json.loads(self.get(path))
+
+	def lines(self):
+		metrics=self.get('/metrics').decode()
+		return sum(int(value) for value in re.findall(r'^riod_lines_total\{[^}]*\} (\d+)', metrics, re.M))
+
+# Wait until riod.py is connected and all zones and sources are watched
+def waitConnected(client, sim, timeout=20):
+	deadline=time.monotonic() + timeout
+	while time.monotonic() < deadline:
+		status=client.json('/status')
+		if not status["LastReconnect"].startswith("01.01.1970") and len(client.json('/zoneconfig').get("1", {})) == sim.zones:
+			return
+		time.sleep(0.05)
+	sys.exit("riod.py is not connected to the simulator")
+
+def testLatency(client, sim, udp, count):
+	udp.settimeout(2)
+	try: # Initial snapshot and patches of the connect
+		while True:
+			udp.recv(65536)
+	except socket.timeout:
+		pass
+
+	latencies=[]
+	for i in range(count):
+		z=i % sim.zones + 1
+		value=str(i % 50)
+		if sim.zone[(1, z)]["volume"] == value:
+			value=str(i % 50 + 1)
+		path='"/1/%d/volume"' % z
+
+		start=time.perf_counter()
+		sim.setZone(1, z, "volume", value)
+		try:
+			while True:
+				msg=udp.recv(65536).decode()
+				if path in msg and '"' + value + '"' in msg:
+					latencies.append(time.perf_counter() - start)
+					break
+		except socket.timeout:
+			print("  lost change of zone %d" % z)
+
+	print("latency   notification -> UDP delta patch: " + percentiles(latencies))
+	return latencies
+
+def replayLoad(sim, records):
+	while True:
+		sim.replay(records, 0)
+
+def testParse(client, sim, records, repeat):
+	before=client.lines()
+	expected=before + len(records) * repeat
+
+	start=time.perf_counter()
+	for r in range(repeat):
+		sim.replay(records, 0)
+	while True:
+		lines=client.lines()
+		if lines >= expected or time.perf_counter() - start > 60:
+			break
+		time.sleep(0.01)
+	elapsed=time.perf_counter() - start
+
+	print("parse     %d lines replayed at full speed: %.0f lines/s (%d of %d lines counted)" % (
+		len(records) * repeat, (lines - before) / elapsed, lines - before, len(records) * repeat))
+
+def measureHTTP(client, paths, duration):
+	latencies={path: [] for path in paths}
+	end=time.perf_counter() + duration
+	while time.perf_counter() < end:
+		for path in paths:
+			start=time.perf_counter()
+			client.get(path)
+			latencies[path].append(time.perf_counter() - start)
+	return latencies
+
+def testHTTP(client, sim, records, duration):
+	paths=['/status', '/zoneconfig']
+	for path, latencies in measureHTTP(client, paths, duration).items():
+		print("http      %-12s idle:   %s" % (path, percentiles(latencies)))
+
+	t=threading.Thread(target=replayLoad, args=(sim, records))
+	t.daemon=True
+	t.start()
+	for path, latencies in measureHTTP(client, paths, duration).items():
+		print("http      %-12s replay: %s" % (path, percentiles(latencies)))
+
+def testMQTT(host, port, topic, count):
+	try:
+		import paho.mqtt.client as mqtt
+	except ImportError:
+		print("mqtt      skipped, paho-mqtt is not installed")
+		return
+
+	received=threading.Event()
+	subscribed=threading.Event()
+	client=mqtt.Client()
+	client.on_message=lambda client, userdata, msg: received.set()
+	client.on_subscribe=lambda *args: subscribed.set()
+	client.connect(host, port)
+	client.loop_start()
+	client.subscribe(topic + '/Data')
+	subscribed.wait(5)
+
+	latencies=[]
+	for i in range(count):
+		received.clear()
+		start=time.perf_counter()
+		client.publish(topic + '/Get', 'status')
+		if received.wait(5):
+			latencies.append(time.perf_counter() - start)
+	client.loop_stop()
+
+	print("mqtt      /Get status -> /Data: " + percentiles(latencies))
+	return latencies
+
+def testReconnect(client, sim, count):
+	durations=[]
+	for i in range(count):
+		reconnects=client.json('/status')["Reconnects"]
+		start=time.perf_counter()
+		sim.disconnect()
+		while time.perf_counter() - start < 30:
+			status=client.json('/status')
+			if status["Reconnects"] > reconnects and not status["StaleZones"] and not status["StaleSources"]:
+				durations.append(time.perf_counter() - start)
+				break
+			time.sleep(0.001)
+		else:
+			print("  not refreshed within 30 s, stale: %s %s" % (status["StaleZones"], status["StaleSources"]))
+
+	print("reconnect drop -> all zones and sources refreshed: " + percentiles(durations))
+
+def main():
+	parser=optparse.OptionParser()
+	parser.add_option('-t', '--tests', dest="tests", default=TESTS)
+	parser.add_option('-f', '--file', dest="file",
+		default=os.path.join(os.path.dirname(os.path.realpath(__file__)), 'burst.txt'))
+	parser.add_option('-n', '--count', dest="count", default=200, type="int")
+	parser.add_option('-d', '--duration', dest="duration", default=3, type="float")
+	parser.add_option('--mqtt', dest="mqtt")
+	parser.add_option('--webport', dest="webport", default=18090, type="int")
+	parser.add_option('--threads', dest="threads", action="store_true", default=False)
+	options, remainder=parser.parse_args()
+	tests=options.tests.split(',')
+
+	records=riosim.loadRecording(options.file)
+
+	udp=socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+	udp.bind(('127.0.0.1', 0))
+	extra="\n[RemoteTargets]\nZoneConfig=udp:127.0.0.1:%d:delta\n" % udp.getsockname()[1]
+
+	mqtt=None
+	if options.mqtt and "mqtt" in tests:
+		host, sep, port=options.mqtt.partition(':')
+		mqtt=(host, int(port or 1883), "riodbench")
+
+	# Two controllers as in burst.txt. A short reconnect delay, a connection dropped again
+	# within RECONNECT_STABLE seconds is reconnected after it.
+	process, sim=loadtest.startDaemon(options.webport, 2, extra=extra, common="ReconnectDelay=0.05\nEventLoop=%d\n" % (not options.threads), mqtt=mqtt)
+	client=Client(options.webport)
+
+	try:
+		waitConnected(client, sim)
+
+		if "latency" in tests:
+			testLatency(client, sim, udp, options.count)
+		if "parse" in tests:
+			testParse(client, sim, records, 20)
+		if "reconnect" in tests:
+			testReconnect(client, sim, 5)
+		if "mqtt" in tests:
+			if mqtt:
+				testMQTT(mqtt[0], mqtt[1], mqtt[2], options.count)
+			else:
+				print("mqtt      skipped, no broker given with --mqtt host:port")
+		if "http" in tests:
+			testHTTP(client, sim, records, options.duration)
+	finally:
+		process.terminate()
+		process.wait()
+
+if __name__ == "__main__":
+	main()
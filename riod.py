@@ -22,15 +22,45 @@
 # V1.7.5 19.04.2020 - Add cmd toggle
 # V1.8 	 24.04.2020 - Implement mqtt protocol for status updates and Cmd
 # V1.9 	 27.04.2020 - Translate RDS from IEC62106 to ISO-8859-15
-
+# V1.10  18.10.2026 - Buffered line framing for the RIO read loop
+# V1.11  18.10.2026 - Single pass notification parser, multi digit zones and sources
+# V1.12  18.10.2026 - Coalesced, debounced publishing of ZoneConfig/SourceConfig
+# V1.13  18.10.2026 - Delta publishing mode for remote targets
+# V1.14  18.10.2026 - Send queue and persistent connections for remote targets
+# V1.15  18.10.2026 - Versioned state with cached responses
+# V1.16  18.10.2026 - Concurrent web service with keep-alive, option -c for the ini file
+# V1.17  18.10.2026 - Server-sent events with live changes on /events
+# V1.18  18.10.2026 - Conditional GET and long poll on the state version
+# V1.19  18.10.2026 - Serialized command writer, relative volume as one Volume event
+# V1.20  18.10.2026 - Pipelined discovery of zones and sources
+# V1.21  18.10.2026 - Warm start from a persisted snapshot of topology and state
+# V1.22  18.10.2026 - Reconnect with exponential backoff, WOL after repeated failures
+# V1.23  18.10.2026 - Deferred formatting of debug messages, written by a background thread
+# V1.24  18.10.2026 - Typed state model for controllers, zones and sources
+# V1.25  18.10.2026 - Incremental index of active zones, views activezones and sources/N/zones
+# V1.26  18.10.2026 - Counters and histograms on /metrics
+# V1.27  18.10.2026 - Capture of the raw RIO traffic to a rotating binary log
+# V1.28  18.10.2026 - Retained MQTT topic per attribute of zones and sources
+# V1.29  18.10.2026 - MQTT requests handled by worker threads, correlation by sub topic
+# V1.30  18.10.2026 - Several Russound devices in one process, sections [Device <name>]
+# V1.31  18.10.2026 - Single asyncio event loop for all connections, [Common] EventLoop
+# V1.32  18.10.2026 - LRU cache of decoded and parsed lines, unchanged values are skipped
+# V1.33  18.10.2026 - Multi-zone commands, batch of commands with POST /cmd and MQTT /Batch
+
+import asyncio
+import bisect
 import configparser
 import datetime
 import errno
+import functools
 import json
+import operator
 import optparse
 import os
+import random
 import paho.mqtt.client as mqtt
 import re
+import select
 import socket
 import ssl
 import string
@@ -40,16 +70,273 @@ import syslog
 import threading
 import time
 
-from collections import defaultdict
+from http import HTTPStatus
+
+from collections import OrderedDict, defaultdict, deque, namedtuple
+
+# Known attributes of zones and sources, other attributes are kept in the dict extra
+ZONE_ATTRIBUTES=("name", "currentSource", "volume", "bass", "treble", "balance", "loudness",
+	"turnOnVolume", "doNotDisturb", "partyMode", "status", "mute", "sharedSource", "page", "lastError")
+SOURCE_ATTRIBUTES=("name", "type", "channel", "channelName", "coverArtURL", "composerName",
+	"genre", "artistName", "albumName", "playlistName", "songName", "programServiceName",
+	"radioText", "radioText2", "radioText3", "radioText4", "shuffleMode", "repeatMode", "mode",
+	"playStatus", "sampleRate", "bitRate", "bitDepth", "playTime", "trackTime", "activeZones")
+
+# Attributes of a zone or a source as fixed fields, None if not set by the device
+class Entity:
+	__slots__=("extra",)
+	ATTRIBUTES=()
+	KNOWN=frozenset()
+	VALUES=None # operator.attrgetter of all ATTRIBUTES
+
+	def __init__(self):
+		for attribute in self.ATTRIBUTES:
+			setattr(self, attribute, None)
+		self.extra=None
+
+	def get(self, attribute, default=None):
+		if attribute in self.KNOWN:
+			value=getattr(self, attribute)
+		else:
+			value=self.extra.get(attribute) if self.extra else None
+		return default if value is None else value
+
+	def __getitem__(self, attribute):
+		value=self.get(attribute)
+		if value is None:
+			raise KeyError(attribute)
+		return value
+
+	def __contains__(self, attribute):
+		return self.get(attribute) is not None
+
+	# Set an attribute, returns the JSON patch operation "add" or "replace", None if unchanged
+	def assign(self, attribute, value):
+		if attribute in self.KNOWN:
+			old=getattr(self, attribute)
+			if old == value:
+				return None
+			setattr(self, attribute, value)
+		else:
+			if self.extra is None:
+				self.extra={}
+			old=self.extra.get(attribute)
+			if old == value:
+				return None
+			self.extra[attribute]=value
+		return "add" if old is None else "replace"
+
+	def update(self, attributes):
+		for attribute, value in attributes.items():
+			self.assign(attribute, value)
+
+	# Serialized as JSON object with the attributes set
+	def toJSON(self):
+		result={attribute: value for attribute, value in zip(self.ATTRIBUTES, self.VALUES(self)) if value is not None}
+		if self.extra:
+			result.update(self.extra)
+		return result
+
+class Zone(Entity):
+	__slots__=ZONE_ATTRIBUTES
+	ATTRIBUTES=ZONE_ATTRIBUTES
+	KNOWN=frozenset(ZONE_ATTRIBUTES)
+	VALUES=operator.attrgetter(*ZONE_ATTRIBUTES)
+
+class Source(Entity):
+	__slots__=SOURCE_ATTRIBUTES
+	ATTRIBUTES=SOURCE_ATTRIBUTES
+	KNOWN=frozenset(SOURCE_ATTRIBUTES)
+	VALUES=operator.attrgetter(*SOURCE_ATTRIBUTES)
+
+class Controller:
+	__slots__=("zones",)
+
+	def __init__(self):
+		self.zones={} # zone: Zone
+
+	def toJSON(self):
+		return {str(z): zone.toJSON() for z, zone in self.zones.items()}
+
+# State of zones and sources with a version, which is increased by every change.
+# Encoded responses are cached per view until the next change.
+# Controllers, zones and sources are indexed by int. The JSON of ZoneConfig and
+# SourceConfig is built by zonesJSON and sourcesJSON only.
+# Zones (controller, zone) and sources (source,) in stale are last known values, e.g. loaded
+# from the state file or kept during an outage, which are not yet refreshed by the device.
+# The powered on zones and the active zones of each source are indexed with every change of
+# status or currentSource, zones by controller are the zones of Controller.
+class StateStore:
+	def __init__(self):
+		self.zones={} # controller: Controller
+		self.sources={} # source: Source
+		self.version=0
+		self.lock=threading.RLock()
+		self.cache={}
+		self.stale=set()
+		self.powered=set() # (controller, zone) with status ON
+		self.activeSource={} # (controller, zone): source of a powered on zone
+		self.sourceZones=defaultdict(set) # source: {(controller, zone)} powered on with this source
+		self.activeChanged=set() # Sources with a changed number of active zones
+		self.touched=[] # Called after touch, e.g. to wake up long polls
+
+	# Returns the zone or None, a missing zone is never created
+	def zone(self, c, z):
+		controller=self.zones.get(c)
+		return controller.zones.get(z) if controller else None
+
+	def source(self, n):
+		return self.sources.get(n)
+
+	# Set an attribute of a zone and return the change as JSON patch operation,
+	# e.g. {"op": "replace", "path": "/1/5/volume", "value": "23"}, None if the value is unchanged.
+	# A value of the device refreshes its zone, a derived value (refresh False) not
+	def setZone(self, c, z, attribute, value, refresh=True):
+		with self.lock:
+			if refresh and self.stale:
+				self.stale.discard((c, z))
+
+			controller=self.zones.get(c)
+			if controller is None:
+				controller=self.zones[c]=Controller()
+				zone=controller.zones[z]=Zone()
+				zone.assign(attribute, value)
+				self.indexZone(c, z, zone)
+				return self.added("/%d" % c, controller.toJSON())
+
+			zone=controller.zones.get(z)
+			if zone is None:
+				zone=controller.zones[z]=Zone()
+				zone.assign(attribute, value)
+				self.indexZone(c, z, zone)
+				return self.added("/%d/%d" % (c, z), zone.toJSON())
+
+			op=zone.assign(attribute, value)
+			if op is None:
+				return None
+			if attribute == "status" or attribute == "currentSource":
+				self.indexZone(c, z, zone)
+			self.version += 1
+			return {"op": op, "path": "/%d/%d/%s" % (c, z, attribute), "value": value}
+
+	# Update the indexes after a change of status or currentSource of a zone
+	def indexZone(self, c, z, zone):
+		key=(c, z)
+		if zone.status == "ON":
+			self.powered.add(key)
+		else:
+			self.powered.discard(key)
+
+		source=None
+		if zone.status == "ON" and zone.currentSource and zone.currentSource.isdigit():
+			source=int(zone.currentSource)
+
+		old=self.activeSource.get(key)
+		if old == source:
+			return
+
+		if old is not None:
+			self.sourceZones[old].discard(key)
+			self.activeChanged.add(old)
+		if source is not None:
+			self.sourceZones[source].add(key)
+			self.activeChanged.add(source)
+			self.activeSource[key]=source
+		else:
+			del self.activeSource[key]
+
+	# Set activeZones of the sources with changed active zones, returns the changes
+	def updateActiveZones(self):
+		with self.lock:
+			changes=[self.setSource(n, "activeZones", len(self.sourceZones[n]), False)
+				for n in self.activeChanged if n in self.sources]
+			self.activeChanged.clear()
+		return changes
+
+	# Set an attribute of a source, see setZone
+	def setSource(self, n, attribute, value, refresh=True):
+		with self.lock:
+			if refresh and self.stale:
+				self.stale.discard((n,))
+
+			source=self.sources.get(n)
+			if source is None:
+				source=self.sources[n]=Source()
+				source.assign("activeZones", len(self.sourceZones.get(n, ())))
+				source.assign(attribute, value)
+				return self.added("/%d" % n, source.toJSON())
+
+			op=source.assign(attribute, value)
+			if op is None:
+				return None
+			self.version += 1
+			return {"op": op, "path": "/%d/%s" % (n, attribute), "value": value}
+
+	# A new controller, zone or source is added as a whole object
+	def added(self, path, value):
+		self.version += 1
+		return {"op": "add", "path": path, "value": value}
+
+	# JSON of ZoneConfig {"1": {"5": {"volume": "23", ...}}} and SourceConfig {"3": {...}}
+	def zonesJSON(self):
+		with self.lock:
+			return {str(c): controller.toJSON() for c, controller in self.zones.items()}
+
+	def sourcesJSON(self):
+		with self.lock:
+			return {str(n): source.toJSON() for n, source in self.sources.items()}
+
+	# Powered on zones by controller {"1": [2, 5]}
+	def activeZonesJSON(self):
+		with self.lock:
+			return self.byController(self.powered)
+
+	# Powered on zones of a source by controller
+	def sourceZonesJSON(self, n):
+		with self.lock:
+			return self.byController(self.sourceZones.get(n, ()))
+
+	@staticmethod
+	def byController(zones):
+		result={}
+		for c, z in sorted(zones):
+			result.setdefault(str(c), []).append(z)
+		return result
+
+	# Mark all zones and sources stale until they are refreshed
+	def markStale(self):
+		with self.lock:
+			self.stale.update((c, z) for c in self.zones for z in self.zones[c].zones)
+			self.stale.update((n,) for n in self.sources)
+
+	# Returns the stale zones ("controller/zone") and sources
+	def staleEntries(self):
+		with self.lock:
+			entries=sorted(self.stale)
+		return ["%d/%d" % key for key in entries if len(key) == 2], [str(key[0]) for key in entries if len(key) == 1]
+
+	# Something else than zones and sources changed, e.g. DeviceStatus
+	def touch(self):
+		with self.lock:
+			self.version += 1
+		for listener in self.touched:
+			listener()
+
+	# Return the encoded response of a view, build() is only called after a change
+	def encode(self, view, build):
+		return self.encodeVersion(view, build)[1]
+
+	# Return the version and the encoded response of a view
+	def encodeVersion(self, view, build):
+		with self.lock:
+			cached=self.cache.get(view)
+			if cached is not None and cached[0] == self.version:
+				return cached
+
+			cached=(self.version, build().encode())
+			self.cache[view]=cached
+			return cached
 
-class recursivedefaultdict(defaultdict):
-    def __init__(self):
-        self.default_factory = type(self) 
-		
-ZoneConfig=recursivedefaultdict()
-SourceConfig=defaultdict(dict)
-ZoneCount=defaultdict(dict)
-ControllerType=defaultdict(dict)
 
 MQTT_TOPIC_DEFAULT="/riod"
 MQTT_TOPIC_DATA="/Data"
@@ -57,19 +344,74 @@ MQTT_TOPIC_ACK="/Ack"
 MQTT_TOPIC_CMD="/Cmd"
 MQTT_TOPIC_GET="/Get"
 MQTT_TOPIC_SET="/Set"
+MQTT_TOPIC_BATCH="/Batch"
+
+# Attributes of sources with the metadata of the playing media, published with QoSMedia
+MEDIA_ATTRIBUTES=frozenset(("channel", "channelName", "coverArtURL", "composerName", "genre", "artistName",
+	"albumName", "playlistName", "songName", "programServiceName", "radioText", "radioText2", "radioText3",
+	"radioText4", "playStatus", "sampleRate", "bitRate", "bitDepth", "playTime", "trackTime"))
+
+# Maximum volume of a zone and maximum number of VolumeUp/VolumeDown events of a relative
+# volume change, if the current volume is unknown
+VOLUME_MAX=50
+VOLUME_STEPS_MAX=20
+
+# Maximum time in seconds a long poll (GET /zoneconfig?since=<version>&timeout=<sec>) waits
+LONGPOLL_MAX=300
+
+# Maximum size in bytes of the body of a HTTP request, e.g. a batch of commands (POST /cmd)
+HTTP_BODY_MAX=65536
+
+# Maximum number of zones per controller type, all zones of a controller are requested at
+# once during discovery. Other types, as well as sources, are probed in steps.
+MODEL_ZONES={"MCA-C3": 6, "MCA-C5": 8, "MCA-66": 6, "MCA-88": 8, "MCA-88X": 8}
+DISCOVERY_ZONES=8
+DISCOVERY_SOURCES=8
+DISCOVERY_TIMEOUT=10
+
+# Reconnect to Russound: the first attempt is immediate, then the delay starts with
+# ReconnectDelay seconds and is doubled up to ReconnectMaxDelay, varied by +-RECONNECT_JITTER.
+# A WOL packet is only sent after WOLAfter failed attempts. A connection, which was lost
+# within RECONNECT_STABLE seconds, is not reconnected immediately.
+RECONNECT_JITTER=0.2
+RECONNECT_STABLE=30
+
+# Version of the format of the state file
+STATE_FILE_FORMAT=1
+
+# Size of the receive buffer of the RIO connection, large enough to read a complete burst
+# (e.g. all zones switched on at once) with a single recv
+RIO_RECV_BUFFER=65536
+
+# Bytes read from a device per turn of the event loop, so a long burst doesn't delay
+# the other connections for long (about 35 lines)
+RIO_LOOP_READ=1024
+
+# Capture file of the raw RIO traffic: a header (magic, monotonic and wall clock time in ns at
+# the start of the file), followed by records of the monotonic time in ns, the direction and
+# the length of the data, all little endian, followed by the data
+CAPTURE_MAGIC=b'RIOCAP1\n'
+CAPTURE_HEADER=struct.Struct('<8sQQ')
+CAPTURE_RECORD=struct.Struct('<QcI')
+CAPTURE_RECEIVED=b'<'
+CAPTURE_SENT=b'>'
+CAPTURE_CONNECT=b'*'
 
 #//// Init section ////
 debugLevel=0
 debugTarget=0
 debugHex=0
+sender=None
+commandWriter=None
+webserver=None
+mqttWorkers=None
+mqtt_client=None
+eventLoop=None
+devices={} # name: Device, the first is the default device
+defaultDevice=None
 ConvertErrorStr=""
 ConvertErrorHex=""
 ConvertErrorDate=datetime.datetime(1970,1,1)
-ConnectErrorDate=ConvertErrorDate
-LastReadDateTime=datetime.datetime.now()
-TimebetweenRead=LastReadDateTime-LastReadDateTime
-MaxTimeReadDiff=TimebetweenRead
-MaxTimeReadDiffDate=LastReadDateTime
 
 
 # Convert Umlaut from according to IEC 62106 Annex E table 1 translate to ISO_8859-15
@@ -92,30 +434,368 @@ def str2hex(str):
 	return hexstr
 
 # Print Debug message to syslog or screen
-def debugFunction(level, msg):
-	global debugHex
+# Debug messages are only formatted, if their level is enabled. Arguments are formatted
+# with %, a callable argument is called first, e.g.
+# debugFunction(3, "SOURCECONFIG: %s", lambda: json.dumps(SourceConfig))
+def debugFunction(level, msg, *args):
+	if level > debugLevel or (debugTarget != 1 and debugTarget != 2):
+		return
+
+	if args:
+		msg=msg % tuple(arg() if callable(arg) else arg for arg in args)
+
+	debugLog.put(msg)
+
+# Debug messages are written to syslog or stdout by the thread of DebugLog, so the reader
+# never blocks on syslog. If more than size messages are waiting, the oldest are dropped.
+class DebugLog:
+	def __init__(self, size=1024):
+		self.queue=deque(maxlen=size)
+		self.condition=threading.Condition()
+		self.dropped=0
+
+	def put(self, msg):
+		with self.condition:
+			if len(self.queue) == self.queue.maxlen:
+				self.dropped += 1
+			self.queue.append(msg)
+			self.condition.notify()
+
+	def status(self):
+		with self.condition:
+			return {"QueueDepth": len(self.queue), "Dropped": self.dropped}
+
+	def run(self):
+		while True:
+			with self.condition:
+				while not self.queue:
+					self.condition.wait()
+
+				msgs=list(self.queue)
+				self.queue.clear()
 
-	if debugTarget == 1:
-		if level <= debugLevel:
+			for msg in msgs:
+				self.write(msg)
+
+	def write(self, msg):
+		if debugTarget == 1:
 			syslog.syslog(msg)
 
-	if debugTarget == 2:
-		if level <= debugLevel:
+		elif debugTarget == 2:
 			print(msg)
 			if debugHex == 1:
 				print(str2hex(msg))
-		
+
+debugLog=DebugLog()
+
+# Counters and histograms, served on /metrics in the Prometheus text format.
+# Every metric is updated by a single thread only (the reader, the web service or the
+# sender), so no lock is needed, except a SharedCounter. Threads running concurrently to
+# them, e.g. the connect and discovery of a device, must not update metrics. Values of
+# other objects (e.g. queue depths) are read by collectors.
+class Counter:
+	def __init__(self, name, help, labels=()):
+		self.name=name
+		self.help=help
+		self.labels=labels
+		self.values=defaultdict(int) # label values: count
+
+	def inc(self, labels=(), amount=1):
+		self.values[labels] += amount
+
+	def render(self):
+		lines=['# HELP %s %s' % (self.name, self.help), '# TYPE %s counter' % self.name]
+		for labels, value in list(self.values.items()):
+			lines.append('%s%s %s' % (self.name, labelText(self.labels, labels), value))
+		return lines
+
+# Counter updated by several threads
+class SharedCounter(Counter):
+	def __init__(self, name, help, labels=()):
+		Counter.__init__(self, name, help, labels)
+		self.lock=threading.Lock()
+
+	def inc(self, labels=(), amount=1):
+		with self.lock:
+			self.values[labels] += amount
+
+class Histogram:
+	def __init__(self, name, help, buckets, labels=()):
+		self.name=name
+		self.help=help
+		self.buckets=buckets
+		self.labels=labels
+		self.values={} # label values: [count per bucket, sum, count]
+
+	def observe(self, value, labels=(), count=1):
+		entry=self.values.get(labels)
+		if entry is None:
+			entry=self.values[labels]=[[0] * (len(self.buckets) + 1), 0, 0]
+		entry[0][bisect.bisect_left(self.buckets, value)] += count
+		entry[1] += value * count
+		entry[2] += count
+
+	def render(self):
+		lines=['# HELP %s %s' % (self.name, self.help), '# TYPE %s histogram' % self.name]
+		for labels, (counts, total, count) in list(self.values.items()):
+			cumulative=0
+			for le, bucket in zip(self.buckets + (float('inf'),), counts):
+				cumulative += bucket
+				lines.append('%s_bucket%s %d' % (self.name,
+					labelText(self.labels + ('le',), labels + ('+Inf' if le == float('inf') else repr(le),)), cumulative))
+			lines.append('%s_sum%s %r' % (self.name, labelText(self.labels, labels), total))
+			lines.append('%s_count%s %d' % (self.name, labelText(self.labels, labels), count))
+		return lines
+
+def labelText(names, values):
+	if not names:
+		return ''
+	return '{' + ','.join('%s="%s"' % (name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+		for name, value in zip(names, values)) + '}'
+
+class Metrics:
+	def __init__(self):
+		self.metrics=[]
+		self.collectors=[] # function returning (name, help, type, [(labels dict, value)])
+
+	def counter(self, name, help, labels=(), shared=False):
+		self.metrics.append((SharedCounter if shared else Counter)(name, help, labels))
+		return self.metrics[-1]
+
+	def histogram(self, name, help, buckets, labels=()):
+		self.metrics.append(Histogram(name, help, buckets, labels))
+		return self.metrics[-1]
+
+	def render(self):
+		lines=[]
+		for metric in self.metrics:
+			lines += metric.render()
+		for collector in self.collectors:
+			for name, help, kind, samples in collector():
+				lines += ['# HELP %s %s' % (name, help), '# TYPE %s %s' % (name, kind)]
+				for labels, value in samples:
+					lines.append('%s%s %s' % (name, labelText(tuple(labels), tuple(labels.values())), value))
+		return '\n'.join(lines) + '\n'
+
+LATENCY_BUCKETS=(0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+metrics=Metrics()
+metricLines=metrics.counter("riod_lines_total", "Lines received from Russound by type", ("type",))
+metricUnchanged=metrics.counter("riod_lines_unchanged_total", "Notifications with an unchanged value, not applied", ("type",))
+metricParse=metrics.histogram("riod_parse_seconds", "Time to parse and apply a line, averaged per burst",
+	(0.000001, 0.0000025, 0.000005, 0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.001))
+metricBurstLines=metrics.histogram("riod_recv_burst_lines", "Complete lines per read from Russound",
+	(1, 2, 5, 10, 20, 50, 100, 200, 500, 1000))
+metricBurstBytes=metrics.histogram("riod_recv_burst_bytes", "Bytes per read from Russound",
+	(64, 256, 1024, 4096, 16384, 65536))
+metricPublish=metrics.histogram("riod_publish_seconds", "Time from queueing to sending a message per remote target",
+	LATENCY_BUCKETS, ("target",))
+metricHTTP=metrics.histogram("riod_http_request_seconds", "Latency of HTTP requests per route", LATENCY_BUCKETS, ("route",))
+metricMQTT=metrics.counter("riod_mqtt_messages_total", "MQTT messages received (in) and published (out)", ("direction",),
+	shared=True)
+metricReconnect=metrics.histogram("riod_reconnect_seconds", "Time from the loss of the connection to Russound to WATCH",
+	(0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300))
+
 # Alle network packages are send via send2Network, either with tcp, udp or mqtt
-def send2Network(options, msg, QoS=0): 
+# The message is queued and send by the thread of NetworkSender, so the caller never
+# blocks on network I/O. Messages with a key replace a queued message with the same key,
+# if the overflow policy is coalesce (e.g. the latest snapshot of ZoneConfig).
+def send2Network(options, msg, QoS=0, key=None): 
 
-	debugFunction(3, "send2Network: " + options + " - Msg: " + msg[0:30])
+	debugFunction(3, "send2Network: %s - Msg: %.30s", options, msg)
 
-	res=options.split(':') # tcp:127.0.0.1:5001
-	prot=res[0].lower()
 	msg=msg.strip()
 		
 	if msg:
-		debugFunction(1, "send2Network: " + msg[0:10] + " with Protocol: " + prot)
+		if sender:
+			sender.put(options, msg, QoS, key)
+		else:
+			debugFunction(0, 'send2Network: sender not running, drop message for %s', options)
+
+	else:
+		debugFunction(0, 'Received empty string!')
+
+# Bounded send queue and pool of long-lived sockets to the remote targets.
+# If the queue is full, the oldest message is dropped (overflow=drop-oldest) or a queued
+# message with the same key is replaced first (overflow=coalesce).
+# A TCP target which is not reachable is retried with exponential backoff, messages for it
+# are dropped in the meantime.
+class NetworkSender:
+	def __init__(self, queueSize=256, overflow="drop-oldest", timeout=5, maxBackoff=60):
+		self.queueSize=queueSize
+		self.coalesce=(overflow == "coalesce")
+		self.timeout=timeout
+		self.maxBackoff=maxBackoff
+		self.queue=deque()
+		self.keys={}
+		self.condition=threading.Condition()
+
+		self.udp=None
+		self.tcp={} # (host, port): socket, StreamWriter on the event loop
+		self.backoff={} # (host, port): [retry time, delay]
+		self.loop=None # Event loop of serve, otherwise the thread of run
+		self.wakeup=None
+
+		self.sent=defaultdict(int)
+		self.dropped=defaultdict(int)
+		self.coalesced=0
+		self.maxDepth=0
+
+	def put(self, options, msg, QoS=0, key=None):
+		with self.condition:
+			if self.coalesce and key is not None and key in self.keys:
+				self.keys[key][1:4]=[options, msg, QoS] # Keeps the time of the first message
+				self.coalesced += 1
+				return
+
+			if len(self.queue) >= self.queueSize:
+				dropped=self.queue.popleft()
+				if dropped[0] is not None and self.keys.get(dropped[0]) is dropped:
+					del self.keys[dropped[0]]
+				self.dropped[dropped[1]] += 1
+
+			entry=[key, options, msg, QoS, time.monotonic()]
+			self.queue.append(entry)
+			if self.coalesce and key is not None:
+				self.keys[key]=entry
+
+			self.maxDepth=max(self.maxDepth, len(self.queue))
+			if self.loop is None:
+				self.condition.notify()
+			elif len(self.queue) == 1:
+				self.loop.call_soon_threadsafe(self.wakeup.set)
+
+	def status(self):
+		with self.condition:
+			return {"QueueDepth": len(self.queue), "MaxQueueDepth": self.maxDepth, "Sent": dict(self.sent),
+				"Dropped": dict(self.dropped), "Coalesced": self.coalesced}
+
+	# Returns the next queued entry, None if the queue is empty
+	def next(self):
+		with self.condition:
+			if not self.queue:
+				return None
+
+			entry=self.queue.popleft()
+			if entry[0] is not None and self.keys.get(entry[0]) is entry:
+				del self.keys[entry[0]]
+			return entry
+
+	def done(self, entry, result):
+		key, options, msg, QoS, queued=entry
+
+		with self.condition:
+			if result:
+				self.sent[options] += 1
+			else:
+				self.dropped[options] += 1
+
+		if result:
+			metricPublish.observe(time.monotonic() - queued, (options,))
+
+	def run(self):
+		while True:
+			with self.condition:
+				while not self.queue:
+					self.condition.wait()
+
+			entry=self.next()
+			self.done(entry, self.send(*entry[1:4]))
+
+	# Send all queued messages on the event loop. TCP targets are connected and written
+	# without blocking the loop, UDP and MQTT don't block anyway.
+	async def serve(self):
+		self.wakeup=asyncio.Event()
+		self.loop=asyncio.get_running_loop()
+
+		while True:
+			entry=self.next()
+			if entry is None:
+				await self.wakeup.wait()
+				self.wakeup.clear()
+				continue
+
+			key, options, msg, QoS, queued=entry
+			if options.split(':')[0].lower() == "tcp":
+				result=await self.sendTCP(options, msg)
+			else:
+				result=self.send(options, msg, QoS)
+			self.done(entry, result)
+
+	# Returns False, if a target is not retried yet after a failed connect
+	def retry(self, target):
+		retry=self.backoff.get(target)
+		return not retry or time.monotonic() >= retry[0]
+
+	def connected(self, target):
+		self.backoff.pop(target, None)
+		debugFunction(1, "NetworkSender: connected to tcp:" + target[0] + ":" + str(target[1]))
+
+	def failed(self, target, err):
+		retry=self.backoff.get(target)
+		delay=min(retry[1] * 2, self.maxBackoff) if retry else 1
+		self.backoff[target]=[time.monotonic() + delay, delay]
+		debugFunction(0, "EXCEPTION - NetworkSender connect tcp:" + target[0] + ":" + str(target[1]) + ": " + str(err) + \
+			", retry in " + str(delay) + " sec")
+
+	def connectTCP(self, host, port):
+		target=(host, port)
+		if not self.retry(target):
+			return None
+
+		try:
+			conn=socket.create_connection(target, self.timeout)
+			self.tcp[target]=conn
+			self.connected(target)
+			return conn
+		except Exception as err:
+			self.failed(target, err)
+			return None
+
+	# Send to a TCP target on the event loop
+	async def sendTCP(self, options, msg):
+		res=options.split(':') # tcp:127.0.0.1:5001
+		debugFunction(1, "send2Network: %.10s with Protocol: tcp", msg)
+
+		if not isinstance(msg, bytes):
+			msg=bytes(msg, "utf-8")
+
+		try:
+			target=(res[1], int(res[2]))
+		except Exception as err:
+			debugFunction(0, "EXCEPTION - send2Network: " + str(err))
+			return False
+
+		writer=self.tcp.get(target)
+		if writer is None:
+			if not self.retry(target):
+				return False
+			try:
+				reader, writer=await asyncio.wait_for(asyncio.open_connection(*target), self.timeout)
+				self.tcp[target]=writer
+				self.connected(target)
+			except Exception as err:
+				self.failed(target, err)
+				return False
+
+		try:
+			writer.write(msg)
+			await asyncio.wait_for(writer.drain(), self.timeout)
+			return True
+		except Exception as err:
+			debugFunction(0, "EXCEPTION - send2Network tcp:" + target[0] + ":" + str(target[1]) + ": " + str(err))
+			writer.close()
+			del self.tcp[target]
+			return False
+
+	def send(self, options, msg, QoS):
+		res=options.split(':') # tcp:127.0.0.1:5001
+		prot=res[0].lower()
+
+		debugFunction(1, "send2Network: %.10s with Protocol: %s", msg, prot)
+
+		if not isinstance(msg, bytes):
+			msg=bytes(msg, "utf-8")
 
 		if  prot == "mqtt":
 			try:
@@ -126,40 +806,47 @@ def send2Network(options, msg, QoS=0):
 				topic=MQTT_TOPIC_DEFAULT
 
 			try:
-				mqtt_client.publish(topic, bytes(msg, "utf-8"), QoS)
+				mqtt_client.publish(topic, msg, QoS)
+				metricMQTT.inc(("out",))
 				if debugHex:
-					mqtt_client.publish(topic, str2hex(msg), QoS)
+					mqtt_client.publish(topic, str2hex(msg.decode("utf-8", "ignore")), QoS)
+				return True
 
-			
 			except Exception as e:
 				debugFunction(0, "send2Network MQTT:" + str(e))
+				return False
 
-		else:
+		try:
 			host=res[1]
 			port=int(res[2])
 
-			try:
-				if prot == "udp":
-					s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM) # UDP
-					s.sendto(bytes(msg, "utf-8"), (host, port))
-
-				elif  prot == "tcp":
-					try:
-						s.sendall(bytes(msg, "utf-8"))
-					except:
-						s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-						s.connect((host, port))
-
-#					s.close
+			if prot == "udp":
+				if self.udp is None:
+					self.udp = socket.socket(socket.AF_INET, socket.SOCK_DGRAM) # UDP
+				self.udp.sendto(msg, (host, port))
+				return True
+
+			elif  prot == "tcp":
+				conn=self.tcp.get((host, port)) or self.connectTCP(host, port)
+				if conn is None:
+					return False
+
+				try:
+					conn.sendall(msg)
+					return True
+				except Exception as err:
+					debugFunction(0, "EXCEPTION - send2Network tcp:" + host + ":" + str(port) + ": " + str(err))
+					conn.close()
+					del self.tcp[(host, port)]
+					return False
 
-				else:
-					debugFunction(2, 'Illegal Protocol ' + msg)
+			else:
+				debugFunction(2, 'Illegal Protocol ' + prot)
 				
-			except Exception as err:
-					debugFunction(0, "EXCEPTION - send2Network: " + str(err))
+		except Exception as err:
+				debugFunction(0, "EXCEPTION - send2Network: " + str(err))
 
-	else:
-		debugFunction(0, 'Received empty string!')
+		return False
 
 def set_keepalive(sock, after_idle_sec=10, interval_sec=3, max_fails=3):
 	# Set TCP keepalive on an open socket.
@@ -175,100 +862,419 @@ def set_keepalive(sock, after_idle_sec=10, interval_sec=3, max_fails=3):
 	debugFunction(1, 'Socket Options defined: Idle (sec)=' + str(after_idle_sec) + \
 		', Interval (sec)=' + str(interval_sec) + ', MaxFail=' + str(max_fails))
 	
-# Connect TCP to Russound device
-def connectRussound(host, port):
-	global s, lastconnect, DeviceVersion, ZoneConfig, ZoneCount, ControllerType, SourceCount
+# Discovery of the topology with pipelined requests. All GET requests of a step are sent
+# at once and the replies are matched in order as they arrive:
+# 1. VERSION, type of all controllers and the first sources
+# 2. zones of a controller up to the maximum of its type, as soon as the type is known
+# Only if all probed zones or sources exist and the maximum is not known, the next ones
+# are probed.
+# With a known topology (e.g. from the state file) only VERSION is requested first. If the
+# version of the device matches, the known topology is taken without further requests.
+class Discovery:
+	def __init__(self, controllers, topology=None):
+		self.controllers=controllers
+		self.topology=topology if topology and topology.get("Controllers") == controllers else None
+		self.reused=False
+		self.version=""
+		self.types={}
+		self.zones={}
+		self.sources=0
+		self.pending=deque() # Expected replies in order of the requests: (kind, controller, index)
+		self.probed={} # Highest probed zone per controller, key None for sources
+		self.missing={} # Lowest missing zone per controller, key None for sources
+		self.complete=set() # Controllers with all zones of their type probed
+
+	# Returns the requests of the first step
+	def start(self):
+		requests=self.request("version", None, None, 'VERSION')
+		if self.topology:
+			return requests
+		return requests + self.discover()
+
+	# Requests of the type of all controllers and the first sources
+	def discover(self):
+		requests=''
+		for c in self.controllers:
+			requests += self.request("type", c, None, 'GET C[' + str(c) + '].type')
+		requests += self.probe(None, DISCOVERY_SOURCES)
+		return requests
+
+	@property
+	def done(self):
+		return not self.pending
+
+	def request(self, kind, controller, index, cmd):
+		self.pending.append((kind, controller, index))
+		return cmd + '\r'
+
+	# Request zones (controller) or sources (controller None) up to count
+	def probe(self, controller, count):
+		first=self.probed.get(controller, 0) + 1
+		self.probed[controller]=first + count - 1
+
+		requests=''
+		for i in range(first, first + count):
+			if controller is None:
+				requests += self.request("source", None, i, 'GET S[' + str(i) + '].name')
+			else:
+				requests += self.request("zone", controller, i, 'GET C[' + str(controller) + '].Z[' + str(i) + '].name')
+		return requests
+
+	# Process a reply, returns the requests of the next step
+	def feed(self, line):
+		if not line or line[0] not in 'SE' or not self.pending: # Not a reply, e.g. a notification
+			return ''
+
+		kind, controller, index=self.pending.popleft()
+		success=(line[0] == 'S')
+		res=line.split('"')
+		value=res[1] if success and len(res) > 1 else ""
+
+		if kind == "version":
+			self.version=value
+			if self.topology:
+				if value == self.topology.get("DeviceVersion"):
+					self.types=dict(self.topology["ControllerType"])
+					self.zones=dict(self.topology["ZoneCount"])
+					self.sources=self.topology["SourceCount"]
+					self.reused=True
+					return ''
+				return self.discover()
+
+		elif kind == "type":
+			self.types[controller]=value
+			if success:
+				if value in MODEL_ZONES:
+					self.complete.add(controller)
+				return self.probe(controller, MODEL_ZONES.get(value, DISCOVERY_ZONES))
 
-	connected=False
-	while not connected:
-		try:
-			s = socket.socket( socket.AF_INET, socket.SOCK_STREAM)
-			s.connect( (host, port))
-			debugFunction(0, 'Socket: ' + str(s))
-			connected=True
-		except socket.error:
-			debugFunction(0, 'error occured, try to wake device using WOL...')
+		else:
+			if not success:
+				self.missing[controller]=min(index, self.missing.get(controller, index))
+
+			# All probed zones (sources) answered?
+			if index == self.probed[controller]:
+				if controller not in self.missing and controller not in self.complete:
+					return self.probe(controller, DISCOVERY_SOURCES if controller is None else DISCOVERY_ZONES)
+
+				count=self.missing.get(controller, index + 1) - 1
+				if controller is None:
+					self.sources=count
+				else:
+					self.zones[controller]=count
+
+		return ''
+
+def discoverTopology(s, controllers, topology=None, capture=None):
+	discovery=Discovery(controllers, topology)
+	framer=RIOFramer(4096, capture, False) # Runs in the connect thread, concurrently to the reader
+
+	sendRussound(s, discovery.start().encode(), capture)
+	while not discovery.done:
+		requests=''
+		for line in framer.recv(s):
+			requests += discovery.feed(line.decode('iso-8859-15'))
+		if requests:
+			sendRussound(s, requests.encode(), capture)
+
+	return discovery
+
+# Send a WOL packet to wake the russound
+def wakeOnLan(macAddr):
+	addr_byte = macAddr.split(':')
+	hw_addr = struct.pack('BBBBBB', int(addr_byte[0], 16),
+		int(addr_byte[1], 16),
+		int(addr_byte[2], 16),
+		int(addr_byte[3], 16),
+		int(addr_byte[4], 16),
+		int(addr_byte[5], 16))
+
+	msg = b'\xff' * 6 + hw_addr * 16
+	debugFunction(0, 'try to send WOL packet.')
+
+	# send magic packet
+	dgramSocket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+	dgramSocket.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+	dgramSocket.sendto(msg, ("255.255.255.255", 9))
+	dgramSocket.close()
+
+# Delay before the next attempt after a number of failed attempts
+def reconnectDelay(failures):
+	delay=min(reconnectInitial * 2 ** (failures - 1), reconnectMax)
+	return delay * random.uniform(1 - RECONNECT_JITTER, 1 + RECONNECT_JITTER)
+
+# A Russound device, e.g. a MCA-C5 with further controllers, with its own connection,
+# state, remote targets and MQTT topic. The device of section [Common] is the default
+# device, further devices are defined in sections [Device <name>]. The sockets of all
+# devices are read by the event loop (EventLoop) or by the thread of watchRussound, only a
+# (re)connect runs in a thread of its own while it lasts.
+class Device:
+	def __init__(self, name, host, port=9621, controllers=None, topic=MQTT_TOPIC_DEFAULT, remoteTargets=None):
+		self.name=name
+		self.host=host
+		self.port=port
+		self.controllers=["1"] if controllers is None else controllers
+		self.topic=topic
+		self.remoteTargets={} if remoteTargets is None else remoteTargets
+		self.macAddr=None
+		self.ignorezones=[]
+		self.ignoresources=[]
+		self.stateFile=None
+		self.capture=None
+		self.attributes=None
+		self.publisher=None
+		self.sock=None
+		self.framer=RIOFramer()
+
+		self.state=StateStore()
+		self.zoneCount=defaultdict(dict)
+		self.controllerType=defaultdict(dict)
+		self.version=""
+		self.status=""
+		self.sourceCount=0
+		self.topology=None
+		self.warmStart=False # State loaded from the state file, not yet sent to the remote targets
+
+		self.lastconnect=ConvertErrorDate
+		self.connectErrorDate=ConvertErrorDate
+		self.lost=None # Monotonic time the connection was lost
+		self.reconnects=0
+		self.connectFailures=0
+		self.lastRead=""
+		self.lastReadDateTime=datetime.datetime.now()
+		self.timeBetweenRead=datetime.timedelta(0)
+		self.maxTimeReadDiff=self.timeBetweenRead
+		self.maxTimeReadDiffDate=self.lastReadDateTime
+
+	# Connect TCP to Russound device, retried until the device is connected and watched
+	def connect(self):
+		commandWriter.detach(self)
+
+		failures=0
+		if (datetime.datetime.now() - self.lastconnect).total_seconds() < RECONNECT_STABLE:
+			failures=1 # Connection was not stable, don't retry immediately
+			time.sleep(reconnectDelay(failures))
+
+		while True:
+			s=None
+			try:
+				s=socket.create_connection((self.host, self.port), DISCOVERY_TIMEOUT)
+				s.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+				debugFunction(0, self.name + ': Socket: ' + str(s))
+				if self.capture:
+					self.capture.put(CAPTURE_CONNECT, (self.host + ':' + str(self.port)).encode())
+
+				self.init(s)
+				self.sock=s
+				return s
+
+			except Exception as err:
+				if s:
+					s.close()
+
+				failures += 1
+				self.connectFailures += 1
+				delay=reconnectDelay(failures)
+				debugFunction(0, self.name + ': Connect to Russound failed (' + str(failures) + '): ' + str(err) + \
+					', retry in %.1f secs..' % delay)
+
+				if self.macAddr and failures >= wolAfter:
+					wakeOnLan(self.macAddr)
+
+				time.sleep(delay)
+
+	# Discover the topology and enable WATCH of all zones and sources
+	def init(self, s):
+		# Read version, type and zones of each connected Controller and number of sources,
+		# unless the version matches the last known topology
+		s.settimeout(DISCOVERY_TIMEOUT)
+		discovery=discoverTopology(s, self.controllers, self.topology, self.capture)
+		s.settimeout(None)
+
+		self.version = discovery.version
+		debugFunction(0, self.name + ': Version of device: ' + self.version)
+		if discovery.reused:
+			debugFunction(0, self.name + ': Topology unchanged, discovery skipped')
+
+		for c in self.controllers: 
+			self.controllerType[c] = discovery.types.get(c, "")
+			self.zoneCount[c] = discovery.zones.get(c, 0)
+			debugFunction(0, self.name + ': Type of device: ' + self.controllerType[c])
+			debugFunction(0, self.name + ": ZoneCount=" + str(self.zoneCount[c]))
+
+		self.sourceCount = discovery.sources
+		debugFunction(0, self.name + ": SourceCount=" + str(self.sourceCount))
+
+		self.topology=self.topologySnapshot()
+				
+		debugFunction(0, self.name + ': WATCH SYSTEM ON')
+		sendRussound(s, 'WATCH SYSTEM ON\r'.encode(), self.capture)
+		self.lastconnect=datetime.datetime.now() 
+		self.state.touch()
 			
-			if macAddr:
-				#////// try to wake the russound ////////////////////////////
+		# Enable WATCH for all zones
+		watch=[]
+		for c in self.controllers:
+			for l in range(1, self.zoneCount[c]+1):
+				if l in self.ignorezones: # Test Zone in ignore list
+					debugFunction(1, self.name + ': Ignore Zone ' + str(l))
+				else:
+					watch.append('WATCH C[' + str(c) + '].Z[' + str(l) + '] ON\r')
 				
-				addr_byte = macAddr.split(':')
-				hw_addr = struct.pack('BBBBBB', int(addr_byte[0], 16),
-					int(addr_byte[1], 16),
-					int(addr_byte[2], 16),
-					int(addr_byte[3], 16),
-					int(addr_byte[4], 16),
-					int(addr_byte[5], 16))
-
-				msg = b'\xff' * 6 + hw_addr * 16
-				debugFunction(0, 'try to send WOL packet.')
-		
-				# send magic packet
-				dgramSocket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-				dgramSocket.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
-				dgramSocket.sendto(msg, ("255.255.255.255", 9))
-
-			debugFunction(0, 'Wait for 60 secs..')
-			time.sleep(60)
-
-	s.send('VERSION\r'.encode())
-	res = s.recv(1024).decode().split('"')
-	DeviceVersion = res[1]
-	debugFunction(0, 'Version of device: ' + DeviceVersion)
-	
-	# Read config for each connected Controller
-	for c in controllers: 
-		s.send(('GET C[' + str(c) + '].type\r').encode())
-		res = s.recv(1024).decode().split('"')
-		ControllerType[c] = res[1]
-		debugFunction(0, 'Type of device: ' + ControllerType[c])
-
-		# Read zones of a Controller
-		ZoneCount[c]=0
-		while True:
-			s.send(('GET C[' + str(c) + '].Z[' + str(ZoneCount[c]+1) + '].name\r').encode())
-			res = s.recv(1024).decode()
-			if res[0] == 'S': #Success
-				ZoneCount[c] += 1
+		# Enable WATCH for all sources
+		for l in range(1, self.sourceCount+1):
+			if l in self.ignoresources: # Test Source in ignore list
+				debugFunction(1, self.name + ': Ignore Source ' + str(l))
 			else:
-				debugFunction(0, "ZoneCount=" + str(ZoneCount[c]))
-				break
+				watch.append('WATCH S[' + str(l) + '] ON\r')
 
-	# Read Number if Sources
-	SourceCount=0
-	while True:
-		s.send(('GET S[' + str(SourceCount+1) + '].name\r').encode())
-		res = s.recv(1024).decode()
-		if res[0] == 'S': #Success
-			SourceCount += 1
-		else:
-			debugFunction(0, "SourceCount=" + str(SourceCount))
-			break
-			
-	debugFunction(0, 'WATCH SYSTEM ON')
-	s.send('WATCH SYSTEM ON\r'.encode())
-	lastconnect=datetime.datetime.now() 
+		sendRussound(s, ''.join(watch).encode(), self.capture)
 		
-	# Enable WATCH for all zones
-	for c in controllers:
-		for l in range(1, ZoneCount[c]+1):
-			try:
-				ignorezones.index(l) # Test Zone in ignore list
-				debugFunction(1, 'Ignore Zone ' + str(l))
-			except:
-				s.send(('WATCH C[' + str(c) + '].Z[' + str(l) + '] ON\r').encode())
-			
-	# Enable WATCH for all sources
-	for l in range(1, SourceCount+1):
+		# Set TCP timeout to reconnect in case of a network outtage
+		set_keepalive(s)
+
+		commandWriter.attach(self, s)
+		return s	 
+
+	# Read and process the lines received from the connected device
+	def read(self, limit=0):
+		result = self.framer.recv(self.sock, limit)
+		debugFunction(2, 'Read: %s', result)
+
+		self.timeBetweenRead=datetime.datetime.now() - self.lastReadDateTime
+		
+		if self.maxTimeReadDiff < self.timeBetweenRead:
+			self.maxTimeReadDiff=self.timeBetweenRead
+			self.maxTimeReadDiffDate=datetime.datetime.now()
+
+		self.lastReadDateTime=datetime.datetime.now() 
+
+		processLines(self, result)
+
+	# Connection to the device is lost, all values are stale until it is connected again
+	def drop(self, err):
+		self.connectErrorDate=datetime.datetime.now()
+		debugFunction(0, "EXCEPTION - connection to Russound " + self.name + ": " + str(err))
+		self.state.markStale()
+		self.publisher.flush(True)
+		self.framer.reset()
+		self.sock.close()
+		self.sock=None
+		self.lost=time.monotonic()
+
+	# Connected device is handed over to the read loop
+	def connected(self):
+		if self.lost is not None:
+			self.reconnects += 1
+			metricReconnect.observe(time.monotonic() - self.lost)
+			self.lost=None
+
+		if self.warmStart:
+			self.warmStart=False
+			self.announce()
+
+	# Send the whole state once to the remote targets after a warm start. The device replays
+	# the loaded values, so there would be no change to publish. Later reconnects send changes only.
+	def announce(self):
+		debugFunction(1, self.name + ': send loaded state to the remote targets')
+		self.publisher.markDirty("ZoneConfig")
+		self.publisher.markDirty("SourceConfig")
+
+		for n, source in self.state.sourcesJSON().items():
+			for attribute, value in source.items():
+				if attribute in self.remoteTargets and isinstance(value, str):
+					send2Network(self.remoteTargets[attribute], value, key=self.name + attribute + n)
+
+	# Publisher of the changes to the remote targets, the event streams and the attribute topics
+	def startPublisher(self):
+		self.publisher=SnapshotPublisher(self.remoteTargets,
+			{"ZoneConfig": self.state.zonesJSON, "SourceConfig": self.state.sourcesJSON},
+			publishDebounce, publishMaxLatency, publishSnapshotInterval, self.name)
+		if webserver:
+			self.publisher.listeners.append(functools.partial(webserver.broadcast, self))
+			self.state.touched.append(webserver.touched)
+		if self.attributes:
+			self.publisher.listeners.append(self.attributes.publish)
+
+	# Topology of the connected device, discovery is skipped if it is still the same
+	def topologySnapshot(self):
+		return {"Controllers": self.controllers, "DeviceVersion": self.version,
+			"ControllerType": dict(self.controllerType), "ZoneCount": dict(self.zoneCount), "SourceCount": self.sourceCount}
+
+	# Write topology and last known state to the state file. The file is replaced atomically,
+	# so a crash or power loss while writing leaves the previous one.
+	def saveState(self):
+		with self.state.lock:
+			saved=self.topology or self.topologySnapshot()
+			data=json.dumps({"Format": STATE_FILE_FORMAT,
+				"SavedDate": datetime.datetime.now().strftime("%d.%m.%Y %H:%M:%S"),
+				"Topology": saved, "DeviceStatus": self.status,
+				"ZoneConfig": self.state.zonesJSON(), "SourceConfig": self.state.sourcesJSON()}, separators=(',', ':'))
+
+		tmp=self.stateFile + '.tmp'
+		with open(tmp, 'w') as f:
+			f.write(data)
+			f.flush()
+			os.fsync(f.fileno())
+		os.replace(tmp, self.stateFile)
+
+	# Load topology and state from the state file, so HTTP and MQTT can answer before the
+	# device is connected. All loaded zones and sources are stale until the device sends them.
+	def loadState(self):
+		filename=self.stateFile
 		try:
-			ignoresources.index(l) # Test Source in ignore list
-			debugFunction(1, 'Ignore Source ' + str(l))
-		except:
-			s.send(('WATCH S[' + str(l) + '] ON\r').encode())
-	
-	# Set TCP timeout to reconnect in case of a network outtage
-	set_keepalive(s)
-	return s	 
+			with open(filename) as f:
+				saved=json.load(f)
+			if saved.get("Format") != STATE_FILE_FORMAT:
+				debugFunction(0, "loadState: unknown format of " + filename)
+				return False
+
+			State=self.state
+			with State.lock:
+				for c, zones in saved["ZoneConfig"].items():
+					for z, zone in zones.items():
+						if int(z) not in self.ignorezones:
+							for attribute, value in zone.items():
+								State.setZone(int(c), int(z), attribute, value, False)
+				for n, source in saved["SourceConfig"].items():
+					if int(n) not in self.ignoresources:
+						for attribute, value in source.items():
+							State.setSource(int(n), attribute, value, False)
+				State.markStale()
+				State.touch()
+
+			self.topology=saved["Topology"]
+			self.version=self.topology["DeviceVersion"]
+			self.controllerType.update(self.topology["ControllerType"])
+			self.zoneCount.update(self.topology["ZoneCount"])
+			self.sourceCount=self.topology["SourceCount"]
+			self.status=saved["DeviceStatus"]
+
+			debugFunction(0, "loadState: " + filename + " from " + saved["SavedDate"])
+			self.warmStart=True
+			return True
+
+		except FileNotFoundError:
+			debugFunction(1, "loadState: " + filename + " not found")
+		except Exception as err:
+			debugFunction(0, "EXCEPTION - loadState: " + str(err))
+		return False
+
+# Write the state file of each device every interval seconds, if its state changed
+def StateService(devices, interval):
+	saved={device.name: device.state.version for device in devices}
+	while True:
+		time.sleep(interval)
+		for device in devices:
+			if device.state.version == saved[device.name]:
+				continue
+
+			try:
+				saved[device.name]=device.state.version
+				device.saveState()
+				debugFunction(2, "StateService: state version " + str(saved[device.name]) + " written to " + device.stateFile)
+			except Exception as err:
+				debugFunction(0, "EXCEPTION - StateService: " + str(err))
 
 #translate IEC 62106 to ISO_8859-15
 def checkCharSet(line):
@@ -278,7 +1284,7 @@ def checkCharSet(line):
 	try:
 		rc=line.translate(transtab)
 	except Exception as err:
-		debugFunction(0, "EXCEPTION - CheckCharSet: " + str(err))
+		debugFunction(0, "EXCEPTION - CheckCharSet: %s", err)
 
 	try:
 		line = rc.decode('iso-8859-15') 
@@ -286,325 +1292,1228 @@ def checkCharSet(line):
 		line = rc.decode('iso-8859-15', 'ignore')
 		ConvertErrorHex=''.join(hex(ord(x))[2:] for x in rc)
 		debugFunction (0, ConvertErrorHex)
-		debugFunction(0, 'Convert Error: ' + rc)
+		debugFunction(0, 'Convert Error: %s', rc)
 		ConvertErrorStr=rc
 		ConvertErrorDate=datetime.datetime.now() 
 
 
 	return line
 
-def countActiveSources():	
-	if bool(SourceConfig):
+# Send data to Russound, the data is written to capture if given
+def sendRussound(sock, data, capture=None):
+	if capture:
+		capture.put(CAPTURE_SENT, data)
+	sock.sendall(data)
+
+# Capture of the raw RIO traffic of a device, enabled with [Capture] File for the default
+# device or Capture in the section of a device. Every received chunk and
+# every sent command is recorded with its monotonic time (see CAPTURE_HEADER), e.g. to
+# replay it with bench/riosim.py or to profile the parser offline.
+# The reader only appends the records to a list, they are written every interval seconds
+# by the thread of CaptureLog. If more than maxPending bytes are waiting, records are dropped.
+# A file larger than maxSize is renamed to file.1 (file.1 to file.2 ...), at most files
+# old files are kept. Monotonic times of different runs don't match, so every start of
+# riod.py begins a new file.
+class CaptureLog:
+	def __init__(self, filename, maxSize=10485760, files=3, interval=1, maxPending=4194304):
+		self.filename=filename
+		self.maxSize=maxSize
+		self.files=files
+		self.interval=interval
+		self.maxPending=maxPending
+		self.lock=threading.Lock()
+		self.records=[]
+		self.pending=0
+		self.file=None
+		self.size=0
+		self.written=0
+		self.dropped=0
+		self.rotations=0
+
+	def put(self, direction, data):
+		with self.lock:
+			if self.pending + len(data) > self.maxPending:
+				self.dropped += 1
+				return
+
+			self.records.append((time.monotonic_ns(), direction, data))
+			self.pending += len(data)
+
+	def status(self):
+		return {"File": self.filename, "Written": self.written, "Dropped": self.dropped, "Rotations": self.rotations}
+
+	def run(self):
+		while True:
+			time.sleep(self.interval)
+			with self.lock:
+				records=self.records
+				self.records=[]
+				self.pending=0
+
+			if records:
+				try:
+					self.write(records)
+				except Exception as err:
+					debugFunction(0, "EXCEPTION - CaptureLog: " + str(err))
+					self.dropped += len(records)
+					self.close()
+
+	def write(self, records):
+		for stamp, direction, data in records:
+			if self.file is None:
+				self.open()
+			elif self.size + CAPTURE_RECORD.size + len(data) > self.maxSize and self.size > CAPTURE_HEADER.size:
+				self.close()
+				self.open()
+
+			self.file.write(CAPTURE_RECORD.pack(stamp, direction, len(data)))
+			self.file.write(data)
+			self.size += CAPTURE_RECORD.size + len(data)
+			self.written += CAPTURE_RECORD.size + len(data)
+
+		self.file.flush()
+
+	# An existing file is rotated first, e.g. of a previous run or after a write error,
+	# so a capture is never truncated
+	def open(self):
+		if os.path.exists(self.filename):
+			self.rotate()
+
+		self.file=open(self.filename, 'wb')
+		self.file.write(CAPTURE_HEADER.pack(CAPTURE_MAGIC, time.monotonic_ns(), time.time_ns()))
+		self.size=CAPTURE_HEADER.size
+
+	def close(self):
+		if self.file:
+			self.file.close()
+			self.file=None
+
+	# Keep the current file as file.1 and the older ones as file.2 up to file.<files>
+	def rotate(self):
+		self.rotations += 1
+		if self.files < 1:
+			os.remove(self.filename)
+			return
+
+		for i in range(self.files - 1, 0, -1):
+			if os.path.exists(self.filename + '.' + str(i)):
+				os.replace(self.filename + '.' + str(i), self.filename + '.' + str(i + 1))
+		os.replace(self.filename, self.filename + '.1')
+
+# Split the byte stream of the RIO connection into complete lines.
+# Data is received with recv_into into a preallocated buffer. An incomplete line at the
+# end of a chunk is kept as tail at the start of the buffer and completed by the next read.
+class RIOFramer:
+	def __init__(self, size=RIO_RECV_BUFFER, capture=None, metrics=True):
+		self.buffer=bytearray(size)
+		self.view=memoryview(self.buffer)
+		self.tail=0
+		self.capture=capture # Received data is written to the CaptureLog
+		self.metrics=metrics # False in threads other than the reader, e.g. of discovery
+		self.received=0 # Bytes of the last recv
+
+	# Drop an incomplete line, e.g. after a reconnect
+	def reset(self):
+		self.tail=0
+
+	# A single line does not fit into the buffer, double the size
+	def grow(self):
+		self.view.release()
+		self.buffer.extend(bytes(len(self.buffer)))
+		self.view=memoryview(self.buffer)
+		debugFunction(1, "RIOFramer: buffer increased to %d", len(self.buffer))
+
+	# Read from socket and return all complete lines, at most limit bytes are read
+	def recv(self, sock, limit=0):
+		if self.tail == len(self.buffer):
+			self.grow()
+
+		count=sock.recv_into(self.view[self.tail:], limit)
+		if count == 0:
+			raise ConnectionError("connection closed by peer")
+		self.received=count
+		if self.metrics:
+			metricBurstBytes.observe(count)
+		if self.capture:
+			self.capture.put(CAPTURE_RECEIVED, self.view[self.tail:self.tail + count].tobytes())
+
+		return self.split(self.tail + count)
+
+	# Add already received data and return all complete lines
+	def feed(self, data):
+		while self.tail + len(data) > len(self.buffer):
+			self.grow()
+
+		end=self.tail + len(data)
+		self.view[self.tail:end]=data
+		return self.split(end)
+
+	def split(self, end):
+		last=self.buffer.rfind(b'\r\n', 0, end)
+		if last < 0: # No complete line yet
+			self.tail=end
+			return []
+
+		lines=self.view[:last].tobytes().split(b'\r\n')
+
+		self.tail=end - last - 2
+		if self.tail:
+			self.buffer[:self.tail]=self.view[last+2:end].tobytes()
+
+		return [line for line in lines if line]
+
+# Notification of the RIO protocol, e.g.
+# N System.status="ON", N C[1].Z[12].volume="20" or N S[3].name="Tuner"
+RIO_NOTIFICATION=re.compile(r'N (?:System|C\[(\d+)\]\.Z\[(\d+)\]|S\[(\d+)\])\.(\w+)="(.*)"$')
+
+EVENT_SYSTEM="system"
+EVENT_ZONE="zone"
+EVENT_SOURCE="source"
+
+# Labels of the lines by type for metricLines
+LINE_TYPES={EVENT_SYSTEM: (EVENT_SYSTEM,), EVENT_ZONE: (EVENT_ZONE,), EVENT_SOURCE: (EVENT_SOURCE,),
+	'S': ("reply",), 'E': ("error",), 'N': ("invalid",)}
+
+# Parsed notification. index is the zone or source number, controller is only set for zones
+RIOEvent=namedtuple('RIOEvent', 'kind controller index attribute value')
+
+# Classify a notification line in one pass, returns None for all other lines
+def parseNotification(line):
+	match=RIO_NOTIFICATION.match(line)
+	if match is None:
+		return None
+
+	controller, zone, source, attribute, value=match.groups()
+
+	if zone is not None:
+		return RIOEvent(EVENT_ZONE, controller, zone, attribute, value)
+	if source is not None:
+		return RIOEvent(EVENT_SOURCE, None, source, attribute, value)
+	return RIOEvent(EVENT_SYSTEM, None, None, attribute, value)
+
+# Decoded and parsed lines by their raw bytes. Tuner sources repeat the same RDS lines
+# (radioText, programServiceName) every few seconds, a cached line is neither translated,
+# decoded nor parsed again. If more than size lines are cached, the least recently used
+# one is dropped. Only used by the read loop.
+class ParseCache:
+	def __init__(self, size=1024):
+		self.size=size
+		self.lines=OrderedDict() # raw line: (line, RIOEvent or None)
+		self.hits=0
+		self.misses=0
+
+	# Returns the decoded line and its event, None for lines other than notifications
+	def get(self, raw):
+		entry=self.lines.get(raw)
+		if entry is not None:
+			self.lines.move_to_end(raw)
+			self.hits += 1
+			return entry
+
+		self.misses += 1
+		line=checkCharSet(raw)
+		entry=(line, parseNotification(line))
+		if self.size:
+			self.lines[raw]=entry
+			if len(self.lines) > self.size:
+				self.lines.popitem(last=False)
+		return entry
+
+	def status(self):
+		return {"Size": len(self.lines), "MaxSize": self.size, "Hits": self.hits, "Misses": self.misses}
+
+parseCache=ParseCache()
+
+# Count active zones of each source, returns the changes of SourceConfig
+def countActiveSources(State):
+	return [change for change in State.updateActiveZones() if change is not None]
+
+# Collect changes of ZoneConfig and SourceConfig and publish one snapshot per burst.
+# A snapshot is sent when no further change arrived for debounce seconds (0 = at the end
+# of each read from Russound), but at the latest maxLatency seconds after its first change.
+#
+# Remote targets with the option delta (e.g. ZoneConfig=udp:127.0.0.1:5002:delta) get only
+# the changes as JSON patch with a sequence number {"seq": 12, "patch": [{"op": "replace",
+# "path": "/1/5/volume", "value": "23"}]}. The full snapshot {"seq": 13, "snapshot": {...}}
+# is sent every snapshotInterval seconds and on request, so a gap in seq can be detected
+# and resolved by the receiver.
+#
+# Listeners, e.g. the event stream of the web service, are called with the same coalesced
+# changes as listener(name, patch).
+class SnapshotPublisher:
+	def __init__(self, remoteTargets, snapshots, debounce=0, maxLatency=0.5, snapshotInterval=300, deviceName=""):
+		self.remoteTargets=remoteTargets
+		self.deviceName=deviceName # Prefix of the coalesce key, devices may share a remote target
+		self.snapshots=snapshots # Name of remote target: function returning the dict to be sent as JSON
+		self.debounce=debounce
+		self.maxLatency=maxLatency
+		self.snapshotInterval=snapshotInterval
+		self.dirty={}
+		self.firstChange=0
+		self.lastChange=0
+
+		self.delta={}
+		for name in snapshots:
+			if name in remoteTargets and remoteTargets[name].split(':')[-1].lower() == "delta":
+				self.delta[name]=True
+		self.patches=defaultdict(dict)
+		self.seq=defaultdict(int)
+		self.nextSnapshot=0 # Initial snapshot with the first flush
+		self.resync=False
+		self.listeners=[]
+
+		# Wake up the read loop on a resync request from another thread
+		self.wakeup, self.wakeupSend=socket.socketpair()
+		self.wakeup.setblocking(False)
+
+	def markDirty(self, name):
+		if name not in self.remoteTargets and not self.listeners:
+			return
+
+		now=time.monotonic()
+		if not self.dirty:
+			self.firstChange=now
+		self.lastChange=now
+		self.dirty[name]=True
+
+	# Record a change returned by State.setZone or State.setSource
+	def change(self, name, change):
+		if change is None or (name not in self.remoteTargets and not self.listeners):
+			return
+
+		if name in self.delta or self.listeners:
+			patch=self.patches[name]
+			if change["path"] in patch and patch[change["path"]]["op"] == "add":
+				change["op"]="add"
+			patch[change["path"]]=change
+
+		self.markDirty(name)
+
+	# Send a snapshot to all delta targets, can be called by any thread
+	def requestSnapshot(self):
+		self.resync=True
+		self.wakeupSend.send(b'\0')
+
+	# Seconds until the next snapshot is due, None if nothing is pending
+	def timeout(self):
+		if self.delta:
+			snapshot=max(0, self.nextSnapshot - time.monotonic())
+		else:
+			snapshot=None
+
+		if not self.dirty:
+			return snapshot
+
+		due=self.dirtyTimeout()
+		return due if snapshot is None else min(due, snapshot)
+
+	# Seconds until the changes of a burst, which is still being received, are due,
+	# None if nothing is pending
+	def burstTimeout(self):
+		if not self.dirty:
+			return None
+		return max(0, self.firstChange + self.maxLatency - time.monotonic())
+
+	def dirtyTimeout(self):
+		return max(0, min(self.lastChange + self.debounce, self.firstChange + self.maxLatency) - time.monotonic())
+
+	def publish(self, name, msg):
+		self.seq[name] += 1
+		msg["seq"]=self.seq[name]
+		send2Network(self.remoteTargets[name], json.dumps(msg))
+
+	def flush(self, force=False):
+		now=time.monotonic()
+		snapshot=self.delta and (self.resync or now >= self.nextSnapshot)
+
+		# Pending changes first, a following snapshot includes them anyway
+		if self.dirty and (force or snapshot or self.dirtyTimeout() <= 0):
+			names=list(self.dirty)
+			self.dirty.clear()
+
+			for name in names:
+				debugFunction(2, "SnapshotPublisher: publish %s", name)
+
+				patch=list(self.patches[name].values())
+				self.patches[name].clear()
+
+				if name in self.delta:
+					if patch:
+						self.publish(name, {"patch": patch})
+				elif name in self.remoteTargets:
+					send2Network(self.remoteTargets[name], json.dumps(self.snapshots[name]()), key=self.deviceName + name)
+
+				if patch:
+					for listener in self.listeners:
+						listener(name, patch)
+
+		if snapshot:
+			self.resync=False
+			self.nextSnapshot=now + self.snapshotInterval
+
+			for name in self.delta:
+				debugFunction(2, "SnapshotPublisher: snapshot %s", name)
+				self.publish(name, {"snapshot": self.snapshots[name]()})
+
+# Every attribute of zones and sources as retained MQTT message on its own topic, e.g.
+# Russound/C1/Z5/volume or Russound/S3/radioText, enabled with [MQTT] Attributes.
+# The changes are received from SnapshotPublisher at the end of a burst. A topic is only
+# published if its value differs from the last published one. After a connect to the
+# broker all attributes are published again, the broker may have lost its retained messages.
+class AttributePublisher:
+	def __init__(self, topic, state, qosZone=1, qosSource=1, qosMedia=0):
+		self.topic=topic
+		self.state=state
+		self.qosZone=qosZone
+		self.qosSource=qosSource
+		self.qosMedia=qosMedia
+		self.published={} # topic: value
+		self.lock=threading.Lock()
+
+	# Listener of SnapshotPublisher, called with the JSON patch of ZoneConfig or SourceConfig
+	def publish(self, name, patch):
+		with self.lock:
+			for change in patch:
+				self.publishValue(name, change["path"].split('/')[1:], change["value"])
+
+	def republish(self):
+		with self.lock:
+			self.published.clear()
+			self.publishValue("ZoneConfig", [], self.state.zonesJSON())
+			self.publishValue("SourceConfig", [], self.state.sourcesJSON())
+
+	# The value of an added controller, zone or source is the dict of its attributes
+	def publishValue(self, name, path, value):
+		if isinstance(value, dict):
+			for key, item in value.items():
+				self.publishValue(name, path + [key], item)
+			return
+
+		if name == "ZoneConfig" and len(path) == 3:
+			topic=self.topic + "/C%s/Z%s/%s" % tuple(path)
+			QoS=self.qosZone
+		elif name == "SourceConfig" and len(path) == 2:
+			topic=self.topic + "/S%s/%s" % tuple(path)
+			QoS=self.qosMedia if path[1] in MEDIA_ATTRIBUTES else self.qosSource
+		else:
+			return
+
+		value=str(value)
+		if self.published.get(topic) == value:
+			return
+		self.published[topic]=value
+
 		try:
-			for s in SourceConfig:
-				SourceConfig[s]["activeZones"]=0
+			mqtt_client.publish(topic, value, QoS, retain=True)
+			metricMQTT.inc(("out",))
+		except Exception as e:
+			debugFunction(0, "AttributePublisher: " + str(e))
 
-			for controller in ZoneConfig:
-				for zone in ZoneConfig[controller]:
-					source=ZoneConfig[controller][zone]["currentSource"]
+# Process the complete lines of a read from a device, changes are collected by its publisher
+def processLines(device, lines):
+	State=device.state
+	publisher=device.publisher
+	remoteTargets=device.remoteTargets
 
-					if ZoneConfig[controller][zone]["status"] == "ON":
-						SourceConfig[source]["activeZones"] +=1
-		except Exception as err:
-			debugFunction(0, "EXCEPTION - countActiveSource: " + str(err))
-	else:
-		debugFunction(1, "countActiveSource: SoruceConfig is empty")
-	
+	start=time.perf_counter()
+	for line in lines:
+		if len(line) > 0:
 
-	
-def watchRussound(host, port, remoteTargets):
-	global DeviceStatus, LastRead, LastReadDateTime, TimebetweenRead, MaxTimeReadDiff, MaxTimeReadDiffDate
+			line, event=parseCache.get(line)
 
-	# Initial connect
-	s=connectRussound(host, port);
+			device.lastRead=line
 
-	# Main loop to read controller updates
-	while True:
-		try:
-			result = s.recv(1024)
-			debugFunction(2, 'Read: ' + str (result))														  
+			if event is None:
+				metricLines.inc(LINE_TYPES.get(line[0], ("other",)))
+				if line[0] == 'N':
+					debugFunction(0, "ERROR: %s", line)
+				continue
 
-			TimebetweenRead=datetime.datetime.now() - LastReadDateTime
-			
-			if MaxTimeReadDiff < TimebetweenRead:
-				MaxTimeReadDiff=TimebetweenRead
-				MaxTimeReadDiffDate=datetime.datetime.now()
+			metricLines.inc(LINE_TYPES[event.kind])
 
-			LastReadDateTime=datetime.datetime.now() 
+			if event.kind == EVENT_ZONE: #N C[1].Z[5].name="Wohnzimmer"
+				c=int(event.controller)
+				z=int(event.index)
 
-			for line in result.split(b'\r\n'): #Split results in different lines
-				if len(line) > 0:
-					
-					line=checkCharSet(line)
-			
-					LastRead=line
-					if line[0] is 'N':
-						if re.search(r'N System.status\="(.*)"$', line):  #N System.status="OFF" | N System.status="ON"
-							res=re.split(r'N System.status\="(.*)"$', line, 0);
-							DeviceStatus=res[1]
-							debugFunction(0, "SYSTEM: " + line)
-							
-						elif re.search(r'N C\[(\d)\]\.Z\[(\d)\]\.(\w+)\="(.*)"$', line):  #N C[1].Z[5].name="Wohnzimmer"
-							res=re.split(r'N C\[(\d)\]\.Z\[(\d)\]\.(\w+)\="(.*)"$', line, 0);
-							source=ZoneConfig[res[1]][res[2]]["currentSource"]
-
-							debugFunction(2, "ZONE: %s, Attr: %s, Current:%s" % ( res[2],res[3],json.dumps(source)))
-
-							ZoneConfig[res[1]][res[2]][res[3]]=res[4]
-							debugFunction(2, "ZONE: " + line)
-							
-							if "ZoneConfig" in remoteTargets:
-								send2Network(remoteTargets["ZoneConfig"], json.dumps(ZoneConfig))
-
-							if res[3] == "status" and res[4] == "OFF":
-								ZoneConfig[res[1]][res[2]]["volume"]=ZoneConfig[res[1]][res[2]]["turnOnVolume"]
-								debugFunction(0, "ZONE " + res[2] + ": Set Volume to " + ZoneConfig[res[1]][res[2]]["volume"])
-							if res[3] == "status" or res[3] == "currentSource": # Change of Sources
-								countActiveSources();
-							
-						elif re.search(r'N S\[(\d)\]\.(\w+)\="(.*)"$', line): #N S[5].type="DMS-3.1 Media Streamer"
-							debugFunction(3, "SOURCECONFIG: " + json.dumps(SourceConfig))
-							res=re.split(r'N S\[(\d)\]\.(\w+)\="(.*)"$', line, 0);
-							SourceConfig[res[1]][res[2]]=res[3]
-							debugFunction(2, "SOURCE: " + line)
-
-							if "SourceConfig" in remoteTargets:
-								send2Network(remoteTargets["SourceConfig"], json.dumps(SourceConfig))
-
-							if res[2] in remoteTargets:
-#								print (res[2] + " found in " + remoteTargets[res[2]])
-								send2Network(remoteTargets[res[2]], res[3])
-							
-						else:
-							debugFunction(0, "ERROR: " + line)
+				# Unchanged value of a refreshed zone, nothing to apply or publish
+				zone=State.zone(c, z)
+				if zone is not None and zone.get(event.attribute) == event.value and (c, z) not in State.stale:
+					metricUnchanged.inc(LINE_TYPES[event.kind])
+					continue
 
-		except Exception as err:
-			ConnectErrorDate=datetime.datetime.now()
-			debugFunction(0, "EXCEPTION - connection to Russound: " + str(err))
-			s=connectRussound(host, port)
+				debugFunction(2, "ZONE: %s, Attr: %s, Current:%s", event.index, event.attribute,
+					lambda: json.dumps(State.zone(c, z) and State.zone(c, z).currentSource))
 
-	s.close()
-	
-def sendCommand(cmd):
-	s.send(cmd.encode())
-	debugFunction(0, "sendCommand: " + cmd)
+				publisher.change("ZoneConfig", State.setZone(c, z, event.attribute, event.value))
+				zone=State.zone(c, z)
+				debugFunction(2, "ZONE: %s", line)
 
-def checkCommand(cmdline):
-	global ZoneConfig
-	digits = [ "DigitZero", "DigitOne", "DigitTwo", "DigitThree", "DigitFour", "DigitFive",
-			"DigitSix", "DigitSeven", "DigitEight", "DigitNine" ]
-	
-	result=dict(re.findall('(\w+)=([\w.+-]+)&?', cmdline.lower())) # e.g zone=1&source=1&action=0
-	debugFunction(1, json.dumps(result))
+				if event.attribute == "status" and event.value == "OFF" and zone.turnOnVolume is not None:
+					publisher.change("ZoneConfig", State.setZone(c, z, "volume", zone.turnOnVolume))
+					debugFunction(0, "ZONE %s: Set Volume to %s", event.index, zone.volume)
+				if event.attribute == "status" or event.attribute == "currentSource": # Change of Sources
+					for change in countActiveSources(State):
+						publisher.change("SourceConfig", change)
+
+			elif event.kind == EVENT_SOURCE: #N S[5].type="DMS-3.1 Media Streamer"
+				n=int(event.index)
+
+				# Unchanged value of a refreshed source, e.g. a repeated radioText
+				source=State.source(n)
+				if source is not None and source.get(event.attribute) == event.value and (n,) not in State.stale:
+					metricUnchanged.inc(LINE_TYPES[event.kind])
+					continue
+
+				debugFunction(3, "SOURCECONFIG: %s", lambda: json.dumps(State.sourcesJSON()))
+				change=State.setSource(n, event.attribute, event.value)
+				publisher.change("SourceConfig", change)
+				debugFunction(2, "SOURCE: %s", line)
+
+				# Only changed values are sent, also after a reconnect
+				if event.attribute in remoteTargets and change is not None:
+					send2Network(remoteTargets[event.attribute], event.value, key=device.name + event.attribute + event.index)
+
+			elif event.attribute == "status": #N System.status="OFF" | N System.status="ON"
+				device.status=event.value
+				State.touch()
+				debugFunction(0, "SYSTEM: %s", line)
 
+			else:
+				debugFunction(1, "SYSTEM: %s", line)
+
+	if lines:
+		metricBurstLines.observe(len(lines))
+		metricParse.observe((time.perf_counter() - start) / len(lines), count=len(lines))
+
+# Returns True, if data is waiting on a socket
+def pending(sock):
 	try:
-		action=result["action"]
-		zone=result["zone"]
+		return len(sock.recv(1, socket.MSG_PEEK | socket.MSG_DONTWAIT)) > 0
+	except OSError:
+		return False
 
-		try:
-			c=result["controller"]
-		except:
-			c=1
+# Read all pending bytes of a wakeup socket
+def drainWakeup(sock):
+	try:
+		while sock.recv(64):
+			pass
+	except BlockingIOError:
+		pass
+
+# Connect a device in a thread of its own, the connected device is handed over to the
+# read loop by connected and a byte on wakeup
+def startConnect(device, connected, wakeup):
+	def run():
+		device.connect()
+		connected.append(device)
+		wakeup.send(b'\0')
+
+	t=threading.Thread(target=run)
+	t.daemon=True
+	t.start()
+
+# Read loop of all devices, a single thread waits for the sockets of all connected devices
+# and the wakeups of their publishers
+def watchRussound(devices):
+	wakeup, wakeupSend=socket.socketpair()
+	wakeup.setblocking(False)
+	connected=deque()
+	socks={} # socket: Device
+
+	for device in devices:
+		device.startPublisher()
+
+		# Initial connect
+		startConnect(device, connected, wakeupSend)
+
+	# Main loop to read controller updates
+	while True:
+		# Wait for data from Russound, but not longer than the next snapshot is due
+		timeouts=[timeout for timeout in (device.publisher.timeout() for device in devices) if timeout is not None]
+		ready, w, x=select.select(list(socks) + [wakeup] + [device.publisher.wakeup for device in devices], [], [],
+			min(timeouts) if timeouts else None)
+
+		if wakeup in ready:
+			drainWakeup(wakeup)
+
+			while connected:
+				device=connected.popleft()
+				socks[device.sock]=device
+				device.connected()
+
+		for s in ready:
+			device=socks.get(s)
+			if device is None:
+				if s is not wakeup:
+					drainWakeup(s) # Publisher wakeup, the snapshot is sent by flush
+				continue
 
-		if action == 'toggle':
 			try:
-				newStatus = 'Off' if ZoneConfig[str(c)][str(zone)]["status"] == 'ON' else 'On'
-				debugFunction(2, 'CheckCommand-toogle: ZoneConfig[' + str(c) + '][' + str(zone) + '["status"]:' \
-					+ ZoneConfig[str(c)][str(zone)]["status"] + 'New status will be: ' + newStatus   )
-				
-				if newStatus == "On":
-					try:
-						source=result["source"]
-						cmd='EVENT C[' + str(c) + '].Z[' + zone + ']!KeyRelease SelectSource ' + source + '\r'
-					except:
-						cmd='EVENT C[' + str(c) + '].Z[' + zone + ']!ZoneOn\r'
-				else:
-					cmd='EVENT C[' + str(c) + '].Z[' + zone + ']!ZoneOff\r'
+				device.read()
 
 			except Exception as err:
-				debugFunction(0, "EXCEPTION - checkCommand, action=toggle: " + str(err))
+				del socks[s]
+				device.drop(err)
+				startConnect(device, connected, wakeupSend)
+
+		# End of the burst, publish all changed snapshots once
+		for device in devices:
+			device.publisher.flush()
+	
+# Run func by a thread, which only exists until func returns, e.g. the blocking connect
+# and discovery of a device. Returns the result of func.
+async def runThread(func, *args):
+	loop=asyncio.get_running_loop()
+	future=loop.create_future()
+
+	def run():
+		try:
+			result=(func(*args), None)
+		except Exception as err:
+			result=(None, err)
+		loop.call_soon_threadsafe(done, *result)
+
+	def done(result, err):
+		if future.cancelled():
+			return
+		if err:
+			future.set_exception(err)
+		else:
+			future.set_result(result)
+
+	t=threading.Thread(target=run)
+	t.daemon=True
+	t.start()
+	return await future
+
+# Single asyncio loop in the main thread ([Common] EventLoop=1): the RIO connections of all
+# devices, the publishers, the HTTP and HTTPS listeners, the outbound TCP, UDP and MQTT targets,
+# the command writes and the MQTT client. Only blocking work is done by threads: connect and
+# discovery of a device (while connecting), the debug output, the capture and state files
+# and, with [MQTT] Workers, the MQTT requests.
+class EventLoop:
+	def __init__(self, devices):
+		self.devices=devices
+		self.loop=None
+		self.timer=None
+
+	async def run(self, webPort=None, sslPort=None, mqtt=None, stateInterval=60):
+		self.loop=asyncio.get_running_loop()
+		commandWriter.loop=self.loop
+		tasks=[self.loop.create_task(sender.serve())]
+
+		if webPort or sslPort:
+			await webserver.serve(webPort, sslPort)
+
+		for device in self.devices:
+			device.startPublisher()
+			self.loop.add_reader(device.publisher.wakeup, self.wakeup, device)
+			tasks.append(self.loop.create_task(self.connect(device)))
+
+		if mqtt:
+			tasks.append(self.loop.create_task(MQTTLoop(self.loop, mqttClient(*mqtt)).run(*mqtt[:2])))
+
+		stateDevices=[device for device in self.devices if device.stateFile]
+		if stateDevices:
+			tasks.append(self.loop.create_task(self.saveState(stateDevices, stateInterval)))
+
+		self.flush()
+		await asyncio.gather(*tasks)
+
+	async def connect(self, device):
+		await runThread(device.connect)
+		device.connected()
+		self.loop.add_reader(device.sock, self.read, device)
+
+	def read(self, device):
+		try:
+			device.read(RIO_LOOP_READ)
 
-		elif action == "1" or  action== "on":
+		except Exception as err:
+			self.loop.remove_reader(device.sock)
+			device.drop(err)
+			self.loop.create_task(self.connect(device))
+
+		# End of the burst, publish all changed snapshots once. While further data of the
+		# burst is waiting, its changes are published at the latest MaxLatency after the first.
+		if device.sock is not None and device.framer.received == RIO_LOOP_READ and pending(device.sock):
+			self.defer(device.publisher.burstTimeout())
+		else:
+			self.flush()
+
+	# Flush in timeout seconds, unless a flush is due earlier
+	def defer(self, timeout):
+		if timeout is None:
+			return
+		if self.timer is None or self.timer.when() > self.loop.time() + timeout:
+			if self.timer:
+				self.timer.cancel()
+			self.timer=self.loop.call_later(timeout, self.flush)
+
+	# Resync requested by another thread
+	def wakeup(self, device):
+		drainWakeup(device.publisher.wakeup)
+		self.flush()
+
+	# Flush all publishers, again when the next snapshot is due
+	def flush(self):
+		for device in self.devices:
+			device.publisher.flush()
+
+		if self.timer:
+			self.timer.cancel()
+		timeouts=[timeout for timeout in (device.publisher.timeout() for device in self.devices) if timeout is not None]
+		self.timer=self.loop.call_later(min(timeouts), self.flush) if timeouts else None
+
+	# Write the state file of each device every interval seconds, if its state changed
+	async def saveState(self, devices, interval):
+		saved={device.name: device.state.version for device in devices}
+		while True:
+			await asyncio.sleep(interval)
+			for device in devices:
+				if device.state.version == saved[device.name]:
+					continue
+
+				try:
+					saved[device.name]=device.state.version
+					await runThread(device.saveState)
+					debugFunction(2, "StateService: state version " + str(saved[device.name]) + " written to " + device.stateFile)
+				except Exception as err:
+					debugFunction(0, "EXCEPTION - StateService: " + str(err))
+
+# All commands to the devices are written by the thread of CommandWriter, so commands of
+# different threads are never interleaved. Commands of a device queued meanwhile (e.g. all
+# digits of a channel) are written with a single send.
+class CommandWriter:
+	def __init__(self):
+		self.queue={} # Device: commands
+		self.socks={} # Device: socket
+		self.condition=threading.Condition()
+		self.commands=0
+		self.writes=0
+		self.loop=None # Event loop writing the commands, otherwise the thread of run
+
+	# Connection to the device is established
+	def attach(self, device, sock):
+		with self.condition:
+			self.socks[device]=sock
+
+	# Connection to the device is lost, drop all queued commands
+	def detach(self, device):
+		with self.condition:
+			self.socks.pop(device, None)
+			self.queue.pop(device, None)
+
+	# Returns False, if there is no connection to the device
+	def put(self, device, cmds):
+		with self.condition:
+			if device not in self.socks:
+				return False
+
+			idle=not self.queue
+			self.queue.setdefault(device, []).extend(cmds)
+			if self.loop is None:
+				self.condition.notify()
+			elif idle:
+				self.loop.call_soon_threadsafe(self.write)
+			return True
+
+	def status(self):
+		with self.condition:
+			return {"Commands": self.commands, "Writes": self.writes,
+				"QueueDepth": sum(len(cmds) for cmds in self.queue.values())}
+
+	def run(self):
+		while True:
+			with self.condition:
+				while not self.queue:
+					self.condition.wait()
+
+			self.write()
+
+	# Write all queued commands, one send per device
+	def write(self):
+		with self.condition:
+			queue=self.queue
+			self.queue={}
+			writes=[(device, self.socks[device], cmds) for device, cmds in queue.items()]
+
+		for device, sock, cmds in writes:
 			try:
-				source=result["source"]
-				cmd='EVENT C[' + str(c) + '].Z[' + zone + ']!KeyRelease SelectSource ' + source + '\r'
-			except:
-				cmd='EVENT C[' + str(c) + '].Z[' + zone + ']!ZoneOn\r'
+				sendRussound(sock, ''.join(cmds).encode(), device.capture)
+				self.commands += len(cmds)
+				self.writes += 1
+			except Exception as err:
+				debugFunction(0, "EXCEPTION - CommandWriter " + device.name + ": " + str(err))
+
+# Send a command or a list of commands to a device, returns False if not connected
+def sendCommand(device, cmd):
+	cmds=[cmd] if isinstance(cmd, str) else cmd
+	debugFunction(0, "sendCommand %s: %s", device.name, lambda: ''.join(cmds))
+	return commandWriter.put(device, cmds)
+
+COMMAND_PARAM=re.compile(r'(\w+)=([\w.,+-]+)&?') # e.g zone=1,4,5&source=1&action=on
+COMMAND_VALUE=re.compile(r'[\w.,+-]+')
+
+# Returns the device of a command, given as device=<name>, otherwise the device given as
+# parameter or the default device, None if unknown
+def commandDevice(result, device=None):
+	if "device" in result: # e.g. device=site2&zone=1&action=on
+		return devices.get(result["device"])
+	return defaultDevice if device is None else device
+
+# Returns the RIO commands of a command for one zone, raises an exception if invalid
+def zoneCommands(result, State, c, zone):
+	digits = [ "DigitZero", "DigitOne", "DigitTwo", "DigitThree", "DigitFour", "DigitFive",
+			"DigitSix", "DigitSeven", "DigitEight", "DigitNine" ]
 
-		elif action == "0" or  action== "off":
-			cmd='EVENT C[' + str(c) + '].Z[' + zone + ']!ZoneOff\r'
+	cmds=[] # Commands before cmd, all are written at once
+	action=result["action"]
+
+	if action == 'toggle':
+		try:
+			status=State.zone(int(c), int(zone))["status"]
+			newStatus = 'Off' if status == 'ON' else 'On'
+			debugFunction(2, 'CheckCommand-toogle: ZoneConfig[%s][%s]["status"]:%s New status will be: %s',
+				c, zone, status, newStatus)
 			
-		elif action == "source":
-			try:
-				source=result["source"]
-				cmd='EVENT C[' + str(c) + '].Z[' + zone + ']!KeyRelease SelectSource ' + source + '\r'
-			except:
-				pass
+			if newStatus == "On":
+				try:
+					source=result["source"]
+					cmd='EVENT C[' + str(c) + '].Z[' + zone + ']!KeyRelease SelectSource ' + source + '\r'
+				except:
+					cmd='EVENT C[' + str(c) + '].Z[' + zone + ']!ZoneOn\r'
+			else:
+				cmd='EVENT C[' + str(c) + '].Z[' + zone + ']!ZoneOff\r'
 
-		elif action == "play":
-			try:
-				source=result["source"]
-				try: 
-					frequency=result["channel"]
-					try:
-						frequency=Channels[frequency]
-					except:
-						pass
-					freq_array = ''.join(i for i in frequency if i not in string.punctuation)
+		except Exception as err:
+			debugFunction(0, "EXCEPTION - checkCommand, action=toggle: " + str(err))
+
+	elif action == "1" or  action== "on":
+		try:
+			source=result["source"]
+			cmd='EVENT C[' + str(c) + '].Z[' + zone + ']!KeyRelease SelectSource ' + source + '\r'
+		except:
+			cmd='EVENT C[' + str(c) + '].Z[' + zone + ']!ZoneOn\r'
+
+	elif action == "0" or  action== "off":
+		cmd='EVENT C[' + str(c) + '].Z[' + zone + ']!ZoneOff\r'
+		
+	elif action == "source":
+		try:
+			source=result["source"]
+			cmd='EVENT C[' + str(c) + '].Z[' + zone + ']!KeyRelease SelectSource ' + source + '\r'
+		except:
+			pass
+
+	elif action == "play":
+		try:
+			source=result["source"]
+			try: 
+				frequency=result["channel"]
+				try:
+					frequency=Channels[frequency]
 				except:
 					pass
-				
-				for i in freq_array :
-					cmd='EVENT C[' + str(c) + '].Z[' + zone + ']!KeyRelease ' + digits[int(i)] + '\r'
-					sendCommand(cmd)
+				freq_array = ''.join(i for i in frequency if i not in string.punctuation)
+			except:
+				pass
+			
+			for i in freq_array :
+				cmds.append('EVENT C[' + str(c) + '].Z[' + zone + ']!KeyRelease ' + digits[int(i)] + '\r')
 
-				cmd='EVENT C[' + str(c) + '].Z[' + zone + ']!KeyRelease Enter\r'
-	
-			except Exception as err:
-				debugFunction(0, "EXCEPTION - checkCommand: " + str(err))
-				return 401
+			cmd='EVENT C[' + str(c) + '].Z[' + zone + ']!KeyRelease Enter\r'
 
-		elif action == "volumeup" or action == "volup":
-			cmd='EVENT C[' + str(c) + '].Z[' + zone + ']!KeyPress VolumeUp\r'
+		except Exception as err:
+			debugFunction(0, "EXCEPTION - checkCommand: " + str(err))
+			raise
 
-		elif action == "volumedown" or action == "voldown":
-			cmd='EVENT C[' + str(c) + '].Z[' + zone + ']!KeyPress VolumeDown\r'
+	elif action == "volumeup" or action == "volup":
+		cmd='EVENT C[' + str(c) + '].Z[' + zone + ']!KeyPress VolumeUp\r'
 
-		elif action == "volume":
-			volume=result["volume"]
+	elif action == "volumedown" or action == "voldown":
+		cmd='EVENT C[' + str(c) + '].Z[' + zone + ']!KeyPress VolumeDown\r'
 
-			if volume[0]=="+":
-				count=int(volume[1:])
-				cmd='EVENT C[' + str(c) + '].Z[' + zone + ']!KeyPress VolumeUp\r'
+	elif action == "volume":
+		volume=result["volume"]
 
-				if count < 20:
-					i=1
-					while (i < count):
-						sendCommand(cmd)
-						i+=1
+		if volume[0] == "+" or volume[0] == "-":
+			count=int(volume)
+			if count == 0: # Nothing to change, e.g. volume=+0
+				return cmds
 
-			if volume[0] == "-":
-				count=int(volume[1:])
-				cmd='EVENT C[' + str(c) + '].Z[' + zone + ']!KeyPress VolumeDown\r'
+			current=State.zone(int(c), int(zone)) if zone.isdigit() else None
+			current=current and current.volume
 
-				if count > 0:
-					i=1
-					while (i < count):
-						sendCommand(cmd)
-						i+=1
+			if current is not None and current.isdigit():
+				# One absolute Volume event instead of count VolumeUp/VolumeDown events
+				volume=str(max(0, min(VOLUME_MAX, int(current) + count)))
+				cmd='EVENT C[' + str(c) + '].Z[' + zone + ']!KeyPress Volume ' + volume + '\r'
 			else:
-				if volume.isdigit():
-					cmd='EVENT C[' + str(c) + '].Z[' + zone + ']!KeyPress Volume ' + volume + '\r'
+				cmd='EVENT C[' + str(c) + '].Z[' + zone + ']!KeyPress ' + ('VolumeUp' if count > 0 else 'VolumeDown') + '\r'
+				cmds += [cmd] * (min(abs(count), VOLUME_STEPS_MAX) - 1)
 
-		elif action == "turnonvolume":
-			attr=result["volume"]
-			cmd='SET C[' + str(c) + '].Z[' + zone + '].' + action + '="' + attr + '"\r'
+		else:
+			if volume.isdigit():
+				cmd='EVENT C[' + str(c) + '].Z[' + zone + ']!KeyPress Volume ' + volume + '\r'
 
-		elif action == "bass":
-			attr=result["bass"]
-			cmd='SET C[' + str(c) + '].Z[' + zone + '].' + action + '="' + attr + '"\r'
+	elif action == "turnonvolume":
+		attr=result["volume"]
+		cmd='SET C[' + str(c) + '].Z[' + zone + '].' + action + '="' + attr + '"\r'
 
-		elif action == "balance":
-			attr=result["balance"]
-			cmd='SET C[' + str(c) + '].Z[' + zone + '].' + action + '="' + attr + '"\r'
+	elif action == "bass":
+		attr=result["bass"]
+		cmd='SET C[' + str(c) + '].Z[' + zone + '].' + action + '="' + attr + '"\r'
 
-		elif action == "treble":
-			attr=result["treble"]
-			cmd='SET C[' + str(c) + '].Z[' + zone + '].' + action + '="' + attr + '"\r'
+	elif action == "balance":
+		attr=result["balance"]
+		cmd='SET C[' + str(c) + '].Z[' + zone + '].' + action + '="' + attr + '"\r'
 
-		else:
-			return 401
-	
-		sendCommand(cmd)
+	elif action == "treble":
+		attr=result["treble"]
+		cmd='SET C[' + str(c) + '].Z[' + zone + '].' + action + '="' + attr + '"\r'
+
+	else:
+		raise ValueError("unknown action " + action)
+	cmds.append(cmd)
+	return cmds
+
+# Returns the RIO commands of a command for all its zones and controllers, e.g. zone=1,4,5
+# or controller=1,2&zone=1,2 (every zone of every controller)
+def buildCommands(result, State):
+	zones=[zone for zone in result["zone"].split(',') if zone]
+	controllers=[c for c in result.get("controller", "1").split(',') if c]
+	if not zones or not controllers:
+		raise ValueError("no zone")
+
+	cmds=[]
+	for c in controllers:
+		for zone in zones:
+			cmds += zoneCommands(result, State, c, zone)
+	return cmds
+
+# Execute a command, e.g. zone=1&action=on&source=2, of the device given as parameter or
+# as device=<name>, returns the HTTP status code, 503 if the device is not connected
+def checkCommand(cmdline, device=None):
+	result=dict(COMMAND_PARAM.findall(cmdline.lower()))
+	debugFunction(1, "%s", lambda: json.dumps(result))
+
+	device=commandDevice(result, device)
+	if device is None:
+		return 404
+
+	try:
+		cmds=buildCommands(result, device.state)
+		if cmds and not sendCommand(device, cmds):
+			return 503
 		return 200
 
 	except Exception as err:
 		debugFunction(0, "EXCEPTION - checkCommand: " + str(err))
-		if err.errno == errno.EPIPE:
+		if getattr(err, "errno", None) == errno.EPIPE:
 			return errno.EPIPE
 		else:
 			return 401
 
-def prepareResponse(request):
-
-	debugFunction(1, "prepareResponse: request=" + request)
-
-	response=""
-
-	if request == 'zoneconfig':
-		response += json.dumps(ZoneConfig)
-
-	elif str(request) == 'sourceconfig':
-		response += json.dumps(SourceConfig)
-
-	elif request == 'channels':
-		response += json.dumps(Channels)
+# Returns the parameters of a command of a batch, either an object like
+# {"zone": [1, 4], "action": "on", "source": 2} or a string like "zone=1,4&action=on&source=2".
+# A value with other characters than a command line allows raises an exception.
+def batchParams(item):
+	if isinstance(item, str):
+		return dict(COMMAND_PARAM.findall(item.lower()))
+
+	result={}
+	for key, value in item.items():
+		value=','.join(str(v) for v in value) if isinstance(value, list) else str(value)
+		if not COMMAND_VALUE.fullmatch(value):
+			raise ValueError("invalid value of " + str(key))
+		result[str(key).lower()]=value.lower()
+	return result
+
+# Execute a batch of commands, a JSON list of commands as accepted by batchParams. The RIO
+# commands of the whole batch are written to a device at once, a command with device=<name>
+# goes to that device. Returns the status of the batch and a list with the status of every
+# command, 200, 401 if invalid, 404 for an unknown device and 503 if not connected.
+def batchCommand(payload, device=None):
+	try:
+		batch=json.loads(payload)
+	except ValueError:
+		return 400, []
+	if not isinstance(batch, list):
+		return 400, []
+
+	writes={} # Device: RIO commands of the batch
+	pending=[] # (device, result) of the valid commands
+	results=[]
+	for item in batch:
+		result={"status": 200}
+		results.append(result)
+		try:
+			params=batchParams(item)
+			debugFunction(1, "batchCommand: %s", lambda: json.dumps(params))
+			target=commandDevice(params, device)
+			if target is None:
+				result["status"]=404
+				continue
+			cmds=buildCommands(params, target.state)
 
-	elif request == 'defaultchannels':
-		response += json.dumps(DefChannel)
+		except Exception as err:
+			debugFunction(0, "EXCEPTION - batchCommand: " + str(err))
+			result["status"]=401
+			continue
+
+		writes.setdefault(target, []).extend(cmds)
+		pending.append((target, result))
+
+	failed=[target for target, cmds in writes.items() if cmds and not sendCommand(target, cmds)]
+	for target, result in pending:
+		if target in failed:
+			result["status"]=503
+
+	return 200, results
+
+def batchResponse(status, results):
+	return json.dumps({"status": status, "results": results}).encode()
+
+def statusResponse(device):
+	staleZones, staleSources=device.state.staleEntries()
+	return \
+		'{ "Device": ' + json.dumps(device.name) + \
+		', "StartDate": ' + json.dumps(startdate.strftime("%d.%m.%Y %H:%M:%S")) + \
+		', "LastReconnect": ' + json.dumps(device.lastconnect.strftime("%d.%m.%Y %H:%M:%S")) + \
+		', "ConnectErrorDate": ' + json.dumps(device.connectErrorDate.strftime("%d.%m.%Y %H:%M:%S")) + \
+		', "Reconnects": ' + json.dumps(device.reconnects) + \
+		', "ConnectFailures": ' + json.dumps(device.connectFailures) + \
+		', "DeviceVersion": ' + json.dumps(device.version) + \
+		', "DeviceStatus": ' + json.dumps(device.status) + \
+		', "ZoneCount": ' + json.dumps(device.zoneCount) + \
+		', "ControllerType": ' + json.dumps(device.controllerType) + \
+		', "CountSource": ' + json.dumps(device.sourceCount) + \
+		', "ConvertErrorStr": ' + json.dumps(ConvertErrorStr) + \
+		', "ConvertErrorHex": ' + json.dumps(ConvertErrorHex) + \
+		', "ConvertErrorDate": ' + json.dumps(ConvertErrorDate.strftime("%d.%m.%Y %H:%M:%S")) + \
+		', "MaxDiffDate": ' + json.dumps(device.maxTimeReadDiffDate.strftime("%d.%m.%Y %H:%M:%S")) + \
+		', "TimebetweenRead": ' + json.dumps(str(device.timeBetweenRead)) + \
+		', "MaxDiffTimebetweenRead": ' + json.dumps(str(device.maxTimeReadDiff)) + \
+		', "LastRead": ' + json.dumps(device.lastRead) + \
+		', "LastReadDateTime": ' + json.dumps(device.lastReadDateTime.strftime("%d.%m.%Y %H:%M:%S")) + \
+		', "StateVersion": ' + json.dumps(device.state.version) + \
+		', "StaleZones": ' + json.dumps(staleZones) + \
+		', "StaleSources": ' + json.dumps(staleSources) + \
+		', "Sender": ' + json.dumps(sender.status() if sender else None) + \
+		', "CommandWriter": ' + json.dumps(commandWriter.status() if commandWriter else None) + \
+		', "Capture": ' + json.dumps(device.capture.status() if device.capture else None) + \
+		', "MQTTWorkers": ' + json.dumps(mqttWorkers.status() if mqttWorkers else None) + \
+		', "EventLoop": ' + json.dumps(eventLoop is not None) + \
+		', "ParseCache": ' + json.dumps(parseCache.status()) + \
+		', "DebugLog": ' + json.dumps(debugLog.status()) + \
+		'}'
+
+def allResponse(device):
+	return \
+		'{ "ZoneConfig": ' + json.dumps(device.state.zonesJSON()) + \
+		', "SourceConfig": ' + json.dumps(device.state.sourcesJSON()) + \
+		', "Channels": ' + json.dumps(Channels) + \
+		', "DefaultChannel": ' + json.dumps(DefChannel) + \
+		', "StartDate": ' + json.dumps(startdate.strftime("%d.%m.%Y %H:%M:%S")) + \
+		', "LastReconnect": ' + json.dumps(device.lastconnect.strftime("%d.%m.%Y %H:%M:%S")) + \
+		', "DeviceVersion": ' + json.dumps(device.version) + \
+		', "DeviceStatus": ' + json.dumps(device.status) + \
+		', "CountSource": ' + json.dumps(device.sourceCount) + \
+		'}'
+
+# All devices with their connection
+def devicesResponse():
+	return json.dumps({device.name: {"Russound": device.host, "Port": device.port, "Topic": device.topic,
+		"Connected": device.sock is not None, "DeviceStatus": device.status} for device in devices.values()})
+
+# Views of a device, which only change with the version of its state and are served from the cache
+CACHED_VIEWS={
+	'zoneconfig': lambda device: json.dumps(device.state.zonesJSON()),
+	'sourceconfig': lambda device: json.dumps(device.state.sourcesJSON()),
+	'channels': lambda device: json.dumps(Channels),
+	'defaultchannels': lambda device: json.dumps(DefChannel),
+	'all': allResponse,
+	'activezones': lambda device: json.dumps(device.state.activeZonesJSON()),
+}
+
+# Returns the device and the rest of a path, e.g. devices/site2/zoneconfig, the default
+# device for all other paths. The device is None, if it is unknown.
+def findDevice(path):
+	match=re.match(r'devices/([^/]+)/?(.*)$', path)
+	if match is None:
+		return defaultDevice, path
+	return devices.get(match.group(1)), match.group(2)
+
+# Returns the name and the function building a view of a device, None for an unknown view
+def findView(view, device):
+	if view in CACHED_VIEWS:
+		return view, functools.partial(CACHED_VIEWS[view], device)
+
+	match=re.match(r'sources/(\d+)/zones$', view) # Zones playing a source, e.g. sources/3/zones
+	if match and int(match.group(1)) in device.state.sources:
+		n=int(match.group(1))
+		return 'sources/%d/zones' % n, lambda: json.dumps(device.state.sourceZonesJSON(n))
+
+	return None, None
+
+# Returns the encoded (utf-8) JSON response of a view of a device
+def prepareResponse(request, device):
+
+	debugFunction(1, "prepareResponse: request=%s", request)
+
+	view, build=findView(request, device)
+	if view:
+		response=device.state.encode(view, build)
+
+	elif request == 'devices':
+		response=devicesResponse().encode()
 
 	elif re.search(r'status.*', request, 0):
-		response += \
-			'{ "StartDate": ' + json.dumps(startdate.strftime("%d.%m.%Y %H:%M:%S")) + \
-			', "LastReconnect": ' + json.dumps(lastconnect.strftime("%d.%m.%Y %H:%M:%S")) + \
-			', "ConnectErrorDate": ' + json.dumps(ConnectErrorDate.strftime("%d.%m.%Y %H:%M:%S")) + \
-			', "DeviceVersion": ' + json.dumps(DeviceVersion) + \
-			', "DeviceStatus": ' + json.dumps(DeviceStatus) + \
-			', "ZoneCount": ' + json.dumps(ZoneCount) + \
-			', "ControllerType": ' + json.dumps(ControllerType) + \
-			', "CountSource": ' + json.dumps(SourceCount) + \
-			', "ConvertErrorStr": ' + json.dumps(ConvertErrorStr) + \
-			', "ConvertErrorHex": ' + json.dumps(ConvertErrorHex) + \
-			', "ConvertErrorDate": ' + json.dumps(ConvertErrorDate.strftime("%d.%m.%Y %H:%M:%S")) + \
-			', "MaxDiffDate": ' + json.dumps(MaxTimeReadDiffDate.strftime("%d.%m.%Y %H:%M:%S")) + \
-			', "TimebetweenRead": ' + json.dumps(str(TimebetweenRead)) + \
-			', "MaxDiffTimebetweenRead": ' + json.dumps(str(MaxTimeReadDiff)) + \
-			', "LastRead": ' + json.dumps(LastRead) + \
-			', "LastReadDateTime": ' + json.dumps(LastReadDateTime.strftime("%d.%m.%Y %H:%M:%S")) + \
-			'}'
+		response=statusResponse(device).encode()
+
 	else:
-		response += \
-			'{ "ZoneConfig": ' + json.dumps(ZoneConfig) + \
-			', "SourceConfig": ' + json.dumps(SourceConfig) + \
-			', "Channels": ' + json.dumps(Channels) + \
-			', "DefaultChannel": ' + json.dumps(DefChannel) + \
-			', "StartDate": ' + json.dumps(startdate.strftime("%d.%m.%Y %H:%M:%S")) + \
-			', "LastReconnect": ' + json.dumps(lastconnect.strftime("%d.%m.%Y %H:%M:%S")) + \
-			', "DeviceVersion": ' + json.dumps(DeviceVersion) + \
-			', "DeviceStatus": ' + json.dumps(DeviceStatus) + \
-			', "CountSource": ' + json.dumps(SourceCount) + \
-			'}'
-
-	debugFunction(1, "prepareResponse: response=" + response)
+		response=device.state.encode('all', functools.partial(allResponse, device))
+
+	debugFunction(1, "prepareResponse: response=%s", response.decode)
 
 	return response
 
 def mqtt_on_connect(client, userdata, flags, rc):
 	debugFunction(1, "Connected with result code "+str(rc))
 
-	client.subscribe([(mqttTopic + MQTT_TOPIC_GET, 2),(mqttTopic + MQTT_TOPIC_SET, 2), (mqttTopic + MQTT_TOPIC_CMD, 2)])
+	# A response published by a worker thread is sent at once, not after the delayed ACK
+	try:
+		client.socket().setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+	except Exception as err:
+		debugFunction(1, "mqtt_on_connect: TCP_NODELAY: " + str(err))
+
+	for device in devices.values():
+		topic=device.topic
+		client.subscribe([(topic + MQTT_TOPIC_GET, 2),(topic + MQTT_TOPIC_SET, 2), (topic + MQTT_TOPIC_CMD, 2),
+			(topic + MQTT_TOPIC_GET + '/+', 2), (topic + MQTT_TOPIC_CMD + '/+', 2),
+			(topic + MQTT_TOPIC_BATCH, 2), (topic + MQTT_TOPIC_BATCH + '/+', 2)])
+
+		if device.attributes:
+			device.attributes.republish()
 
 def mqtt_on_message(client, userdata, msg):
-	global debugLevel, debugHex
-	try:
-		payload = msg.payload.decode().strip('\n').lower()
-		debugFunction(2, "mqtt_on_message: topic = " + msg.topic + " payload: " + payload)
+	metricMQTT.inc(("in",))
+	mqttWorkers.put(msg.topic, msg.payload)
+
+# MQTT requests are handled by worker threads, so the network loop of paho is never blocked,
+# e.g. by the serialization of a large response. /Get requests are handled concurrently,
+# /Cmd, /Batch and /Set in the order received, one at a time. At most queueSize requests are
+# waiting, further requests are rejected, a command or batch with 503 on /Ack. Without workers, the requests
+# are handled at once by the network loop.
+# A request on a sub topic, e.g. Russound/Get/42 or Russound/Cmd/42, is answered on the same
+# sub topic, e.g. Russound/Data/42 or Russound/Ack/42, so a client can match the responses
+# of concurrent requests. Every device has its own topic, a request is handled by the
+# device with the longest topic matching.
+class MQTTWorkers:
+	def __init__(self, workers=4, queueSize=64):
+		self.workers=workers
+		self.queueSize=queueSize
+		self.condition=threading.Condition()
+		self.requests=deque() # (device, kind, correlation, payload) of /Get
+		self.commands=deque() # of /Cmd, /Batch and /Set
+		self.commandBusy=False
+		self.rejected=0
+
+	def start(self):
+		for i in range(self.workers):
+			t=threading.Thread(target=self.run)
+			t.daemon=True
+			t.start()
+
+	# Called by the network loop of paho
+	def put(self, topic, payload):
+		device=max((device for device in devices.values() if topic.startswith(device.topic + '/')),
+			key=lambda device: len(device.topic), default=None)
+		if device is None:
+			return
+
+		kind, sep, correlation=topic[len(device.topic):].partition('/')[2].partition('/')
+		kind='/' + kind
+
+		if not self.workers:
+			try:
+				self.handle(device, kind, correlation, payload)
+			except Exception as e:
+				debugFunction(0, "MQTTWorkers: "+ str(e))
+			return
 
-		if msg.topic == mqttTopic + MQTT_TOPIC_GET:
+		pending=self.requests if kind == MQTT_TOPIC_GET else self.commands
 
-			response=prepareResponse(payload)
-			send2Network("mqtt:" + mqttTopic + MQTT_TOPIC_DATA, response, 1)
+		with self.condition:
+			if len(self.requests) + len(self.commands) < self.queueSize:
+				pending.append((device, kind, correlation, payload))
+				self.condition.notify()
+				return
 
-		elif msg.topic == mqttTopic + MQTT_TOPIC_CMD:
-			rc=checkCommand(payload);
+			self.rejected += 1
 
-			send2Network("mqtt:" + mqttTopic + MQTT_TOPIC_ACK, \
-				"Ok" if rc == 200 else str(rc) + ' - Cmd: ' + payload, 2)
+		debugFunction(0, "MQTTWorkers: queue full, %s rejected", topic)
+		if kind == MQTT_TOPIC_CMD:
+			self.reply(device, MQTT_TOPIC_ACK, correlation, '503 - Cmd: ' + payload.decode(errors='replace').strip('\n'), 2)
+		elif kind == MQTT_TOPIC_BATCH:
+			self.reply(device, MQTT_TOPIC_ACK, correlation, batchResponse(503, []), 2)
 
-		elif msg.topic == mqttTopic + MQTT_TOPIC_SET:
+	def status(self):
+		with self.condition:
+			return {"QueueDepth": len(self.requests) + len(self.commands), "Rejected": self.rejected}
+
+	def run(self):
+		while True:
+			with self.condition:
+				while True:
+					if self.commands and not self.commandBusy:
+						request=self.commands.popleft()
+						self.commandBusy=True
+						break
+					if self.requests:
+						request=self.requests.popleft()
+						break
+					self.condition.wait()
+
+			try:
+				self.handle(*request)
+			except Exception as e:
+				debugFunction(0, "MQTTWorkers: "+ str(e))
+
+			if request[1] != MQTT_TOPIC_GET:
+				with self.condition:
+					self.commandBusy=False
+					self.condition.notify()
+
+	# Publish the response of a request on the same sub topic
+	def reply(self, device, kind, correlation, msg, QoS):
+		topic=device.topic + kind + ('/' + correlation if correlation else '')
+		mqtt_client.publish(topic, msg, QoS)
+		metricMQTT.inc(("out",))
+
+	def handle(self, device, kind, correlation, payload):
+		global debugLevel, debugHex
+
+		payload = payload.decode().strip('\n').lower()
+		debugFunction(2, "MQTTWorkers: %s %s %s payload: %s", device.name, kind, correlation, payload)
+
+		if kind == MQTT_TOPIC_GET:
+
+			self.reply(device, MQTT_TOPIC_DATA, correlation, prepareResponse(payload, device), 1)
+
+		elif kind == MQTT_TOPIC_CMD:
+			rc=checkCommand(payload, device);
+
+			self.reply(device, MQTT_TOPIC_ACK, correlation, "Ok" if rc == 200 else str(rc) + ' - Cmd: ' + payload, 2)
+
+		elif kind == MQTT_TOPIC_BATCH:
+			self.reply(device, MQTT_TOPIC_ACK, correlation, batchResponse(*batchCommand(payload, device)), 2)
+
+		elif kind == MQTT_TOPIC_SET:
 
 			result=dict(re.findall('(\w+)=([\w.+-]+)&?', payload)) # e.g debugLevel=1&debugTarget=2
-			debugFunction(2, "mqtt_on_message: " + json.dumps(result))
+			debugFunction(2, "mqtt_on_message: %s", lambda: json.dumps(result))
 
 			try:
 				rc=int(result["debuglevel"])
@@ -622,114 +2531,565 @@ def mqtt_on_message(client, userdata, msg):
 			except:
 				pass
 
-	except Exception as e:
-		debugFunction(0, "mqtt_on_message: "+ str(e))
+			if result.get("resync") == "1" and device.publisher:
+				debugFunction(0, "mqtt_on_message:  resync of delta targets of " + device.name + " requested")
+				device.publisher.requestSnapshot()
+				if device.attributes:
+					device.attributes.republish()
 
-def MQTTService(mqttHost, mqttPort, mqttTopic, mqttUser, mqttPass):
+def mqttClient(mqttHost, mqttPort, mqttUser, mqttPass):
 	global mqtt_client
 	
 	debugFunction (0, 'Connect MQTT to ' + mqttHost + ' on port ' + str(mqttPort) + ', SSL is ' + str(usemqttssl) + \
-		', with Topic ' + mqttTopic)
-	try:
-		mqtt_client = mqtt.Client()
-		if usemqttssl:
-			mqtt_client.tls_set(mqttcertificatefile, tls_version=ssl.PROTOCOL_TLSv1_2)
-			mqtt_client.tls_insecure_set(True)
-			
-		if mqttUser:
-			mqtt_client.username_pw_set(mqttUser, mqttPass)
+		', with Topics ' + ', '.join(device.topic for device in devices.values()))
 
-		mqtt_client.connect(mqttHost, mqttPort)
+	mqtt_client = mqtt.Client()
+	if usemqttssl:
+		mqtt_client.tls_set(mqttcertificatefile, tls_version=ssl.PROTOCOL_TLSv1_2)
+		mqtt_client.tls_insecure_set(True)
+		
+	if mqttUser:
+		mqtt_client.username_pw_set(mqttUser, mqttPass)
 
-		mqtt_client.on_connect = mqtt_on_connect
-		mqtt_client.on_message = mqtt_on_message
+	mqtt_client.on_connect = mqtt_on_connect
+	mqtt_client.on_message = mqtt_on_message
+	return mqtt_client
 
-		mqtt_client.loop_forever()
+def MQTTService(mqttHost, mqttPort, mqttUser, mqttPass):
+	try:
+		client=mqttClient(mqttHost, mqttPort, mqttUser, mqttPass)
+		client.connect(mqttHost, mqttPort)
+		client.loop_forever()
 
 	except Exception as e:
 		debugFunction(0, "MQTT Service Initiation: "+ str(e))
 
-def WebService(usessl, wport):
-	
-	client_connection=None
+# MQTT client on the event loop. paho reports its socket by callbacks, which may be called
+# by any thread (e.g. publish of a worker), the socket is watched by the loop for reading and,
+# while paho has data to send, for writing. A callback of the loop itself is handled at once,
+# paho closes the socket after the callback. A lost connection is reconnected after
+# reconnectDelay, the connect itself (DNS, TCP, TLS) is done by a thread.
+class MQTTLoop:
+	def __init__(self, loop, client):
+		self.loop=loop
+		self.client=client
+		self.closed=None
+		self.thread=threading.get_ident()
+		client.on_socket_open=self.onOpen
+		client.on_socket_close=self.onClose
+		client.on_socket_register_write=self.onRegisterWrite
+		client.on_socket_unregister_write=self.onUnregisterWrite
+
+	# Call func by the loop
+	def call(self, func, *args):
+		if threading.get_ident() == self.thread:
+			func(*args)
+		else:
+			self.loop.call_soon_threadsafe(func, *args)
 
-	while True:
+	def onOpen(self, client, userdata, sock):
+		self.call(self.loop.add_reader, sock, client.loop_read)
+
+	def onClose(self, client, userdata, sock):
+		self.call(self.closedSocket, sock)
 
-		if not client_connection:
-			HOST = ''
-			listen_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-			listen_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-			listen_socket.bind((HOST, wport))
-			listen_socket.listen(1)
+	def onRegisterWrite(self, client, userdata, sock):
+		self.call(self.loop.add_writer, sock, client.loop_write)
 
-			if usessl:
-				context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
-				context.load_cert_chain(certfile=certificatefile)  
-				context.options |= ssl.OP_NO_TLSv1 | ssl.OP_NO_TLSv1_1  # optional
-				context.set_ciphers('EECDH+AESGCM:EDH+AESGCM:AES256+EECDH:AES256+EDH')
+	def onUnregisterWrite(self, client, userdata, sock):
+		self.call(self.loop.remove_writer, sock)
 
-			debugFunction (0, 'Serving HTTP on port ' + str(wport) + ', SSL is ' + str(usessl))
+	def closedSocket(self, sock):
+		self.loop.remove_reader(sock)
+		self.loop.remove_writer(sock)
+		self.closed.set()
 
-		conn, client_address = listen_socket.accept()
-		if usessl:
+	async def run(self, mqttHost, mqttPort):
+		self.client.connect_async(mqttHost, mqttPort)
+
+		failures=0
+		while True:
+			self.closed=asyncio.Event()
 			try:
-				client_connection = context.wrap_socket(conn, server_side=True)
+				await runThread(self.client.reconnect)
+				failures=0
+
+				# Keepalive and retries of paho, until the connection is closed
+				while not self.closed.is_set():
+					self.client.loop_misc()
+					try:
+						await asyncio.wait_for(self.closed.wait(), 1)
+					except asyncio.TimeoutError:
+						pass
+
 			except Exception as e:
-				conn.close()
-				client_connection=None
-				debugFunction(0, "SSL-Error: "+ str(e))
+				failures += 1
+				debugFunction(0, "MQTT connect failed (" + str(failures) + "): " + str(e))
 
-		else:
-			client_connection=conn
-		
+			await asyncio.sleep(reconnectDelay(failures))
+
+# Built in web service. The plain and the SSL listener are served by one asyncio loop,
+# every client connection is handled concurrently and kept alive (HTTP/1.1).
+#
+# GET /events is a stream of server-sent events with all changes of ZoneConfig and
+# SourceConfig. It starts with the event snapshot, followed by the events ZoneConfig and
+# SourceConfig with a JSON patch as data. The id of an event is the version of the state.
+# All paths are served for the default device, with the prefix /devices/<name> for a device.
+# Every client has a buffer of eventBuffer events. If a slow client can't keep up, its
+# buffered events are replaced by a new snapshot.
+class WebServer:
+	def __init__(self, backlog=16, timeout=30, eventBuffer=64):
+		self.backlog=backlog
+		self.timeout=timeout # Idle time in seconds before a kept alive connection is closed
+		self.eventBuffer=eventBuffer
+		self.subscribers=defaultdict(set) # Device: queues of the event streams
+		self.loop=None
+
+	async def start(self, port, context=None):
+		await asyncio.start_server(self.handle, '', port, ssl=context, backlog=self.backlog,
+			reuse_address=True, ssl_handshake_timeout=self.timeout if context else None)
+		debugFunction (0, 'Serving HTTP on port ' + str(port) + ', SSL is ' + str(context is not None))
+
+	async def readRequest(self, reader):
+		head=await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), self.timeout)
+		lines=head.decode('iso-8859-1').split('\r\n')
+
+		method, target, version=lines[0].split(' ', 2)
+		headers={}
+		for line in lines[1:]:
+			if ':' in line:
+				name, value=line.split(':', 1)
+				headers[name.strip().lower()]=value.strip()
+
+		length=int(headers.get('content-length', 0))
+		if length > HTTP_BODY_MAX:
+			raise ValueError("request body of " + str(length) + " bytes")
+		body=await asyncio.wait_for(reader.readexactly(length), self.timeout) if length else b''
+
+		return method, target, version, headers, body
+
+	async def handle(self, reader, writer):
 		try:
-			
-			request = client_connection.recv(1024).decode('utf-8', 'ignore')
-			now = datetime.datetime.now()
-			
-			debugFunction(1, request)
-			if re.search(r'^GET /(.*) HTTP', request, 0):  
-				res=re.split(r'^GET /(.*) HTTP', request, 0)
-				result=res[1].lower()
-				
-				debugFunction(1, "Result: " + result)
+			while True:
+				try:
+					method, target, version, headers, body=await self.readRequest(reader)
+				except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError):
+					break
+				except (asyncio.LimitOverrunError, ValueError) as e:
+					debugFunction(0, "WebServer: bad request: " + str(e))
+					writer.write(httpResponse(400, b'', close=True))
+					break
 
-				http_response = "HTTP/1.1 200 OK\nCache-Control: no-cache\nAccess-Control-Allow-Origin: *\nContent-Type: application/json\n\n"
+				debugFunction(1, '%s %s %s', method, target, version)
 
-				if re.search(r'^cmd\?(.*)', result, 0): #GET /cmd?zone=1&source=1?status=1
-					res=re.split(r'^cmd\?(.*)', result, 0); 
-					rc=checkCommand(res[1])
-					http_response = 'HTTP/1.1 ' + str(rc) + ' OK\nAccess-Control-Allow-Origin: *\n\n<html></html>'
+				connection=headers.get('connection', '').lower()
+				close=(connection == 'close' or (version == 'HTTP/1.0' and connection != 'keep-alive'))
 
-					if rc==errno.EPIPE:
-						raise Exception("CheckCommand:Broken Pipe")
-				else:
-					http_response += prepareResponse(result)
+				start=time.perf_counter()
+				request=target[1:].lower()
+				device, path=findDevice(request)
 
-			client_connection.sendall(http_response.encode())
-			client_connection.close()
-			client_connection=None
+				if method == 'GET' and path == 'events' and device:
+					await self.stream(writer, device)
+					break
+
+				status, contenttype, response, etag=await self.dispatch(method, device, path, headers, body)
+				metricHTTP.observe(time.perf_counter() - start, (httpRoute(request),))
+				writer.writelines([httpResponse(status, response, contenttype, close, etag), response])
+				await writer.drain()
+
+				if close:
+					break
 
-				
 		except Exception as e:
 			debugFunction(0, "Error: "+ str(e))
-			client_connection=None
 
-		
+		finally:
+			writer.close()
+
+	# Send server-sent events until the client disconnects
+	async def stream(self, writer, device):
+		queue=asyncio.Queue(self.eventBuffer)
+		self.subscribers[device].add(queue)
+		debugFunction(1, "WebServer: event stream opened, subscribers: " + str(len(self.subscribers[device])))
+
+		try:
+			writer.write(b'HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nCache-Control: no-cache\r\n' \
+				b'Access-Control-Allow-Origin: *\r\nConnection: close\r\n\r\n')
+			writer.write(self.snapshotEvent(device))
+			await writer.drain()
+
+			while True:
+				try:
+					event=await asyncio.wait_for(queue.get(), self.timeout)
+				except asyncio.TimeoutError:
+					event=b': keepalive\n\n'
+
+				if event is None: # Buffer overflow, start again with a snapshot
+					event=self.snapshotEvent(device)
+
+				writer.write(event)
+				await writer.drain()
+
+		except (ConnectionError, OSError) as e:
+			debugFunction(1, "WebServer: event stream closed: " + str(e))
+
+		finally:
+			self.subscribers[device].discard(queue)
+
+	def snapshotEvent(self, device):
+		State=device.state
+		return State.encode('events', lambda: 'event: snapshot\nid: ' + str(State.version) + \
+			'\ndata: { "ZoneConfig": ' + json.dumps(State.zonesJSON()) + ', "SourceConfig": ' + json.dumps(State.sourcesJSON()) + '}\n\n')
+
+	# Publisher listener of a device, called by the Russound thread
+	def broadcast(self, device, name, patch):
+		if not self.loop:
+			return
+
+		if self.subscribers[device]:
+			event=('event: ' + name + '\nid: ' + str(device.state.version) + '\ndata: ' + json.dumps(patch) + '\n\n').encode()
+		else:
+			event=None
+		self.loop.call_soon_threadsafe(self.deliver, device, event)
+
+	# Version of a state changed without a patch, e.g. System.status, called by any thread
+	def touched(self):
+		if self.loop:
+			self.loop.call_soon_threadsafe(self.deliver, None, None)
+
+	def deliver(self, device, event):
+		# Wake up all long polls
+		self.changed.set()
+		self.changed=asyncio.Event()
+
+		if event is None:
+			return
+
+		for queue in self.subscribers[device]:
+			try:
+				queue.put_nowait(event)
+			except asyncio.QueueFull:
+				debugFunction(1, "WebServer: event buffer overflow, send snapshot")
+				while not queue.empty():
+					queue.get_nowait()
+				queue.put_nowait(None)
+
+	# Returns status, content type, encoded body and ETag of the response of a device
+	async def dispatch(self, method, device, request, headers, body):
+		debugFunction(1, "Result: %s", request)
+
+		if device is None: # Unknown device
+			return 404, None, b'', None
+
+		if method == 'POST' and request.partition('?')[0] == 'cmd': # POST /cmd with a JSON list of commands
+			status, results=batchCommand(body, device)
+			return status, 'application/json', batchResponse(status, results), None
+
+		if method != 'GET':
+			return 405, None, b'', None
+
+		if re.search(r'^cmd\?(.*)', request, 0): #GET /cmd?zone=1&source=1?status=1
+			res=re.split(r'^cmd\?(.*)', request, 0); 
+			rc=checkCommand(res[1], device)
+
+			if rc==errno.EPIPE:
+				debugFunction(0, "CheckCommand:Broken Pipe")
+				rc=503
+
+			return rc, 'text/html', b'<html></html>', None
+
+		path, sep, query=request.partition('?')
+		if path == 'metrics':
+			return 200, 'text/plain; version=0.0.4', metrics.render().encode(), None
+
+		State=device.state
+		view, build=findView(path, device)
+		if view is None:
+			if re.search(r'status.*', path, 0) or path == 'devices':
+				return 200, 'application/json', prepareResponse(path, device), None
+			if path.startswith('sources/'): # Unknown source
+				return 404, None, b'', None
+			view, build='all', functools.partial(allResponse, device)
+
+		# Long poll, e.g. GET /zoneconfig?since=1234&timeout=60
+		params=dict(re.findall(r'(\w+)=([\w.+-]+)&?', query))
+		try:
+			since=int(params.get('since', -1))
+			timeout=min(float(params.get('timeout', self.timeout)), LONGPOLL_MAX)
+		except ValueError:
+			return 400, None, b'', None
+
+		if since >= 0:
+			deadline=self.loop.time() + timeout
+			while State.version <= since and self.loop.time() < deadline:
+				try:
+					await asyncio.wait_for(self.changed.wait(), deadline - self.loop.time())
+				except asyncio.TimeoutError:
+					break
+
+		# Conditional GET, the ETag is the version of the state
+		version, response=State.encodeVersion(view, build)
+		etag='"' + str(version) + '"'
+
+		if version <= since or headers.get('if-none-match') == etag:
+			return 304, None, b'', etag
+
+		return 200, 'application/json', response, etag
+
+	# Start the listeners on the running event loop
+	async def serve(self, port, sslPort=None):
+		self.changed=asyncio.Event()
+
+		if port:
+			await self.start(port)
+
+		if sslPort:
+			context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+			context.load_cert_chain(certfile=certificatefile)  
+			context.options |= ssl.OP_NO_TLSv1 | ssl.OP_NO_TLSv1_1  # optional
+			context.set_ciphers('EECDH+AESGCM:EDH+AESGCM:AES256+EECDH:AES256+EDH')
+			await self.start(sslPort, context)
+
+		self.loop=asyncio.get_running_loop()
+
+	# Web service in a thread of its own with an event loop of its own
+	def run(self, port, sslPort=None):
+		loop=asyncio.new_event_loop()
+		asyncio.set_event_loop(loop)
+		loop.run_until_complete(self.serve(port, sslPort))
+		loop.run_forever()
+
+# Route of a request for metricHTTP, only known routes to limit the number of labels
+def httpRoute(request):
+	path, sep, query=request.partition('?')
+	if 'since=' in query:
+		return 'longpoll'
+	device, path=findDevice(path)
+	if path in CACHED_VIEWS or path in ('cmd', 'status', 'metrics', 'devices'):
+		return path
+	if path.startswith('sources/'):
+		return 'sources/zones'
+	return 'other'
+
+# Values of other objects for /metrics
+def collectMetrics():
+	result=[
+		("riod_reconnects_total", "Reconnects to Russound", "counter",
+			[({"device": device.name}, device.reconnects) for device in devices.values()]),
+		("riod_connect_failures_total", "Failed connection attempts to Russound", "counter",
+			[({"device": device.name}, device.connectFailures) for device in devices.values()]),
+		("riod_state_version", "Version of the state", "gauge",
+			[({"device": device.name}, device.state.version) for device in devices.values()]),
+	]
+
+	if sender:
+		status=sender.status()
+		result.append(("riod_send_queue_depth", "Messages waiting for the remote targets", "gauge", [({}, status["QueueDepth"])]))
+		result.append(("riod_send_coalesced_total", "Queued messages replaced by a newer one", "counter", [({}, status["Coalesced"])]))
+		result.append(("riod_publish_failures_total", "Messages dropped or not sent per remote target", "counter",
+			[({"target": target}, count) for target, count in status["Dropped"].items()]))
+
+	if commandWriter:
+		status=commandWriter.status()
+		result.append(("riod_command_queue_depth", "Commands waiting for Russound", "gauge", [({}, status["QueueDepth"])]))
+		result.append(("riod_commands_total", "Commands sent to Russound", "counter", [({}, status["Commands"])]))
+		result.append(("riod_command_writes_total", "Writes of commands to Russound", "counter", [({}, status["Writes"])]))
+
+	if webserver:
+		result.append(("riod_event_subscribers", "Clients of /events", "gauge",
+			[({"device": device.name}, len(webserver.subscribers[device])) for device in devices.values()]))
+
+	status=parseCache.status()
+	result.append(("riod_parse_cache_total", "Lookups of received lines in the parse cache", "counter",
+		[({"result": "hit"}, status["Hits"]), ({"result": "miss"}, status["Misses"])]))
+	result.append(("riod_parse_cache_lines", "Lines in the parse cache", "gauge", [({}, status["Size"])]))
+
+	status=debugLog.status()
+	result.append(("riod_debug_dropped_total", "Debug messages dropped, the debug queue was full", "counter", [({}, status["Dropped"])]))
+
+	if mqttWorkers:
+		status=mqttWorkers.status()
+		result.append(("riod_mqtt_queue_depth", "MQTT requests waiting for a worker", "gauge", [({}, status["QueueDepth"])]))
+		result.append(("riod_mqtt_rejected_total", "MQTT requests rejected, the queue was full", "counter", [({}, status["Rejected"])]))
+
+	captures=[device for device in devices.values() if device.capture]
+	if captures:
+		result.append(("riod_capture_bytes_total", "Bytes written to the capture file", "counter",
+			[({"device": device.name}, device.capture.written) for device in captures]))
+		result.append(("riod_capture_dropped_total", "Records of the capture not written", "counter",
+			[({"device": device.name}, device.capture.dropped) for device in captures]))
+
+	return result
+
+metrics.collectors.append(collectMetrics)
+
+def httpResponse(status, body, contenttype=None, close=False, etag=None):
+	try:
+		reason=HTTPStatus(status).phrase
+	except ValueError:
+		reason='OK'
+
+	head='HTTP/1.1 ' + str(status) + ' ' + reason + '\r\n'
+	if contenttype == 'application/json':
+		head += 'Cache-Control: no-cache\r\n'
+	head += 'Access-Control-Allow-Origin: *\r\n'
+	if contenttype:
+		head += 'Content-Type: ' + contenttype + '\r\n'
+	head += 'Content-Length: ' + str(len(body)) + '\r\n'
+	if etag:
+		head += 'ETag: ' + etag + '\r\n'
+	if close:
+		head += 'Connection: close\r\n'
+
+	return (head + '\r\n').encode()
+
+# Device of a section of the ini file, [Common] for the default device or [Device <name>]
+# with its remote targets in [RemoteTargets] or [RemoteTargets <name>]
+# Returns the device of a section, Russound is required unless the host is given, e.g. by option -r
+def configDevice(config, section, name, topic, targets, host=None):
+	if host is None:
+		host=config.get(section,"Russound")
+
+	try:
+		port=int(config.get(section,"Port"))
+	except:
+		port=9621
+
+	try:
+		controllers=config.get(section,"Controllers").split(',')
+	except:
+		controllers=["1"]
+
+	try:
+		remoteTargets=dict(config.items(targets))
+		debugFunction(2, name + ": remoteTargets: " + json.dumps(remoteTargets))
+	except:
+		remoteTargets={}
+
+	try:
+		topic=config.get(section,"Topic")
+	except:
+		pass
+
+	device=Device(name, host, port, controllers, topic, remoteTargets)
+
+	try:
+		device.ignoresources=list(map(int, config.get(section,"IgnoreSources").split(',')))
+	except:
+		pass
+	debugFunction(2, name + ": IgnoreSources: " + json.dumps(device.ignoresources))
+
+	try:
+		device.ignorezones=list(map(int, config.get(section,"IgnoreZones").split(',')))
+	except:
+		pass
+	debugFunction(2, name + ": IgnoreZones: " + json.dumps(device.ignorezones))
+
+	try:
+		device.stateFile=config.get(section,"StateFile")
+	except:
+		pass
+
+	try:
+		device.macAddr=config.get(section,"MAC")
+	except:
+		pass
+
+	return device
+
 def main(argv):
-	global host, wport, port, SSLPort, usessl, useWeb, useMQTT, debugTarget, debugLevel, macAddr, \
+	global wport, SSLPort, usessl, useWeb, useMQTT, debugTarget, debugLevel, \
 		mqttTopic, mqttHost, mqttPort, mqttUser, mqttPass, usemqttssl, mqttcertificatefile, \
-		remoteTargets, controllers, Channels, DefChannel, ignoresources, ignorezones, certificatefile
+		Channels, DefChannel, certificatefile, defaultDevice, \
+		publishDebounce, publishMaxLatency, publishSnapshotInterval, sender, webserver, commandWriter, \
+		stateInterval, reconnectInitial, reconnectMax, wolAfter, mqttWorkers, eventLoop
 	
+	parser = optparse.OptionParser()
+	parser.add_option('-d', '--debug',
+		dest="debugLevel",
+		default=0,
+		action="store",
+		type="int",
+	)
+	parser.add_option('-t', '--target',
+		dest="debugTarget",
+		default=0,
+		action="store",
+		type="int",
+	)
+	parser.add_option('-r', '--russound',
+		dest="russound",
+		action="store",
+		type="string",
+	)
+	parser.add_option('-w', '--wport',
+		dest="wport",
+		action="store",
+		type="int",
+	)
+	parser.add_option('--sslport',
+		dest="sslport",
+		action="store",
+		type="int",
+	)
+	parser.add_option('-p', '--port',
+		dest="port",
+		action="store",
+		type="int",
+	)
+	parser.add_option('-s', '--usessl',
+		dest="usessl",
+		action="store",
+		type="int",
+	)
+	parser.add_option('-m', '--mac',
+		dest="mac",
+		action="store",
+		type="string",
+	)
+	parser.add_option('-c', '--config',
+		dest="config",
+		action="store",
+		type="string",
+	)
+
+	options, remainder = parser.parse_args()
+
 	config = configparser.ConfigParser()
 	config.optionxform = str
-	config.read([os.path.dirname(os.path.realpath(__file__)) + '/riod.ini', '/etc/riod.ini', '/usr/local/etc/riod.ini'])
+	if options.config is not None:
+		config.read(options.config)
+	else:
+		config.read([os.path.dirname(os.path.realpath(__file__)) + '/riod.ini', '/etc/riod.ini', '/usr/local/etc/riod.ini'])
+
+	try:
+		publishDebounce=float(config.get("Publish","Debounce"))
+	except:
+		publishDebounce=0
+
+	try:
+		publishMaxLatency=float(config.get("Publish","MaxLatency"))
+	except:
+		publishMaxLatency=0.5
+
+	try:
+		publishSnapshotInterval=float(config.get("Publish","SnapshotInterval"))
+	except:
+		publishSnapshotInterval=300
 
 	try:
-		remoteTargets=dict(config.items('RemoteTargets'))
-		debugFunction(2, "remoteTargets: " + json.dumps(remoteTargets))
+		queueSize=int(config.get("Publish","QueueSize"))
 	except:
-		remoteTargets=[]
+		queueSize=256
+
+	try:
+		overflow=config.get("Publish","Overflow").lower()
+	except:
+		overflow="drop-oldest"
+
+	sender=NetworkSender(queueSize, overflow)
+	commandWriter=CommandWriter()
 
 	try:
 		Channels=dict(config.items('Channels'))
@@ -742,24 +3102,44 @@ def main(argv):
 		DefChannel = ""
 			
 	try:
-		ignoresources=config.get("Common","IgnoreSources").split(',')
-		ignoresources = list(map(int, ignoresources))
+		stateInterval=float(config.get("Common","StateInterval"))
+	except:
+		stateInterval=60
+
+	try:
+		reconnectInitial=float(config.get("Common","ReconnectDelay"))
 	except:
-		ignoresources=[]
-	debugFunction(2, "IgnoreSources: " + json.dumps(ignoresources))
+		reconnectInitial=0.5
 
+	try:
+		reconnectMax=float(config.get("Common","ReconnectMaxDelay"))
+	except:
+		reconnectMax=60
+
+	try:
+		wolAfter=int(config.get("Common","WOLAfter"))
+	except:
+		wolAfter=3
+
+	try:
+		useEventLoop=int(config.get("Common","EventLoop"))
+	except:
+		useEventLoop=1
+
+	try:
+		parseCache.size=int(config.get("Common","ParseCache"))
+	except:
+		pass
 	
 	try:
-		ignorezones=config.get("Common","IgnoreZones").split(',')
-		ignorezones=list(map(int, ignorezones))
+		captureSize=int(config.get("Capture","MaxSize"))
 	except:
-		ignorezones=[]
-	debugFunction(2, "IgnoreZones: " + json.dumps(ignorezones))
+		captureSize=10485760
 
 	try:
-		macAddr = config.get("Common","MAC")
+		captureFiles=int(config.get("Capture","Files"))
 	except:
-		maxAddr=None
+		captureFiles=3
 	
 	try:
 		useWeb=int(config.get("Webserver","EnableWeb"))
@@ -774,8 +3154,27 @@ def main(argv):
 			SSLPort=int(config.get("Webserver","SSLPort"))		
 			debugFunction(0, "SSL port missing in ini - fallback to http")
 	except:
-		usesll=0
+		usessl=0
 
+	try:
+		webBacklog=int(config.get("Webserver","Backlog"))
+	except:
+		webBacklog=16
+
+	try:
+		webTimeout=float(config.get("Webserver","KeepAliveTimeout"))
+	except:
+		webTimeout=30
+
+	try:
+		eventBuffer=int(config.get("Webserver","EventBuffer"))
+	except:
+		eventBuffer=64
+
+	webserver=WebServer(webBacklog, webTimeout, eventBuffer)
+
+	mqttTopic=MQTT_TOPIC_DEFAULT
+	useAttributes=0
 	try:
 		useMQTT=int(config.get("MQTT","EnableMQTT"))
 
@@ -801,84 +3200,89 @@ def main(argv):
 					debugFunction(0, "MQTT Certificate file is missing in ini")
 			except:
 				usemqttssl=0
+
+			try:
+				workers=int(config.get("MQTT","Workers"))
+			except:
+				workers=4
+
+			try:
+				requestQueue=int(config.get("MQTT","QueueSize"))
+			except:
+				requestQueue=64
+
+			mqttWorkers=MQTTWorkers(workers, requestQueue)
+
+			try:
+				useAttributes=int(config.get("MQTT","Attributes"))
+			except:
+				useAttributes=0
+
+			qos={}
+			for name, default in (("QoSZone", 1), ("QoSSource", 1), ("QoSMedia", 0)):
+				try:
+					qos[name]=int(config.get("MQTT",name))
+				except:
+					qos[name]=default
 		
 	except:
 		useMQTT=0
 
+	# The default device of [Common], further devices of the sections [Device <name>]
+	try:
+		name=config.get("Common","Name")
+	except:
+		name="default"
 
-	controllers=config.get("Common","Controllers").split(',')	
-	host=config.get("Common","Russound")
-	port=int(config.get("Common","Port"))
-	wport=int(config.get("Webserver","Port"))
-	
-	parser = optparse.OptionParser()
-	parser.add_option('-d', '--debug',
-		dest="debugLevel",
-		default=0,
-		action="store",
-		type="int",
-	)
-	parser.add_option('-t', '--target',
-		dest="debugTarget",
-		default=0,
-		action="store",
-		type="int",
-	)
-	parser.add_option('-r', '--russound',
-		dest="russound",
-		action="store",
-		type="string",
-	)
-	parser.add_option('-w', '--wport',
-		dest="wport",
-		action="store",
-		type="int",
-	)
-	parser.add_option('--sslport',
-		dest="sslport",
-		action="store",
-		type="int",
-	)
-	parser.add_option('-p', '--port',
-		dest="port",
-		action="store",
-		type="int",
-	)
-	parser.add_option('-s', '--usessl',
-		dest="usessl",
-		action="store",
-		type="int",
-	)
-	parser.add_option('-m', '--mac',
-		dest="mac",
-		action="store",
-		type="string",
-	)
+	try:
+		defaultDevice=configDevice(config, "Common", name, mqttTopic, "RemoteTargets", options.russound)
+	except configparser.Error:
+		print('Russound address not given')
+		sys.exit(2)
 
-	options, remainder = parser.parse_args()
+	try:
+		defaultDevice.capture=config.get("Capture","File")
+	except:
+		pass
+
+	if options.mac is not None:
+		defaultDevice.macAddr=options.mac
+	if options.port is not None:
+		defaultDevice.port=options.port
+	devices[defaultDevice.name.lower()]=defaultDevice
+
+	for section in config.sections():
+		if not section.startswith("Device "):
+			continue
+
+		name=section[len("Device "):].strip()
+		if name.lower() in devices or not re.match(r'[\w-]+$', name):
+			print('Device name ' + name + ' is not unique or invalid')
+			sys.exit(2)
+
+		device=configDevice(config, section, name, mqttTopic + '/' + name, "RemoteTargets " + name)
+		try:
+			device.capture=config.get(section,"Capture")
+		except:
+			pass
+		devices[name.lower()]=device
+
+	for device in devices.values():
+		if device.capture:
+			device.capture=CaptureLog(device.capture, captureSize, captureFiles)
+			device.framer.capture=device.capture
+
+		if useMQTT and useAttributes:
+			device.attributes=AttributePublisher(device.topic, device.state, qos["QoSZone"], qos["QoSSource"], qos["QoSMedia"])
+
+	wport=int(config.get("Webserver","Port"))
 	
-	if options.russound is not None:
-		host=options.russound
 	if options.wport is not None:
 		wport=options.wport
-	if options.mac is not None:
-		macAddr=options.mac
-	if options.port is not None:
-		port=options.port
 	if options.sslport is not None:
 		SSLPort=options.sslport
 	if options.usessl is not None:
 		usessl=options.usessl
-
-	if controllers is None:
-		controllers=["1"]
-		
-	if host is None:
-		print('Russound address not given')
-		sys.exit(2)
-		
-	if port is None:
-		port=9621
 		
 	if wport is None:
 		print('Webserver Port not given')
@@ -887,61 +3291,111 @@ def main(argv):
 	debugLevel=options.debugLevel
 	debugTarget=options.debugTarget
 
-	debugFunction(1, "Russound address: " + host + ", Port: " + str(port))
 	debugFunction(1, "Webserver Port: " + str(wport))
 	debugFunction(1, "SSL: " + str(usessl))
 	debugFunction(1, "Webserver: " + str(useWeb))
+	debugFunction(1, "Webserver Backlog: " + str(webBacklog) + ", KeepAliveTimeout: " + str(webTimeout))
+	debugFunction(1, "Event loop: " + str(useEventLoop))
+	debugFunction(1, "Parse cache: " + str(parseCache.size))
 	debugFunction(1, "MQTT: " + str(useMQTT))
 
 	if useMQTT == 1:
 		debugFunction(1, "MQTT Host: " + mqttHost)
 		debugFunction(1, "MQTT Port: " + str(mqttPort))
 		debugFunction(1, "MQTT Topic: " + mqttTopic)
-		debugFunction(1, "MQTT User: " + mqttUser)
-		debugFunction(1, "MQTT Pass: " + mqttPass)
+		debugFunction(1, "MQTT User: %s", mqttUser)
+		debugFunction(1, "MQTT Pass: %s", mqttPass)
+		debugFunction(1, "MQTT Workers: " + str(mqttWorkers.workers) + ", QueueSize: " + str(mqttWorkers.queueSize))
+		if useAttributes:
+			debugFunction(1, "MQTT Attributes: QoSZone " + str(qos["QoSZone"]) + ", QoSSource " + \
+				str(qos["QoSSource"]) + ", QoSMedia " + str(qos["QoSMedia"]))
 
 	if usessl:
 		debugFunction(1, "SSL Webserver Port: " + str(SSLPort))
 		debugFunction(1, "Certificate: " + certificatefile)
 
-	debugFunction(1, "Controller : " + json.dumps(controllers))
-
-	debugFunction(1, "IgnoreZone : " + json.dumps(ignorezones))
-	debugFunction(1, "IgnoreSource : " + json.dumps(ignoresources))
-	debugFunction(1, "remote Target : " + json.dumps(remoteTargets))
+	for device in devices.values():
+		debugFunction(1, "Device " + device.name + ": Russound address: " + device.host + ", Port: " + str(device.port) + \
+			", Topic: " + device.topic)
+		debugFunction(1, "Device " + device.name + ": Controller : " + json.dumps(device.controllers))
+		debugFunction(1, "Device " + device.name + ": IgnoreZone : " + json.dumps(device.ignorezones))
+		debugFunction(1, "Device " + device.name + ": IgnoreSource : " + json.dumps(device.ignoresources))
+		debugFunction(1, "Device " + device.name + ": remote Target : " + json.dumps(device.remoteTargets))
+		debugFunction(1, "Device " + device.name + ": State file : " + str(device.stateFile))
+		if device.capture:
+			debugFunction(1, "Device " + device.name + ": Capture : " + device.capture.filename + \
+				", MaxSize: " + str(device.capture.maxSize) + ", Files: " + str(device.capture.files))
+
+	debugFunction(1, "Publish Debounce : " + str(publishDebounce) + ", MaxLatency: " + str(publishMaxLatency) + \
+		", SnapshotInterval: " + str(publishSnapshotInterval))
+	debugFunction(1, "Send Queue : " + str(sender.queueSize) + ", Coalesce: " + str(sender.coalesce))
+	debugFunction(1, "State Interval: " + str(stateInterval))
+	debugFunction(1, "Reconnect Delay : " + str(reconnectInitial) + ", MaxDelay: " + str(reconnectMax) + \
+		", WOLAfter: " + str(wolAfter))
+
+	for device in devices.values():
+		if device.stateFile:
+			device.loadState()
+
+	if useEventLoop:
+		eventLoop=EventLoop(list(devices.values()))
 
 	
 if __name__ == "__main__":
+	t6 = threading.Thread(target=debugLog.run)
+	t6.daemon = True
+	t6.start()
+
 	main(sys.argv[1:])
 
-t1 = threading.Thread(target=watchRussound, args=(host, port, remoteTargets))
-t2 = threading.Thread(target=WebService, args=(0, wport))
+	for device in devices.values():
+		if device.capture:
+			t7 = threading.Thread(target=device.capture.run)
+			t7.daemon = True
+			t7.start()
 
-startdate=datetime.datetime.now()
-	
-t1.daemon = True
-t1.start()
+	startdate=datetime.datetime.now()
 
-if useWeb:
-	debugFunction(1, "Starting Web-Service...")
+	if eventLoop:
+		if useMQTT == 1:
+			mqttWorkers.start()
 
-	t2.daemon = True
-	t2.start()
+		asyncio.run(eventLoop.run(wport if useWeb else None, SSLPort if usessl == 1 else None,
+			(mqttHost, mqttPort, mqttUser, mqttPass) if useMQTT == 1 else None, stateInterval))
+		sys.exit(0)
 
-if useMQTT == 1:
-	debugFunction(1, "Starting MQTT-Service...")
+	t0 = threading.Thread(target=sender.run)
+	t0.daemon = True
+	t0.start()
 
-	t3 = threading.Thread(target=MQTTService, args=(mqttHost, mqttPort, mqttTopic, mqttUser, mqttPass))
-	t3.start()
+	t5 = threading.Thread(target=commandWriter.run)
+	t5.daemon = True
+	t5.start()
 
+	stateDevices=[device for device in devices.values() if device.stateFile]
+	if stateDevices:
+		t4 = threading.Thread(target=StateService, args=(stateDevices, stateInterval))
+		t4.daemon = True
+		t4.start()
 
-if usessl == 1:
-	debugFunction(1, "Starting SSL-Service...")
+	t1 = threading.Thread(target=watchRussound, args=(list(devices.values()),))
 
-	t4 = threading.Thread(target=WebService, args=(1, SSLPort))
-	t4.start()	
+	t1.daemon = True
+	t1.start()
 
+	if useWeb or usessl == 1:
+		debugFunction(1, "Starting Web-Service...")
+
+		t2 = threading.Thread(target=webserver.run, args=(wport if useWeb else None, SSLPort if usessl == 1 else None))
+		t2.daemon = True
+		t2.start()
+
+	if useMQTT == 1:
+		debugFunction(1, "Starting MQTT-Service...")
+		mqttWorkers.start()
 
-t1.join()
+		t3 = threading.Thread(target=MQTTService, args=(mqttHost, mqttPort, mqttUser, mqttPass))
+		t3.start()
 
 
+	t1.join()